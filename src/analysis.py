@@ -1,20 +1,41 @@
-from dotenv import load_dotenv
-from utils import setup_logger, setup_flask_app, init_db
-from models import WeatherData, WeatherStats
-from sqlalchemy import func, extract, case
+import argparse
+import time
+from datetime import date
+from flask import Flask
+from utils import create_db_app, setup_logger
+from metrics import instrument_engine, phase, record_rows, write_job_metrics
+from typing import List, Optional, Tuple
+from models import (
+    db,
+    DataGeneration,
+    StationVersion,
+    WeatherData,
+    WeatherRowCount,
+    WeatherStats,
+    WeatherStatsMonthly,
+    WeatherStatsPending,
+    WeatherStatsSeasonal,
+)
+from sqlalchemy import (
+    Integer,
+    and_,
+    case,
+    cast,
+    delete,
+    extract,
+    func,
+    or_,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy_utils import database_exists, create_database
-from typing import List, Tuple
-
-# Load environment variables
-load_dotenv(override=True)
+from station_cache import load_station, refresh_stations, station_rollups
 
 # Setup logger
 logger = setup_logger("weather_analysis.log")
 
-# Create and configure Flask app
-app = setup_flask_app()
-db = init_db(app)
-
 
 def create_weather_stats_table() -> None:
     """
@@ -22,87 +43,547 @@ def create_weather_stats_table() -> None:
     This function ensures that the necessary table for storing weather
     statistics is available.
     """
-    with app.app_context():
-        if not database_exists(db.engine.url):
-            create_database(db.engine.url)
-            logger.info(f"Created database: {db.engine.url}")
+    if not database_exists(db.engine.url):
+        create_database(db.engine.url)
+        logger.info(f"Created database: {db.engine.url}")
+
+    WeatherStats.__table__.create(db.engine, checkfirst=True)
+    logger.info("WeatherStats table created (if it didn't exist)")
+
+    for model in (WeatherStatsMonthly, WeatherStatsSeasonal):
+        model.__table__.create(db.engine, checkfirst=True)
+    logger.info("Rollup tables created (if they didn't exist)")
+
+    WeatherStatsPending.__table__.create(db.engine, checkfirst=True)
+    logger.info("WeatherStatsPending table created (if it didn't exist)")
+
+    DataGeneration.__table__.create(db.engine, checkfirst=True)
+    logger.info("DataGeneration table created (if it didn't exist)")
 
-        WeatherStats.__table__.create(db.engine, checkfirst=True)
-        logger.info("WeatherStats table created (if it didn't exist)")
+    StationVersion.__table__.create(db.engine, checkfirst=True)
+    logger.info("StationVersion table created (if it didn't exist)")
 
+    ensure_stats_unique_key()
 
-def calculate_annual_stats() -> None:
+
+STATS_UNIQUE_KEY = text(
+    "SELECT 1 FROM pg_indexes "
+    "WHERE tablename = 'weather_stats' AND indexname = 'uix_station_year'"
+)
+
+
+def ensure_stats_unique_key() -> None:
     """
-    Calculate annual weather statistics for each station and year.
+    Make sure weather_stats has a unique key on (station_id, year).
 
-    This function computes the average maximum temperature, average
-    minimum temperature, and total precipitation for each weather
-    station and year. The results are stored in the WeatherStats table.
-    If a statistic cannot be calculated, NULL is used.
+    Tables created before the key existed may hold duplicate rows left
+    behind by earlier runs; only the newest row per station-year is kept
+    before the unique index is added. Tables that already have the key
+    are left alone, so the dedupe scan runs once rather than every run.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return
+    # A unique constraint is backed by an index of the same name, so this
+    # finds the key whether create() or an earlier run added it.
+    if db.session.execute(STATS_UNIQUE_KEY).scalar() is not None:
+        return
+    db.session.execute(
+        text(
+            "DELETE FROM weather_stats a USING weather_stats b "
+            "WHERE a.station_id = b.station_id AND a.year = b.year "
+            "AND a.id < b.id"
+        )
+    )
+    db.session.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uix_station_year "
+            "ON weather_stats (station_id, year)"
+        )
+    )
+    db.session.commit()
+
+
+ROLLUP_COLUMNS = [
+    "avg_max_temp",
+    "avg_min_temp",
+    "total_precipitation",
+    "max_temp_days",
+    "min_temp_days",
+    "precipitation_days",
+]
 
-    The function uses SQLAlchemy's functionality to perform efficient
-    database operations.
+
+def season_of(month):
+    """
+    Return SQL expressions for the meteorological season of a month and
+    the year that season is attributed to (December counts towards the
+    following year's winter).
     """
-    create_weather_stats_table()
+    season = case(
+        (month.in_([12, 1, 2]), "winter"),
+        (month.in_([3, 4, 5]), "spring"),
+        (month.in_([6, 7, 8]), "summer"),
+        else_="fall",
+    )
+    offset = case((month == 12, 1), else_=0)
+    return season, offset
 
-    with app.app_context():
-        logger.info("Starting annual statistics calculation")
-
-        stats: List[Tuple] = (
-            db.session.query(
-                WeatherData.station_id,
-                extract("year", WeatherData.date).label("year"),
-                func.avg(
-                    case(
-                        (
-                            WeatherData.max_temp.isnot(None),
-                            WeatherData.max_temp,
-                        )
-                    )
-                ).label("avg_max_temp"),
-                func.avg(
-                    case(
-                        (
-                            WeatherData.min_temp.isnot(None),
-                            WeatherData.min_temp,
-                        )
-                    )
-                ).label("avg_min_temp"),
-                func.sum(
-                    case(
-                        (
-                            WeatherData.precipitation.isnot(None),
-                            WeatherData.precipitation,
-                        )
-                    )
-                ).label("total_precipitation"),
-            )
-            .group_by(
-                WeatherData.station_id, extract("year", WeatherData.date)
+
+def rollup_columns(source, grouped: bool = True) -> List:
+    """
+    Build the statistic columns of a rollup from the monthly partial sums.
+
+    Averages are recombined as sum / valid days rather than as averages
+    of averages, so they match a direct aggregation over the daily rows.
+
+    Args:
+        source: Monthly partial sums (the "monthly" CTE)
+        grouped: Whether the rollup groups several months per row
+
+    Returns:
+        Labelled columns matching ROLLUP_COLUMNS
+    """
+
+    def total(column):
+        return func.sum(column) if grouped else column
+
+    def days(column):
+        return cast(total(column), Integer)
+
+    return [
+        (
+            total(source.c.max_temp_sum)
+            / func.nullif(total(source.c.max_temp_days), 0)
+        ).label("avg_max_temp"),
+        (
+            total(source.c.min_temp_sum)
+            / func.nullif(total(source.c.min_temp_days), 0)
+        ).label("avg_min_temp"),
+        total(source.c.precipitation_sum).label("total_precipitation"),
+        days(source.c.max_temp_days).label("max_temp_days"),
+        days(source.c.min_temp_days).label("min_temp_days"),
+        days(source.c.precipitation_days).label("precipitation_days"),
+    ]
+
+
+def upsert(model, keys: List[str], columns: List[str], rows):
+    """
+    Build an INSERT ... SELECT ... ON CONFLICT DO UPDATE of rows into a
+    statistics table, returning the ids written.
+    """
+    stmt = insert(model).from_select(keys + columns, rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={column: stmt.excluded[column] for column in columns},
+    )
+    return stmt.returning(model.id)
+
+
+def year_ranges(years: List[int]) -> List[Tuple[int, int]]:
+    """
+    Merge sorted years into (first, last) runs of consecutive years.
+    """
+    ranges: List[Tuple[int, int]] = []
+    for year in years:
+        if ranges and ranges[-1][1] == year - 1:
+            ranges[-1] = (ranges[-1][0], year)
+        else:
+            ranges.append((year, year))
+    return ranges
+
+
+def compute_stats(incremental: bool) -> Tuple[int, int, int]:
+    """
+    Recompute the statistics tables from weather_data in the session's
+    transaction.
+
+    Everything happens in a single statement that scans weather_data
+    once: a CTE aggregates per station and month, and the three
+    INSERT ... SELECT ... ON CONFLICT DO UPDATE writes are derived from
+    it, so no rows are pulled into Python.
+
+    Args:
+        incremental: Only recompute the station-years queued in
+            weather_stats_pending. Their years are read first, so that
+            the statement can restrict weather_data to them by date.
+            Rollups of claimed station-years that no longer have data
+            are deleted.
+
+    Returns:
+        Number of station-years, station-months and station-seasons
+        written
+    """
+    year = cast(extract("year", WeatherData.date), Integer)
+    month = cast(extract("month", WeatherData.date), Integer)
+    monthly = select(
+        WeatherData.station_id,
+        year.label("year"),
+        month.label("month"),
+        func.sum(WeatherData.max_temp).label("max_temp_sum"),
+        func.count(WeatherData.max_temp).label("max_temp_days"),
+        func.sum(WeatherData.min_temp).label("min_temp_sum"),
+        func.count(WeatherData.min_temp).label("min_temp_days"),
+        func.sum(WeatherData.precipitation).label("precipitation_sum"),
+        func.count(WeatherData.precipitation).label("precipitation_days"),
+    ).group_by(WeatherData.station_id, year, month)
+
+    if incremental:
+        years = (
+            db.session.execute(
+                select(WeatherStatsPending.year)
+                .distinct()
+                .order_by(WeatherStatsPending.year)
             )
+            .scalars()
             .all()
         )
+        if not years:
+            return 0, 0, 0
+        # Claim the queued station-years of those years in the same
+        # statement, so anything ingested concurrently stays queued for
+        # the next run
+        claimed = (
+            delete(WeatherStatsPending)
+            .where(WeatherStatsPending.year.in_(years))
+            .returning(
+                WeatherStatsPending.station_id, WeatherStatsPending.year
+            )
+            .cte("claimed")
+        )
+        # Constant date ranges let the planner prune weather_data's
+        # partitions, which bounds taken from the claimed rows don't.
+        # Each range is widened by the neighbouring winter months, so
+        # the winters a claimed year shares with the adjacent years are
+        # recomputed from complete data. A station's months in another
+        # station's pending years are rewritten too, with the same
+        # values.
+        monthly = monthly.where(
+            WeatherData.station_id.in_(select(claimed.c.station_id)),
+            or_(
+                *[
+                    and_(
+                        WeatherData.date >= date(first - 1, 12, 1),
+                        WeatherData.date < date(last + 1, 3, 1),
+                    )
+                    for first, last in year_ranges(years)
+                ]
+            ),
+        )
+    else:
+        db.session.execute(delete(WeatherStatsPending))
 
-        logger.info(
-            f"Calculated statistics for {len(stats)} station-year combinations"
+    monthly = monthly.cte("monthly")
+
+    annual = select(
+        monthly.c.station_id,
+        monthly.c.year,
+        *rollup_columns(monthly)[:3],
+    ).group_by(monthly.c.station_id, monthly.c.year)
+    if incremental:
+        annual = annual.join(
+            claimed,
+            and_(
+                monthly.c.station_id == claimed.c.station_id,
+                monthly.c.year == claimed.c.year,
+            ),
         )
 
-        for stat in stats:
-            weather_stat = WeatherStats(
-                station_id=stat.station_id,
-                year=int(stat.year),
-                avg_max_temp=stat.avg_max_temp,
-                avg_min_temp=stat.avg_min_temp,
-                total_precipitation=stat.total_precipitation,
-            )
-            db.session.merge(weather_stat)
+    season, offset = season_of(monthly.c.month)
+    season_year = monthly.c.year + offset
+    seasonal = select(
+        monthly.c.station_id,
+        season_year.label("year"),
+        season.label("season"),
+        *rollup_columns(monthly),
+    ).group_by(monthly.c.station_id, season_year, season)
+
+    month_rows = select(
+        monthly.c.station_id,
+        monthly.c.year,
+        monthly.c.month,
+        *rollup_columns(monthly, grouped=False),
+    )
+
+    written = [
+        upsert(
+            WeatherStats,
+            ["station_id", "year"],
+            ROLLUP_COLUMNS[:3],
+            annual,
+        ).cte("annual_written"),
+        upsert(
+            WeatherStatsMonthly,
+            ["station_id", "year", "month"],
+            ROLLUP_COLUMNS,
+            month_rows,
+        ).cte("monthly_written"),
+        upsert(
+            WeatherStatsSeasonal,
+            ["station_id", "year", "season"],
+            ROLLUP_COLUMNS,
+            seasonal,
+        ).cte("seasonal_written"),
+    ]
+    if incremental:
+        # A claimed station-year whose rows are all gone (its file was
+        # reloaded without them) produces nothing above, so its old
+        # rollups are deleted instead. The winter that a claimed year's
+        # December counts towards is covered by the same window.
+        claimed_keys = select(claimed.c.station_id, claimed.c.year)
+
+        def claimed_scope(model, year=None):
+            year = model.year if year is None else year
+            return tuple_(model.station_id, year).in_(claimed_keys)
 
-        db.session.commit()
+        written += [
+            delete_stale(
+                WeatherStats,
+                ["station_id", "year"],
+                claimed_scope(WeatherStats),
+                select(monthly.c.station_id, monthly.c.year),
+            ).cte("annual_removed"),
+            delete_stale(
+                WeatherStatsMonthly,
+                ["station_id", "year", "month"],
+                claimed_scope(WeatherStatsMonthly),
+                select(monthly.c.station_id, monthly.c.year, monthly.c.month),
+            ).cte("monthly_removed"),
+            delete_stale(
+                WeatherStatsSeasonal,
+                ["station_id", "year", "season"],
+                or_(
+                    claimed_scope(WeatherStatsSeasonal),
+                    and_(
+                        WeatherStatsSeasonal.season == "winter",
+                        claimed_scope(
+                            WeatherStatsSeasonal, WeatherStatsSeasonal.year - 1
+                        ),
+                    ),
+                ),
+                select(monthly.c.station_id, season_year, season),
+            ).cte("seasonal_removed"),
+        ]
+
+    counts = db.session.execute(
+        select(
+            *[
+                select(func.count()).select_from(cte).scalar_subquery()
+                for cte in written
+            ]
+        )
+    ).one()
+    if sum(counts[3:]):
         logger.info(
-            "Annual statistics calculation completed and stored "
-            "in database"
+            f"Removed {sum(counts[3:])} rollups of station-years without "
+            "data"
         )
+    return tuple(counts[:3])
+
+
+def delete_stale(model, keys: List[str], scope, produced):
+    """
+    Build a DELETE of the rows of a statistics table within scope whose
+    keys are not among those produced by the current run, returning the
+    ids deleted.
+    """
+    key = tuple_(*[getattr(model, name) for name in keys])
+    return (
+        delete(model)
+        .where(scope, key.not_in(produced))
+        .returning(model.id)
+    )
+
+
+def upsert_rows(model, keys: List[str], columns: List[str], rows):
+    """
+    Build an INSERT ... VALUES ... ON CONFLICT DO UPDATE of row tuples
+    (keys then columns) into a statistics table.
+    """
+    stmt = insert(model).values(
+        [dict(zip(keys + columns, row)) for row in rows]
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={column: stmt.excluded[column] for column in columns},
+    )
+
+
+def compute_stats_from_cache(
+    directory: str, incremental: bool
+) -> Tuple[int, int, int]:
+    """
+    Recompute the statistics tables from the station cache in the
+    session's transaction.
+
+    Each station's columns are aggregated with NumPy (see
+    station_cache.station_rollups) instead of scanning weather_data, and
+    replace all of its rollups.
+    Stale cache files are rebuilt first; the pending station-years are
+    claimed before that, so the rebuilt files include every row they
+    were queued for.
+
+    Args:
+        directory: Station cache directory
+        incremental: Only recompute the stations with station-years
+            queued in weather_stats_pending (all of their years, which
+            is as cheap as a few of them from the cache)
+
+    Returns:
+        Number of station-years, station-months and station-seasons
+        written
+    """
+    if incremental:
+        claimed = db.session.execute(
+            delete(WeatherStatsPending).returning(
+                WeatherStatsPending.station_id
+            )
+        ).scalars()
+        station_ids = sorted(set(claimed))
+    else:
+        db.session.execute(delete(WeatherStatsPending))
+        station_ids = (
+            db.session.execute(
+                select(WeatherRowCount.station_id)
+                .distinct()
+                .order_by(WeatherRowCount.station_id)
+            )
+            .scalars()
+            .all()
+        )
+
+    with db.engine.connect() as connection:
+        rebuilt = refresh_stations(connection, directory)
+    logger.info(f"Rebuilt {rebuilt} stale station cache files")
+
+    tables = [
+        ("year", WeatherStats, ["station_id", "year"], ROLLUP_COLUMNS[:3]),
+        (
+            "month",
+            WeatherStatsMonthly,
+            ["station_id", "year", "month"],
+            ROLLUP_COLUMNS,
+        ),
+        (
+            "season",
+            WeatherStatsSeasonal,
+            ["station_id", "year", "season"],
+            ROLLUP_COLUMNS,
+        ),
+    ]
+    written = [0, 0, 0]
+    for station_id in station_ids:
+        series = load_station(directory, station_id)
+        if series is None:
+            logger.warning(f"Station {station_id} is not in the cache")
+            continue
+        rollups = station_rollups(series)
+        for i, (granularity, model, keys, columns) in enumerate(tables):
+            # The cache holds all of the station's rows, so rollups of
+            # periods it no longer has data for are stale
+            db.session.execute(
+                delete(model).where(model.station_id == station_id)
+            )
+            rows = [(station_id, *row) for row in rollups[granularity]]
+            if rows:
+                db.session.execute(upsert_rows(model, keys, columns, rows))
+                written[i] += len(rows)
+    return tuple(written)
+
+
+def calculate_annual_stats(
+    incremental: bool = False,
+    from_cache: bool = False,
+    app: Optional[Flask] = None,
+) -> None:
+    """
+    Calculate annual, monthly and seasonal weather statistics for each
+    station.
+
+    This function computes the average maximum temperature, average
+    minimum temperature, and total precipitation for each weather
+    station and year, month and meteorological season. The results are
+    stored in the WeatherStats, WeatherStatsMonthly and
+    WeatherStatsSeasonal tables; the monthly and seasonal rollups also
+    count the days with valid measurements. If a statistic cannot be
+    calculated, NULL is used.
+
+    Args:
+        incremental: Only recompute the station-years that ingestion
+            queued in weather_stats_pending since the last run. Otherwise
+            every station-year is recomputed.
+        from_cache: Aggregate the station cache (STATION_CACHE_DIR) with
+            NumPy instead of scanning weather_data in SQL
+        app: App whose database to analyse; by default one is created
+            from the configuration with create_db_app()
+
+    Raises:
+        ValueError: If from_cache is set without STATION_CACHE_DIR
+    """
+    app = app or create_db_app()
+    with app.app_context():
+        directory = app.config.get("STATION_CACHE_DIR")
+        if from_cache and not directory:
+            raise ValueError("from_cache needs STATION_CACHE_DIR")
+
+        instrument_engine(db.engine)
+        with phase("analysis", "setup"):
+            create_weather_stats_table()
+
+        with phase("analysis", "compute"):
+            start = time.perf_counter()
+            logger.info(
+                "Starting "
+                f"{'incremental' if incremental else 'full'} "
+                "statistics calculation"
+                f"{' from the station cache' if from_cache else ''}"
+            )
+
+            if from_cache:
+                counts = compute_stats_from_cache(directory, incremental)
+            else:
+                counts = compute_stats(incremental)
+            annual_count, monthly_count, seasonal_count = counts
+            if annual_count or monthly_count or seasonal_count:
+                DataGeneration.bump(db.session)
+
+            logger.info(
+                f"Calculated statistics for {annual_count} station-years, "
+                f"{monthly_count} station-months and {seasonal_count} "
+                "station-seasons"
+            )
+
+            db.session.commit()
+            record_rows(
+                "analysis",
+                time.perf_counter() - start,
+                station_years=annual_count,
+                station_months=monthly_count,
+                station_seasons=seasonal_count,
+            )
+            logger.info(
+                "Statistics calculation completed and stored in database"
+            )
+
+        write_job_metrics("analysis", logger)
 
 
 if __name__ == "__main__":
-    calculate_annual_stats()
+    parser = argparse.ArgumentParser(
+        description="Calculate annual, monthly and seasonal stats"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only recompute station-years changed by ingestion",
+    )
+    parser.add_argument(
+        "--from-cache",
+        action="store_true",
+        help="Aggregate the station cache (STATION_CACHE_DIR) with NumPy",
+    )
+    args = parser.parse_args()
+    calculate_annual_stats(
+        incremental=args.incremental,
+        from_cache=args.from_cache,
+        app=create_db_app(),
+    )
@@ -1,43 +1,144 @@
-from flask import jsonify, request, Response
-from flasgger import Swagger
-from sqlalchemy_utils import database_exists, create_database
-from datetime import datetime
-from dotenv import load_dotenv
-from typing import Dict, Any
+import base64
+import binascii
+import csv
+import io
+import json
+import math
+from functools import lru_cache
+import threading
+from flask import (
+    Blueprint,
+    Flask,
+    current_app,
+    jsonify,
+    request,
+    Response,
+    stream_with_context,
+)
+from sqlalchemy import (
+    Date,
+    any_,
+    bindparam,
+    func,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date
 
-from utils import setup_logger, setup_flask_app, init_db
-from models import WeatherData, WeatherStats
-
-# Load environment variables from .env file
-load_dotenv(override=True)
+from cache import cached_response
+from metrics import instrument_app
+from profiling import instrument_profiling, section
+from columnar import (
+    ARROW_MIMETYPE,
+    MONTHLY_STATS_SCHEMA,
+    SEASONAL_STATS_SCHEMA,
+    STATS_SCHEMA,
+    WEATHER_SCHEMA,
+    to_arrow_stream,
+)
+from compact import create_weather_data_compact
+from partitioning import create_weather_data_table
+from utils import create_db_app, setup_logger
+from models import (
+    db,
+    StationVersion,
+    WeatherData,
+    WeatherRowCount,
+    WeatherStats,
+    WeatherStatsMonthly,
+    WeatherStatsPending,
+    WeatherStatsSeasonal,
+)
 
 # Setup logger for the Flask application
 logger = setup_logger("flask_app.log")
 
-# Initialize Flask app and database
-app = setup_flask_app()
-db = init_db(app)
-swagger = Swagger(app)
+api = Blueprint("api", __name__)
+
+# Path prefixes served by flasgger's blueprint
+SWAGGER_PREFIXES = ("/apidocs", "/apispec", "/flasgger_static")
+
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    """
+    Create the Flask application.
+
+    Creating the app touches neither the database nor flasgger: tables are
+    created with the create-tables command (see create_tables) and the
+    Swagger UI is set up on the first request for it.
+
+    Args:
+        config: Settings overriding the ones from load_config()
+
+    Returns:
+        Configured Flask application
+    """
+    app = create_db_app(config)
+    app.register_blueprint(api)
+    instrument_app(app, db)
+    instrument_profiling(app, db)
+    app.wsgi_app = LazySwagger(app, app.wsgi_app)
+
+    @app.cli.command("create-tables")
+    def create_tables_command():
+        """Create the database and its tables if they don't exist."""
+        create_tables()
+
+    return app
+
+
+class LazySwagger:
+    """
+    WSGI middleware that sets up flasgger on the first request for the
+    API docs, keeping its import and spec parsing out of app start-up.
+    """
+
+    def __init__(self, app: Flask, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """Set up flasgger on the app unless it already is."""
+        with self.lock:
+            if not self.loaded:
+                from flasgger import Swagger
+
+                Swagger(self.app)
+                self.loaded = True
+
+    def __call__(self, environ, start_response):
+        if not self.loaded and environ.get("PATH_INFO", "").startswith(
+            SWAGGER_PREFIXES
+        ):
+            self.load()
+        return self.wsgi_app(environ, start_response)
 
 
 def create_tables():
     """
     Create database and tables if they don't exist.
-    This function is called when the app starts to ensure the database
-    is set up.
+    Run it once per database with `flask create-tables` (FLASK_APP=app)
+    rather than on every start.
     """
-    with app.app_context():
-        if not database_exists(db.engine.url):
-            create_database(db.engine.url)
-            logger.info(f"Created database: {db.engine.url}")
-        db.create_all()
-        logger.info("Database tables created (if they didn't exist)")
-
+    from sqlalchemy_utils import create_database, database_exists
 
-create_tables()
+    if not database_exists(db.engine.url):
+        create_database(db.engine.url)
+        logger.info(f"Created database: {db.engine.url}")
+    create_weather_data_compact(db.engine)
+    create_weather_data_table(db.engine)
+    db.create_all()
+    logger.info("Database tables created (if they didn't exist)")
 
 
-@app.after_request
+@api.after_app_request
 def after_request(response: Response) -> Response:
     """
     Log details of each request after it's processed.
@@ -52,7 +153,17 @@ def after_request(response: Response) -> Response:
     return response
 
 
-def paginate(query, page: int, per_page: int) -> Dict[str, Any]:
+COUNT_MODES = ("exact", "estimate", "none")
+
+
+def paginate(
+    query,
+    page: int,
+    per_page: int,
+    raw: bool = False,
+    count: str = "exact",
+    estimate: Optional[Callable[[], Optional[int]]] = None,
+) -> Dict[str, Any]:
     """
     Paginate the query results.
 
@@ -60,21 +171,500 @@ def paginate(query, page: int, per_page: int) -> Dict[str, Any]:
         query: SQLAlchemy query object
         page: Current page number
         per_page: Number of items per page
+        raw: Return items as fetched instead of as_dict() dicts
+        count: How to fill in total/pages: "exact" runs COUNT(*) over the
+            query, "estimate" calls estimate, "none" leaves them null
+        estimate: Callable returning an estimated total (or None)
 
     Returns:
         Dict containing paginated results and metadata
     """
-    paginated = query.paginate(page=page, per_page=per_page, error_out=False)
+    if count == "exact":
+        paginated = query.paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        items = paginated.items
+        total = paginated.total
+    else:
+        page = max(page, 1)
+        items = query.limit(per_page).offset((page - 1) * per_page).all()
+        total = estimate() if count == "estimate" and estimate else None
+
+    pages = None
+    if total is not None:
+        pages = math.ceil(total / per_page) if per_page > 0 else 0
+    return {
+        "items": items if raw else [item.as_dict() for item in items],
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "pages": pages,
+    }
+
+
+PLANNER_ESTIMATE = text("SELECT reltuples FROM pg_class WHERE relname = :name")
+
+
+def planner_estimate(table_name: str) -> Optional[int]:
+    """
+    Return PostgreSQL's row estimate for a table (pg_class.reltuples), or
+    None if it is unavailable (other databases, or never analyzed).
+    """
+    if db.engine.dialect.name != "postgresql":
+        return None
+    reltuples = db.session.execute(
+        PLANNER_ESTIMATE, {"name": table_name}
+    ).scalar()
+    if reltuples is None or reltuples < 0:
+        return None
+    return int(reltuples)
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """
+    Encode the sort key of the last row on a page as an opaque cursor.
+
+    Args:
+        values: Values of the key columns, in key order
+
+    Returns:
+        URL-safe cursor string
+    """
+    payload = json.dumps(
+        [v.isoformat() if isinstance(v, date) else v for v in values]
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, key_columns: List) -> List[Any]:
+    """
+    Decode a cursor produced by encode_cursor for the given key columns.
+
+    Raises:
+        ValueError: If the cursor is malformed or does not match the key
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(key_columns):
+        raise ValueError("Invalid cursor")
+    for column, value in zip(key_columns, values):
+        # Dates are encoded as ISO strings
+        expected = (
+            str if isinstance(column.type, Date) else column.type.python_type
+        )
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError("Invalid cursor")
+    return [
+        date.fromisoformat(value) if isinstance(column.type, Date) else value
+        for column, value in zip(key_columns, values)
+    ]
+
+
+def keyset_paginate(
+    query,
+    key_columns: List,
+    cursor: Optional[str],
+    per_page: int,
+    raw: bool = False,
+) -> Dict[str, Any]:
+    """
+    Paginate the query results by seeking past the last row seen.
+
+    Unlike paginate(), no OFFSET or COUNT(*) is issued, so every page
+    costs one index range scan on the key columns regardless of depth.
+
+    Args:
+        query: SQLAlchemy query object
+        key_columns: Columns forming a unique sort key for the query
+        cursor: Cursor returned as next_cursor by the previous page, or
+            an empty string for the first page
+        per_page: Number of items per page
+        raw: Return items as fetched instead of as_dict() dicts
+
+    Returns:
+        Dict containing the page of results, and next_cursor (None on the
+        last page)
+
+    Raises:
+        ValueError: If per_page is below 1 or the cursor is invalid
+    """
+    if per_page < 1:
+        raise ValueError("per_page must be at least 1")
+    if cursor:
+        query = query.filter(
+            tuple_(*key_columns) > tuple_(*decode_cursor(cursor, key_columns))
+        )
+    items = query.order_by(*key_columns).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(
+            [getattr(items[-1], column.key) for column in key_columns]
+        )
+    return {
+        "items": items if raw else [item.as_dict() for item in items],
+        "per_page": per_page,
+        "next_cursor": next_cursor,
+    }
+
+
+def wants_arrow(args=None, accept: Optional[MIMEAccept] = None) -> bool:
+    """
+    Whether the client asked for an Arrow IPC stream, either with
+    format=arrow or by preferring ARROW_MIMETYPE in its Accept header.
+
+    Args:
+        args: Query arguments (defaults to the Flask request's)
+        accept: Parsed Accept header (defaults to the Flask request's)
+    """
+    args = request.args if args is None else args
+    accept = request.accept_mimetypes if accept is None else accept
+    if args.get("format") == "arrow":
+        return True
+    best = accept.best_match(["application/json", ARROW_MIMETYPE])
+    return best == ARROW_MIMETYPE
+
+
+# Dates are rendered like Flask's default JSON encoder does; a page only
+# holds a handful of distinct dates, so formatting each once is enough
+_json_date = lru_cache(maxsize=4096)(http_date)
+
+
+def encode_json_page(payload: Dict[str, Any], fields: List[str]) -> bytes:
+    """
+    Encode a page of row tuples as a JSON document.
+
+    This is the fast path for paginated endpoints: rows are zipped with
+    the field names and encoded with orjson, producing the same document
+    as jsonify() over as_dict() without ORM objects or Flask's encoder.
+
+    Args:
+        payload: Pagination result whose items are row tuples
+        fields: Names of the row's columns, in order
+    """
+    import orjson
+
+    items = payload["items"]
+    if items:
+        date_fields = [
+            i for i, value in enumerate(items[0]) if isinstance(value, date)
+        ]
+        if date_fields:
+            rows = []
+            for row in items:
+                row = list(row)
+                for i in date_fields:
+                    if row[i] is not None:
+                        row[i] = _json_date(row[i])
+                rows.append(row)
+            items = rows
+    payload["items"] = [dict(zip(fields, row)) for row in items]
+    return orjson.dumps(payload)
+
+
+def json_page(payload: Dict[str, Any], fields: List[str]) -> Response:
+    """Encode a page of row tuples as a JSON response."""
+    return Response(
+        encode_json_page(payload, fields), mimetype="application/json"
+    )
+
+
+def paginated_response(
+    query,
+    model,
+    schema,
+    key_columns: List,
+    page: int,
+    per_page: int,
+    cursor: Optional[str],
+    estimate: Optional[Callable[[], Optional[int]]] = None,
+):
+    """
+    Paginate a query and encode the page as JSON or as an Arrow stream.
+
+    Only the schema's columns are selected and the page is encoded from
+    the row tuples, skipping ORM objects and as_dict().
+
+    Args:
+        query: SQLAlchemy query object over model
+        model: Model class the query selects
+        schema: Arrow schema of the model's columns
+        key_columns: Columns forming a unique sort key for cursor paging
+        page: Current page number
+        per_page: Number of items per page
+        cursor: Cursor for keyset pagination, or None for page/per_page
+        estimate: Callable returning an estimated total, used when the
+            client passes count=estimate
+
+    Raises:
+        ValueError: If the count argument is not one of COUNT_MODES
+    """
+    count = request.args.get("count", "exact")
+    if count not in COUNT_MODES:
+        raise ValueError(f"Unsupported count: {count}")
+
+    query = query.with_entities(
+        *[getattr(model, name) for name in schema.names]
+    )
+
+    if cursor is not None:
+        payload = keyset_paginate(
+            query, key_columns, cursor, per_page, raw=True
+        )
+    else:
+        payload = paginate(
+            query, page, per_page, raw=True, count=count, estimate=estimate
+        )
+
+    return encode_page(payload, schema)
+
+
+def encode_page(payload: Dict[str, Any], schema) -> Response:
+    """Encode a page of row tuples as JSON or as an Arrow stream."""
+    with section("serialize"):
+        if not wants_arrow():
+            return json_page(payload, schema.names)
+        items = payload.pop("items")
+        return Response(
+            to_arrow_stream(items, schema, payload), mimetype=ARROW_MIMETYPE
+        )
+
+
+# Statistics table, Arrow schema and the column completing the
+# (station_id, year) sort key for each /api/weather/stats granularity
+STATS_GRANULARITIES = {
+    "year": (WeatherStats, STATS_SCHEMA, None),
+    "month": (WeatherStatsMonthly, MONTHLY_STATS_SCHEMA, "month"),
+    "season": (WeatherStatsSeasonal, SEASONAL_STATS_SCHEMA, "season"),
+}
+
+
+def requested_station_ids(args=None) -> List[str]:
+    """Return the station IDs given as repeated or comma-separated args."""
+    args = request.args if args is None else args
+    return [
+        station_id
+        for value in args.getlist("station_id")
+        for station_id in value.split(",")
+        if station_id
+    ]
+
+
+def row_count_scope(
+    start_arg: str = "start_date", end_arg: str = "end_date", args=None
+) -> Tuple[List[str], Optional[date], Optional[date]]:
+    """
+    Return the stations and the inclusive date range a weather request
+    covers, for estimating its total from weather_row_counts.
+    """
+    args = request.args if args is None else args
+    exact_date = args.get("date")
+    start = exact_date or args.get(start_arg)
+    end = exact_date or args.get(end_arg)
+    return (
+        requested_station_ids(args),
+        date.fromisoformat(start) if start else None,
+        date.fromisoformat(end) if end else None,
+    )
+
+
+def row_count_query(
+    station_ids: List[str], start: Optional[date], end: Optional[date]
+):
+    """Select the weather_row_counts totals per year for a request."""
+    stmt = select(
+        WeatherRowCount.year, func.sum(WeatherRowCount.row_count)
+    ).group_by(WeatherRowCount.year)
+    if station_ids:
+        stmt = stmt.where(WeatherRowCount.station_id.in_(station_ids))
+    if start:
+        stmt = stmt.where(WeatherRowCount.year >= start.year)
+    if end:
+        stmt = stmt.where(WeatherRowCount.year <= end.year)
+    return stmt
+
+
+def estimate_weather_total(
+    start_arg: str = "start_date", end_arg: str = "end_date"
+) -> Optional[int]:
+    """
+    Estimate how many weather_data rows match the request's filters.
+
+    Totals come from weather_row_counts, which ingestion maintains per
+    station and year: years fully inside the date range count exactly and
+    partially covered years are prorated by the number of days covered.
+    Without that summary, unfiltered requests fall back to the planner's
+    estimate.
+
+    Args:
+        start_arg: Name of the query argument holding the first date
+        end_arg: Name of the query argument holding the last date
+    """
+    station_ids, start, end = row_count_scope(start_arg, end_arg)
+    per_year = db.session.execute(
+        row_count_query(station_ids, start, end)
+    ).all()
+
+    if not per_year:
+        if station_ids or start or end:
+            return None
+        return planner_estimate(WeatherData.__tablename__)
+    return prorate_row_counts(per_year, start, end)
+
+
+def prorate_row_counts(
+    per_year: List[Tuple[int, int]],
+    start: Optional[date],
+    end: Optional[date],
+) -> int:
+    """
+    Sum per-year row counts over an inclusive date range, prorating the
+    partially covered years by the number of days covered.
+    """
+    total = 0.0
+    for year, rows in per_year:
+        first, last = date(year, 1, 1), date(year, 12, 31)
+        covered = (min(end or last, last) - max(start or first, first)).days
+        total += rows * (covered + 1) / ((last - first).days + 1)
+    return round(total)
+
+
+def station_cache_page(
+    page: int, per_page: int, cursor: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Serve a single-station /api/weather page from the station cache.
+
+    The date filters become binary searches on the station's mapped date
+    column and the page is sliced out of the mapped columns, so only the
+    rows on the page are read. Totals are exact whatever count asks for.
+
+    Args:
+        page: Current page number
+        per_page: Number of items per page
+        cursor: Cursor for keyset pagination, or None for page/per_page
+
+    Returns:
+        The page, shaped like paginate() or keyset_paginate() with
+        raw=True, or None if the request isn't for exactly one station,
+        the cache is off, or the station's file is missing or stale
+
+    Raises:
+        ValueError: If the count argument is not one of COUNT_MODES, a
+            date is not an ISO date, or the cursor or (with a cursor)
+            per_page is invalid
+    """
+    directory = current_app.config.get("STATION_CACHE_DIR")
+    station_ids = requested_station_ids()
+    if not directory or len(station_ids) != 1:
+        return None
+    # Imported here so that NumPy is only loaded when the cache is on
+    from station_cache import date_range, load_station, station_rows
+
+    station_id = station_ids[0]
+    series = load_station(directory, station_id)
+    if series is None:
+        return None
+    if StationVersion.current(db.session, station_id) != series.data_version:
+        return None
+
+    count = request.args.get("count", "exact")
+    if count not in COUNT_MODES:
+        raise ValueError(f"Unsupported count: {count}")
+    _, start, end = row_count_scope()
+    first, stop = date_range(series, start, end)
+
+    if cursor is not None:
+        if per_page < 1:
+            raise ValueError("per_page must be at least 1")
+        if cursor:
+            after_station, after_date = decode_cursor(
+                cursor, [WeatherData.station_id, WeatherData.date]
+            )
+            if after_station > station_id:
+                first = stop
+            elif after_station == station_id:
+                after, _ = date_range(
+                    series, after_date + timedelta(days=1), None
+                )
+                first = max(first, min(after, stop))
+        items = station_rows(
+            series, station_id, first, min(first + per_page + 1, stop)
+        )
+        next_cursor = None
+        if len(items) > per_page:
+            items = items[:per_page]
+            next_cursor = encode_cursor([station_id, items[-1][2]])
+        return {
+            "items": items,
+            "per_page": per_page,
+            "next_cursor": next_cursor,
+        }
+
+    page = max(page, 1)
+    if per_page < 0:
+        per_page = 20
+    offset = min(first + (page - 1) * per_page, stop)
+    total = None if count == "none" else stop - first
+    pages = None
+    if total is not None:
+        pages = math.ceil(total / per_page) if per_page > 0 else 0
     return {
-        "items": [item.as_dict() for item in paginated.items],
-        "total": paginated.total,
+        "items": station_rows(
+            series, station_id, offset, min(offset + per_page, stop)
+        ),
+        "total": total,
         "page": page,
         "per_page": per_page,
-        "pages": paginated.pages,
+        "pages": pages,
     }
 
 
-@app.route("/api/weather", methods=["GET"])
+def weather_filters(
+    start_arg: str = "start_date", end_arg: str = "end_date", args=None
+) -> List:
+    """
+    Build the WHERE clauses shared by the weather data endpoints from the
+    request's query string.
+
+    station_id may be repeated or comma-separated to select several
+    stations. The date range is inclusive and, together with station_id,
+    matches the (station_id, date) and (date, station_id) indexes.
+
+    Args:
+        start_arg: Name of the query argument holding the first date
+        end_arg: Name of the query argument holding the last date
+        args: Query arguments (defaults to the Flask request's)
+
+    Raises:
+        ValueError: If the date or a range bound is not an ISO date
+    """
+    args = request.args if args is None else args
+    filters = []
+    station_ids = requested_station_ids(args)
+    exact_date = args.get("date")
+    start = args.get(start_arg)
+    end = args.get(end_arg)
+
+    if len(station_ids) == 1:
+        filters.append(WeatherData.station_id == station_ids[0])
+    elif station_ids:
+        filters.append(WeatherData.station_id.in_(station_ids))
+    if exact_date:
+        # Parsed like the range bounds: asyncpg only binds date objects
+        filters.append(WeatherData.date == date.fromisoformat(exact_date))
+    if start:
+        filters.append(WeatherData.date >= date.fromisoformat(start))
+    if end:
+        filters.append(WeatherData.date <= date.fromisoformat(end))
+    return filters
+
+
+@api.route("/api/weather", methods=["GET"])
+@cached_response
 def get_weather():
     """
     Endpoint returning the weather data
@@ -84,10 +674,21 @@ def get_weather():
         in: query
         type: string
         required: false
+        description: Station ID; repeat or comma-separate for several
       - name: date
         in: query
         type: string
         required: false
+      - name: start_date
+        in: query
+        type: string
+        required: false
+        description: First date to include (YYYY-MM-DD)
+      - name: end_date
+        in: query
+        type: string
+        required: false
+        description: Last date to include (YYYY-MM-DD)
       - name: page
         in: query
         type: integer
@@ -98,34 +699,608 @@ def get_weather():
         type: integer
         required: false
         default: 20
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: >
+          Opaque next_cursor from the previous response (empty for the
+          first page). Switches to keyset pagination, which returns
+          next_cursor instead of total/page/pages.
+      - name: count
+        in: query
+        type: string
+        enum: [exact, estimate, none]
+        required: false
+        default: exact
+        description: >
+          How total/pages are computed: exact COUNT(*), an estimate from
+          precomputed counts or planner statistics, or not at all
+      - name: format
+        in: query
+        type: string
+        enum: [json, arrow]
+        required: false
+        default: json
+        description: >
+          arrow returns an Apache Arrow IPC stream (also selected by
+          Accept: application/vnd.apache.arrow.stream)
     responses:
       200:
         description: Weather data retrieved successfully
+      304:
+        description: Not modified since the ETag in If-None-Match
+      400:
+        description: Invalid cursor, count or date
       500:
         description: Internal server error
     """
     try:
         logger.info("Fetching weather data")
 
-        station_id = request.args.get("station_id")
-        date = request.args.get("date")
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 20, type=int)
+        cursor = request.args.get("cursor")
 
-        query = WeatherData.query
+        payload = station_cache_page(page, per_page, cursor)
+        if payload is not None:
+            return encode_page(payload, WEATHER_SCHEMA)
 
-        if station_id:
-            query = query.filter_by(station_id=station_id)
-        if date:
-            query = query.filter_by(date=date)
+        query = WeatherData.query.filter(*weather_filters())
 
-        return jsonify(paginate(query, page, per_page))
+        key_columns = [WeatherData.station_id, WeatherData.date]
+        return paginated_response(
+            query,
+            WeatherData,
+            WEATHER_SCHEMA,
+            key_columns,
+            page,
+            per_page,
+            cursor,
+            estimate=estimate_weather_total,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error fetching weather data: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
 
-@app.route("/api/weather/stats", methods=["GET"])
+EXPORT_COLUMNS = [
+    WeatherData.id,
+    WeatherData.station_id,
+    WeatherData.date,
+    WeatherData.max_temp,
+    WeatherData.min_temp,
+    WeatherData.precipitation,
+]
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_chunks(stmt, fmt: str) -> Iterator[str]:
+    """
+    Stream the rows of a statement as NDJSON or CSV text.
+
+    Rows are fetched from a server-side cursor EXPORT_CHUNK_SIZE at a
+    time and each chunk is encoded and yielded before the next is read,
+    so memory stays flat regardless of the result size.
+
+    Args:
+        stmt: Select statement over EXPORT_COLUMNS
+        fmt: "ndjson" or "csv"
+    """
+    result = db.session.execute(
+        stmt.execution_options(stream_results=True)
+    )
+    if fmt == "csv":
+        yield ",".join(EXPORT_FIELDS) + "\r\n"
+
+    for rows in result.partitions(EXPORT_CHUNK_SIZE):
+        if fmt == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            yield buffer.getvalue()
+        else:
+            yield "".join(
+                json.dumps(dict(zip(EXPORT_FIELDS, row)), default=str) + "\n"
+                for row in rows
+            )
+
+
+@api.route("/api/weather/export", methods=["GET"])
+def export_weather():
+    """
+    Endpoint streaming weather data as NDJSON or CSV
+    ---
+    parameters:
+      - name: station_id
+        in: query
+        type: string
+        required: false
+      - name: date
+        in: query
+        type: string
+        required: false
+      - name: start
+        in: query
+        type: string
+        required: false
+        description: First date to include (YYYY-MM-DD)
+      - name: end
+        in: query
+        type: string
+        required: false
+        description: Last date to include (YYYY-MM-DD)
+      - name: format
+        in: query
+        type: string
+        enum: [ndjson, csv]
+        required: false
+        default: ndjson
+    responses:
+      200:
+        description: Weather data streamed successfully
+      400:
+        description: Invalid format or date
+      500:
+        description: Internal server error
+    """
+    try:
+        logger.info("Exporting weather data")
+
+        fmt = request.args.get("format", "ndjson")
+        if fmt not in EXPORT_MIMETYPES:
+            raise ValueError(f"Unsupported format: {fmt}")
+
+        stmt = (
+            select(*EXPORT_COLUMNS)
+            .where(*weather_filters("start", "end"))
+            .order_by(WeatherData.station_id, WeatherData.date)
+        )
+        return Response(
+            stream_with_context(export_chunks(stmt, fmt)),
+            mimetype=EXPORT_MIMETYPES[fmt],
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error exporting weather data: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+# Limits of a /api/weather/batch request, overridable in the app config
+BATCH_MAX_STATIONS = 1000
+BATCH_MAX_DATES = 366
+BATCH_MAX_DAYS = 3660
+BATCH_FIELDS = [field for field in EXPORT_FIELDS if field != "station_id"]
+
+
+def matches_any(column, values: List):
+    """
+    Match a column against a list of values with a single array
+    parameter (column = ANY(:values)) on PostgreSQL, so the statement is
+    the same whatever the number of values; other databases use IN.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return column.in_(values)
+    return column == any_(
+        bindparam(f"{column.key}_values", values, type_=ARRAY(column.type))
+    )
+
+
+def batch_request() -> Tuple[List[str], List]:
+    """
+    Validate a /api/weather/batch request body.
+
+    Returns:
+        The distinct station IDs, in request order, and the date filters
+
+    Raises:
+        ValueError: If the body is malformed or exceeds the batch limits
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    station_ids = body.get("station_ids")
+    if (
+        not isinstance(station_ids, list)
+        or not station_ids
+        or not all(isinstance(value, str) for value in station_ids)
+    ):
+        raise ValueError("station_ids must be a non-empty list of strings")
+    station_ids = list(dict.fromkeys(station_ids))
+    max_stations = current_app.config.get(
+        "BATCH_MAX_STATIONS", BATCH_MAX_STATIONS
+    )
+    if len(station_ids) > max_stations:
+        raise ValueError(f"At most {max_stations} station_ids per request")
+
+    dates = body.get("dates")
+    start, end = body.get("start_date"), body.get("end_date")
+    if dates is not None:
+        if (
+            not isinstance(dates, list)
+            or not dates
+            or not all(isinstance(value, str) for value in dates)
+        ):
+            raise ValueError("dates must be a non-empty list of ISO dates")
+        max_dates = current_app.config.get("BATCH_MAX_DATES", BATCH_MAX_DATES)
+        if len(dates) > max_dates:
+            raise ValueError(f"At most {max_dates} dates per request")
+        days = sorted({date.fromisoformat(value) for value in dates})
+        return station_ids, [matches_any(WeatherData.date, days)]
+
+    if not start or not end:
+        raise ValueError("Pass dates, or start_date and end_date")
+    if not isinstance(start, str) or not isinstance(end, str):
+        raise ValueError("start_date and end_date must be ISO dates")
+    start, end = date.fromisoformat(start), date.fromisoformat(end)
+    max_days = current_app.config.get("BATCH_MAX_DAYS", BATCH_MAX_DAYS)
+    if not 0 <= (end - start).days < max_days:
+        raise ValueError(
+            f"end_date must be within {max_days} days after start_date"
+        )
+    return station_ids, [WeatherData.date >= start, WeatherData.date <= end]
+
+
+def batch_chunks(stmt, station_ids: List[str]) -> Iterator[bytes]:
+    """
+    Stream the rows of a batch query as one JSON object mapping each
+    station ID to its rows.
+
+    Rows arrive ordered by station and date from a server-side cursor,
+    EXPORT_CHUNK_SIZE at a time, and each chunk is encoded and yielded
+    before the next is read, so memory stays flat regardless of the
+    number of stations. Requested stations without rows map to [].
+
+    Args:
+        stmt: Select statement over EXPORT_COLUMNS
+        station_ids: Requested station IDs
+    """
+    import orjson
+
+    result = db.session.execute(
+        stmt.execution_options(stream_results=True)
+    )
+    yield b'{"stations":{'
+    current = None
+    seen = set()
+    for rows in result.partitions(EXPORT_CHUNK_SIZE):
+        parts = []
+        for row in rows:
+            row = tuple(row)
+            if row[1] != current:
+                if current is not None:
+                    parts.append(b"],")
+                current = row[1]
+                seen.add(current)
+                parts.append(orjson.dumps(current) + b":[")
+            else:
+                parts.append(b",")
+            parts.append(
+                orjson.dumps(dict(zip(BATCH_FIELDS, row[:1] + row[2:])))
+            )
+        yield b"".join(parts)
+
+    parts = [b"]"] if current is not None else []
+    for station_id in station_ids:
+        if station_id not in seen:
+            separator = b"," if parts else b""
+            parts.append(separator + orjson.dumps(station_id) + b":[]")
+    yield b"".join(parts) + b"}}"
+
+
+@api.route("/api/weather/batch", methods=["POST"])
+def batch_weather():
+    """
+    Endpoint returning the weather data of many stations at once
+    ---
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [station_ids]
+          properties:
+            station_ids:
+              type: array
+              items:
+                type: string
+              description: Stations to fetch (at most BATCH_MAX_STATIONS)
+            start_date:
+              type: string
+              description: First date to include (YYYY-MM-DD)
+            end_date:
+              type: string
+              description: Last date to include (YYYY-MM-DD), at most
+                BATCH_MAX_DAYS after start_date
+            dates:
+              type: array
+              items:
+                type: string
+              description: Explicit dates to fetch instead of a range (at
+                most BATCH_MAX_DATES)
+    responses:
+      200:
+        description: >
+          {"stations": {station_id: [rows ordered by date]}}, streamed;
+          requested stations without data map to []
+      400:
+        description: Invalid body, date or limits exceeded
+      500:
+        description: Internal server error
+    """
+    try:
+        station_ids, date_filters = batch_request()
+        logger.info(f"Fetching weather data for {len(station_ids)} stations")
+
+        # One set-based query for every station, instead of one request
+        # (with its COUNT and page query) per station
+        stmt = (
+            select(*EXPORT_COLUMNS)
+            .where(matches_any(WeatherData.station_id, station_ids))
+            .where(*date_filters)
+            .order_by(WeatherData.station_id, WeatherData.date)
+        )
+        return Response(
+            stream_with_context(batch_chunks(stmt, station_ids)),
+            mimetype="application/json",
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error fetching weather data batch: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+# Measures and aggregates of /api/weather/aggregate metric names, which
+# are "<aggregate>_<measure>" (avg_max, min_min, p95_precip, ...)
+AGGREGATE_MEASURES = {
+    "max": WeatherData.max_temp,
+    "min": WeatherData.min_temp,
+    "precip": WeatherData.precipitation,
+}
+AGGREGATE_FUNCTIONS = {
+    "avg": func.avg,
+    "min": func.min,
+    "max": func.max,
+    "sum": func.sum,
+    "count": func.count,
+}
+# Metrics that add up from the monthly rollups, with the rollup columns
+# holding the measure's value and its number of valid days
+ROLLUP_MEASURES = {
+    "max": ("avg_max_temp", "max_temp_days"),
+    "min": ("avg_min_temp", "min_temp_days"),
+    "precip": ("total_precipitation", "precipitation_days"),
+}
+ROLLUP_METRICS = {"avg_max", "avg_min", "sum_precip"} | {
+    f"count_{measure}" for measure in ROLLUP_MEASURES
+}
+
+
+def aggregate_metric(name: str):
+    """
+    Return the SQL aggregate of a metric name, labelled with the name:
+    avg, min, max, sum and count, or pNN for the NNth percentile
+    (percentile_cont, interpolating between values).
+
+    Raises:
+        ValueError: If the name is not a supported metric
+    """
+    aggregate, _, measure = name.partition("_")
+    if measure not in AGGREGATE_MEASURES:
+        raise ValueError(f"Unsupported metric: {name}")
+    column = AGGREGATE_MEASURES[measure]
+    if aggregate in AGGREGATE_FUNCTIONS:
+        return AGGREGATE_FUNCTIONS[aggregate](column).label(name)
+    if (
+        aggregate[:1] == "p"
+        and aggregate[1:].isdigit()
+        and 0 < int(aggregate[1:]) < 100
+    ):
+        fraction = int(aggregate[1:]) / 100
+        return func.percentile_cont(fraction).within_group(column).label(name)
+    raise ValueError(f"Unsupported metric: {name}")
+
+
+def aggregate_from_rollups(
+    station_ids: List[str], start: date, end: date, metrics: List[str]
+) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Compute metrics from the precomputed monthly rollups, which hold a
+    few hundred rows per station where weather_data holds thousands.
+
+    Only windows of whole years qualify, and only when analysis has
+    produced current statistics for every station-month in them: each
+    has a weather_stats_monthly row and no station-year is waiting in
+    weather_stats_pending. Months without data have no row, so such
+    windows are scanned instead.
+    Averages are weighted by the rollups' valid-day counts, so they equal
+    the averages of the daily values.
+
+    Returns:
+        Metrics by station, or None if the window can't use the rollups
+    """
+    if (
+        not set(metrics) <= ROLLUP_METRICS
+        or (start.month, start.day) != (1, 1)
+        or (end.month, end.day) != (12, 31)
+    ):
+        return None
+
+    # The values are read from the monthly rollups, so that is where
+    # coverage is checked: annual rows may predate them
+    months = 12 * (end.year - start.year + 1)
+    covered = dict(
+        db.session.query(WeatherStatsMonthly.station_id, func.count())
+        .filter(
+            WeatherStatsMonthly.station_id.in_(station_ids),
+            WeatherStatsMonthly.year.between(start.year, end.year),
+        )
+        .group_by(WeatherStatsMonthly.station_id)
+        .all()
+    )
+    pending = db.session.query(
+        WeatherStatsPending.query.filter(
+            WeatherStatsPending.station_id.in_(station_ids),
+            WeatherStatsPending.year.between(start.year, end.year),
+        ).exists()
+    ).scalar()
+    if pending or any(
+        covered.get(station_id) != months for station_id in station_ids
+    ):
+        return None
+
+    model = WeatherStatsMonthly
+    columns = []
+    for value, days in ROLLUP_MEASURES.values():
+        total, days = getattr(model, value), getattr(model, days)
+        if value.startswith("avg_"):
+            # Monthly averages are weighted back into sums of daily values
+            total = total * days
+        columns += [func.sum(total), func.sum(days)]
+    rows = (
+        db.session.query(model.station_id, *columns)
+        .filter(
+            model.station_id.in_(station_ids),
+            model.year.between(start.year, end.year),
+        )
+        .group_by(model.station_id)
+        .all()
+    )
+
+    results = {}
+    for station_id, *sums in rows:
+        values = {}
+        for index, measure in enumerate(ROLLUP_MEASURES):
+            total, days = sums[2 * index], int(sums[2 * index + 1] or 0)
+            values[f"count_{measure}"] = days
+            values[f"avg_{measure}"] = total / days if days else None
+            values[f"sum_{measure}"] = total if days else None
+        results[station_id] = {name: values[name] for name in metrics}
+    return results
+
+
+@api.route("/api/weather/aggregate", methods=["GET"])
+@cached_response
+def aggregate_weather():
+    """
+    Endpoint computing statistics over an arbitrary date range
+    ---
+    parameters:
+      - name: station_id
+        in: query
+        type: string
+        required: true
+        description: Station ID; repeat or comma-separate for several
+      - name: start
+        in: query
+        type: string
+        required: true
+        description: First date to include (YYYY-MM-DD)
+      - name: end
+        in: query
+        type: string
+        required: true
+        description: Last date to include (YYYY-MM-DD)
+      - name: metrics
+        in: query
+        type: string
+        required: true
+        description: >
+          Comma-separated <aggregate>_<measure> names, where aggregate is
+          avg, min, max, sum, count or pNN (NNth percentile) and measure
+          is max (max_temp), min (min_temp) or precip (precipitation),
+          e.g. avg_max,min_min,p95_precip
+    responses:
+      200:
+        description: >
+          {"start", "end", "metrics", "source", "stations": {station_id:
+          {metric: value}}}, where source is rollups or weather_data;
+          stations without data in the range have null values and zero
+          counts
+      304:
+        description: Not modified since the ETag in If-None-Match
+      400:
+        description: Missing or invalid station, dates or metrics
+      500:
+        description: Internal server error
+    """
+    try:
+        station_ids = requested_station_ids()
+        start, end = request.args.get("start"), request.args.get("end")
+        metrics = list(
+            dict.fromkeys(
+                name.strip()
+                for name in request.args.get("metrics", "").split(",")
+                if name.strip()
+            )
+        )
+        if not station_ids or not start or not end or not metrics:
+            raise ValueError("Pass station_id, start, end and metrics")
+        max_stations = current_app.config.get(
+            "BATCH_MAX_STATIONS", BATCH_MAX_STATIONS
+        )
+        if len(station_ids) > max_stations:
+            raise ValueError(f"At most {max_stations} stations per request")
+        start, end = date.fromisoformat(start), date.fromisoformat(end)
+        if end < start:
+            raise ValueError("end must not be before start")
+        columns = [aggregate_metric(name) for name in metrics]
+        logger.info(
+            f"Aggregating {','.join(metrics)} for {len(station_ids)} "
+            f"stations from {start} to {end}"
+        )
+
+        results = aggregate_from_rollups(station_ids, start, end, metrics)
+        source = "rollups"
+        if results is None:
+            # One pass over the window's rows computes every metric of
+            # every station
+            source = "weather_data"
+            rows = db.session.execute(
+                select(WeatherData.station_id, *columns)
+                .where(
+                    matches_any(WeatherData.station_id, station_ids),
+                    WeatherData.date.between(start, end),
+                )
+                .group_by(WeatherData.station_id)
+            )
+            results = {
+                row.station_id: {name: row[name] for name in metrics}
+                for row in rows.mappings()
+            }
+
+        empty = {
+            name: 0 if name.startswith("count_") else None for name in metrics
+        }
+        payload = {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "metrics": metrics,
+            "source": source,
+            "stations": {
+                station_id: results.get(station_id, empty)
+                for station_id in station_ids
+            },
+        }
+        import orjson
+
+        return Response(orjson.dumps(payload), mimetype="application/json")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error aggregating weather data: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@api.route("/api/weather/stats", methods=["GET"])
+@cached_response
 def get_weather_stats():
     """
     Endpoint returning the weather statistics
@@ -139,6 +1314,17 @@ def get_weather_stats():
         in: query
         type: string
         required: false
+      - name: granularity
+        in: query
+        type: string
+        enum: [year, month, season]
+        required: false
+        default: year
+        description: >
+          Annual statistics, or the monthly or seasonal rollups, which
+          also carry max_temp_days, min_temp_days and precipitation_days
+          (days with a valid measurement). Winter is Dec-Feb and counts
+          towards the year its January falls in.
       - name: page
         in: query
         type: integer
@@ -149,9 +1335,39 @@ def get_weather_stats():
         type: integer
         required: false
         default: 20
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: >
+          Opaque next_cursor from the previous response (empty for the
+          first page). Switches to keyset pagination, which returns
+          next_cursor instead of total/page/pages.
+      - name: count
+        in: query
+        type: string
+        enum: [exact, estimate, none]
+        required: false
+        default: exact
+        description: >
+          How total/pages are computed: exact COUNT(*), an estimate from
+          precomputed counts or planner statistics, or not at all
+      - name: format
+        in: query
+        type: string
+        enum: [json, arrow]
+        required: false
+        default: json
+        description: >
+          arrow returns an Apache Arrow IPC stream (also selected by
+          Accept: application/vnd.apache.arrow.stream)
     responses:
       200:
         description: Weather stats retrieved successfully
+      304:
+        description: Not modified since the ETag in If-None-Match
+      400:
+        description: Invalid cursor, count or granularity
       500:
         description: Internal server error
     """
@@ -162,15 +1378,41 @@ def get_weather_stats():
         station_id = request.args.get("station_id")
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 20, type=int)
+        cursor = request.args.get("cursor")
+        granularity = request.args.get("granularity", "year")
+        if granularity not in STATS_GRANULARITIES:
+            raise ValueError(f"Unsupported granularity: {granularity}")
+        model, schema, period = STATS_GRANULARITIES[granularity]
 
-        query = WeatherStats.query
+        query = model.query
 
         if year:
             query = query.filter_by(year=year)
         if station_id:
             query = query.filter_by(station_id=station_id)
 
-        return jsonify(paginate(query, page, per_page))
+        key_columns = [model.station_id, model.year]
+        if period:
+            key_columns.append(getattr(model, period))
+        return paginated_response(
+            query,
+            model,
+            schema,
+            key_columns,
+            page,
+            per_page,
+            cursor,
+            # The stats tables hold at most a few rows per station-year,
+            # so filtered counts stay cheap; only the unfiltered count is
+            # estimated
+            estimate=(
+                lambda: planner_estimate(model.__tablename__)
+                if not (year or station_id)
+                else query.order_by(None).count()
+            ),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error fetching weather stats: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
@@ -178,4 +1420,7 @@ def get_weather_stats():
 
 if __name__ == "__main__":
     logger.info("Starting Flask application")
+    app = create_app()
+    # The debug server's reloader restarts often; load the docs up front
+    app.wsgi_app.load()
     app.run(debug=True)
@@ -0,0 +1,368 @@
+"""Async (ASGI) serving mode for the weather read endpoints.
+
+The Flask app serves each request on a blocking psycopg2 connection held
+for the whole request. This module serves /api/weather and
+/api/weather/stats from coroutines instead, on SQLAlchemy's asyncio
+engine with the asyncpg driver: a worker multiplexes many requests over
+a bounded connection pool, holds a connection only while its queries
+run, and gives up on requests that exceed a timeout.
+
+Run it with:
+
+    uvicorn asgi:app --workers 4
+
+and tune it with these environment variables:
+
+    ASYNC_DB_POOL_SIZE: Connections per worker process (default 10)
+    ASYNC_DB_POOL_TIMEOUT: Seconds to wait for a free connection before
+        answering 503 (default 5)
+    ASYNC_REQUEST_TIMEOUT: Seconds before a request is cancelled and
+        answered with 504 (default 10)
+
+Responses match the Flask endpoints (JSON or Arrow, page or cursor
+pagination, count modes) except that they are not cached, so they carry
+no ETag.
+"""
+
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import exc, func, select, tuple_
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import (
+    COUNT_MODES,
+    PLANNER_ESTIMATE,
+    STATS_GRANULARITIES,
+    decode_cursor,
+    encode_cursor,
+    encode_json_page,
+    logger,
+    prorate_row_counts,
+    row_count_query,
+    row_count_scope,
+    wants_arrow,
+    weather_filters,
+)
+from columnar import ARROW_MIMETYPE, WEATHER_SCHEMA, to_arrow_stream
+from metrics import (
+    CONTENT_TYPE_LATEST,
+    exposition,
+    instrument_engine,
+    observe_request,
+)
+from models import WeatherData
+from utils import load_config
+
+POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("ASYNC_DB_POOL_TIMEOUT", "5"))
+REQUEST_TIMEOUT = float(os.getenv("ASYNC_REQUEST_TIMEOUT", "10"))
+
+# max_overflow=0 keeps the pool bounded: requests beyond POOL_SIZE wait
+# for a connection (up to POOL_TIMEOUT) instead of opening new ones.
+# command_timeout makes asyncpg cancel statements running past the
+# request timeout on the server as well.
+engine = create_async_engine(
+    make_url(load_config()["SQLALCHEMY_DATABASE_URI"]).set(
+        drivername="postgresql+asyncpg"
+    ),
+    pool_size=POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=POOL_TIMEOUT,
+    connect_args={"command_timeout": REQUEST_TIMEOUT},
+)
+instrument_engine(engine.sync_engine)
+
+Estimate = Callable[[AsyncConnection], Awaitable[Optional[int]]]
+
+
+def int_arg(request: Request, name: str, default: Optional[int] = None):
+    """Read an integer query argument like request.args.get(type=int)."""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def planner_estimate(
+    connection: AsyncConnection, table_name: str
+) -> Optional[int]:
+    """Return pg_class.reltuples for a table, or None if unavailable."""
+    reltuples = (
+        await connection.execute(PLANNER_ESTIMATE, {"name": table_name})
+    ).scalar()
+    if reltuples is None or reltuples < 0:
+        return None
+    return int(reltuples)
+
+
+async def offset_page(
+    connection: AsyncConnection,
+    stmt,
+    page: int,
+    per_page: int,
+    count: str,
+    estimate: Estimate,
+) -> Dict[str, Any]:
+    """
+    Fetch one page with LIMIT/OFFSET, like app.paginate(raw=True).
+
+    Args:
+        connection: Connection to run the queries on
+        stmt: Select of the response's columns
+        page: Current page number
+        per_page: Number of items per page
+        count: One of COUNT_MODES
+        estimate: Coroutine function returning an estimated total
+    """
+    page = max(page, 1)
+    if per_page < 0:
+        per_page = 20
+    items = (
+        await connection.execute(
+            stmt.limit(per_page).offset((page - 1) * per_page)
+        )
+    ).all()
+
+    total = None
+    if count == "exact":
+        if page == 1 and len(items) < per_page:
+            total = len(items)
+        else:
+            total = (
+                await connection.execute(
+                    select(func.count()).select_from(
+                        stmt.order_by(None).subquery()
+                    )
+                )
+            ).scalar()
+    elif count == "estimate":
+        total = await estimate(connection)
+
+    pages = None
+    if total is not None:
+        pages = math.ceil(total / per_page) if per_page > 0 else 0
+    return {
+        "items": items,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "pages": pages,
+    }
+
+
+async def keyset_page(
+    connection: AsyncConnection,
+    stmt,
+    key_columns: List,
+    cursor: str,
+    per_page: int,
+) -> Dict[str, Any]:
+    """Fetch one page past a cursor, like app.keyset_paginate(raw=True)."""
+    if per_page < 1:
+        raise ValueError("per_page must be at least 1")
+    if cursor:
+        stmt = stmt.where(
+            tuple_(*key_columns) > tuple_(*decode_cursor(cursor, key_columns))
+        )
+    items = (
+        await connection.execute(
+            stmt.order_by(*key_columns).limit(per_page + 1)
+        )
+    ).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(
+            [getattr(items[-1], column.key) for column in key_columns]
+        )
+    return {"items": items, "per_page": per_page, "next_cursor": next_cursor}
+
+
+async def paginated_response(
+    request: Request,
+    model,
+    schema,
+    filters: List,
+    key_columns: List,
+    estimate: Estimate,
+) -> Response:
+    """
+    Paginate a model's rows and encode the page as JSON or Arrow.
+
+    The connection is released before the page is encoded, so it is only
+    held for the duration of the queries.
+
+    Raises:
+        ValueError: If the count argument is not one of COUNT_MODES
+    """
+    count = request.query_params.get("count", "exact")
+    if count not in COUNT_MODES:
+        raise ValueError(f"Unsupported count: {count}")
+    page = int_arg(request, "page", 1)
+    per_page = int_arg(request, "per_page", 20)
+    cursor = request.query_params.get("cursor")
+
+    stmt = select(*[getattr(model, name) for name in schema.names]).where(
+        *filters
+    )
+    async with engine.connect() as connection:
+        if cursor is not None:
+            payload = await keyset_page(
+                connection, stmt, key_columns, cursor, per_page
+            )
+        else:
+            payload = await offset_page(
+                connection, stmt, page, per_page, count, estimate
+            )
+
+    accept = parse_accept_header(request.headers.get("accept"), MIMEAccept)
+    if not wants_arrow(request.query_params, accept):
+        return Response(
+            encode_json_page(payload, schema.names),
+            media_type="application/json",
+        )
+    items = payload.pop("items")
+    return Response(
+        to_arrow_stream(items, schema, payload), media_type=ARROW_MIMETYPE
+    )
+
+
+def endpoint(name: str):
+    """
+    Wrap an endpoint coroutine with the request timeout, the error
+    responses of the Flask endpoints and request metrics.
+    """
+
+    def decorator(handler):
+        async def wrapper(request: Request) -> Response:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    handler(request), timeout=REQUEST_TIMEOUT
+                )
+            except ValueError as e:
+                response = JSONResponse({"error": str(e)}, status_code=400)
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out fetching {name}")
+                response = JSONResponse(
+                    {"error": "Request timed out"}, status_code=504
+                )
+            except exc.TimeoutError:
+                logger.error(f"No database connection for {name}")
+                response = JSONResponse(
+                    {"error": "Service unavailable"}, status_code=503
+                )
+            except Exception as e:
+                logger.error(f"Error fetching {name}: {str(e)}")
+                response = JSONResponse(
+                    {"error": "Internal server error"}, status_code=500
+                )
+            observe_request(
+                request.method,
+                request.url.path,
+                response.status_code,
+                time.perf_counter() - start,
+                len(response.body),
+            )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@endpoint("weather data")
+async def get_weather(request: Request) -> Response:
+    """Async counterpart of app.get_weather."""
+    args = request.query_params
+
+    async def estimate(connection: AsyncConnection) -> Optional[int]:
+        station_ids, start, end = row_count_scope(args=args)
+        per_year = (
+            await connection.execute(row_count_query(station_ids, start, end))
+        ).all()
+        if not per_year:
+            if station_ids or start or end:
+                return None
+            return await planner_estimate(
+                connection, WeatherData.__tablename__
+            )
+        return prorate_row_counts(per_year, start, end)
+
+    return await paginated_response(
+        request,
+        WeatherData,
+        WEATHER_SCHEMA,
+        weather_filters(args=args),
+        [WeatherData.station_id, WeatherData.date],
+        estimate,
+    )
+
+
+@endpoint("weather stats")
+async def get_weather_stats(request: Request) -> Response:
+    """Async counterpart of app.get_weather_stats."""
+    year = int_arg(request, "year")
+    station_id = request.query_params.get("station_id")
+    granularity = request.query_params.get("granularity", "year")
+    if granularity not in STATS_GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    model, schema, period = STATS_GRANULARITIES[granularity]
+
+    filters = []
+    if year:
+        filters.append(model.year == year)
+    if station_id:
+        filters.append(model.station_id == station_id)
+
+    key_columns = [model.station_id, model.year]
+    if period:
+        key_columns.append(getattr(model, period))
+
+    async def estimate(connection: AsyncConnection) -> Optional[int]:
+        if not filters:
+            return await planner_estimate(connection, model.__tablename__)
+        return (
+            await connection.execute(
+                select(func.count()).select_from(model).where(*filters)
+            )
+        ).scalar()
+
+    return await paginated_response(
+        request, model, schema, filters, key_columns, estimate
+    )
+
+
+async def metrics(request: Request) -> Response:
+    """Prometheus metrics of this worker (see metrics.py)."""
+    return Response(exposition(), media_type=CONTENT_TYPE_LATEST)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    """Close the pool's connections when the server shuts down."""
+    yield
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/weather", get_weather),
+        Route("/api/weather/stats", get_weather_stats),
+        Route("/metrics", metrics),
+    ],
+    lifespan=lifespan,
+)
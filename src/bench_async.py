@@ -0,0 +1,176 @@
+"""Benchmark the sync (Flask) and async (ASGI) serving modes under load.
+
+Starts the Flask app and the ASGI app (asgi.py, under uvicorn) against
+the database configured in .env, drives each with the same number of
+concurrent clients, and reports requests/sec and p50/p99 latency per
+mode. Point it at a local Postgres that already holds ingested data.
+
+Usage:
+    python bench_async.py [--concurrency 64] [--requests 2000]
+        [--path /api/weather?per_page=100] [--path /api/weather/stats]
+
+Servers started elsewhere (e.g. behind another WSGI server) can be
+benchmarked instead with --sync-url and --async-url.
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+SYNC_PORT = 5101
+ASYNC_PORT = 5102
+
+
+async def fetch(host: str, port: int, path: str) -> int:
+    """Send one GET request and return the response's status code."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+        "Connection: close\r\n\r\n".encode()
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+async def run_load(
+    base_url: str, paths: List[str], concurrency: int, requests: int
+) -> Tuple[float, List[float], int]:
+    """
+    Issue requests round-robin over paths from concurrent clients.
+
+    Returns:
+        Wall time in seconds, per-request latencies in seconds, and the
+        number of failed (non-200) requests
+    """
+    url = urlsplit(base_url)
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            try:
+                status = await fetch(
+                    url.hostname, url.port, paths[i % len(paths)]
+                )
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return time.perf_counter() - start, latencies, errors
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the q-th percentile (0-100) of values, nearest-rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def start_server(mode: str) -> Tuple[subprocess.Popen, str]:
+    """Start the app in the given mode and return it with its base URL."""
+    if mode == "sync":
+        port = SYNC_PORT
+        # The async mode has no response cache, so measure the sync mode
+        # without it too
+        command = [
+            sys.executable,
+            "-c",
+            "from app import create_app; "
+            "app = create_app({'RESPONSE_CACHE_MAX_ENTRIES': 0}); "
+            f"app.run(port={port}, threaded=True)",
+        ]
+    else:
+        port = ASYNC_PORT
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "asgi:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ]
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_ready(base_url: str, path: str, timeout: float = 30):
+    """Poll the server until it answers, or raise after timeout."""
+    url = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await fetch(url.hostname, url.port, path)
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{base_url} did not start")
+            await asyncio.sleep(0.2)
+
+
+def benchmark(
+    mode: str,
+    base_url: Optional[str],
+    paths: List[str],
+    concurrency: int,
+    requests: int,
+) -> None:
+    """Benchmark one serving mode and print its results."""
+    process = None
+    if base_url is None:
+        process, base_url = start_server(mode)
+    try:
+        asyncio.run(wait_until_ready(base_url, paths[0]))
+        # Warm up connections and caches before measuring
+        asyncio.run(run_load(base_url, paths, concurrency, concurrency))
+        elapsed, latencies, errors = asyncio.run(
+            run_load(base_url, paths, concurrency, requests)
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print(
+        f"{mode:>5}: {requests / elapsed:8.1f} req/s  "
+        f"p50 {percentile(latencies, 50) * 1000:7.1f} ms  "
+        f"p99 {percentile(latencies, 99) * 1000:7.1f} ms  "
+        f"errors {errors}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--path", action="append", dest="paths")
+    parser.add_argument("--sync-url")
+    parser.add_argument("--async-url")
+    args = parser.parse_args()
+
+    paths = args.paths or [
+        "/api/weather?per_page=100&count=none",
+        "/api/weather/stats?per_page=100",
+    ]
+    print(
+        f"{args.requests} requests, {args.concurrency} concurrent clients"
+    )
+    benchmark("sync", args.sync_url, paths, args.concurrency, args.requests)
+    benchmark(
+        "async", args.async_url, paths, args.concurrency, args.requests
+    )
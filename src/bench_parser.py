@@ -0,0 +1,93 @@
+"""Benchmark the vectorized wx_data parser against the row-by-row path.
+
+Generates a station file of realistic size (daily rows over several
+decades, with some -9999 sentinels) and reports rows/sec for
+csv.reader + ingest.parse_row and for wx_parser.parse_wx_bytes.
+
+Usage:
+    python bench_parser.py [--years 30] [--repeat 5]
+"""
+
+import argparse
+import csv
+import io
+import random
+import time
+from datetime import date, timedelta
+from typing import Callable
+
+from ingest import parse_row
+from wx_parser import SENTINEL, parse_wx_bytes
+
+
+def generate_station_file(
+    years: int, missing_rate: float = 0.05, seed: int = 0
+) -> bytes:
+    """
+    Generate the contents of one wx_data station file.
+
+    Args:
+        years: Number of years of daily rows, ending on 2014-12-31
+        missing_rate: Fraction of measurements replaced by the sentinel
+        seed: Seed for the random generator
+
+    Returns:
+        Tab-separated file contents
+    """
+    rng = random.Random(seed)
+
+    def value(low: int, high: int) -> int:
+        if rng.random() < missing_rate:
+            return SENTINEL
+        return rng.randint(low, high)
+
+    day = date(2014 - years + 1, 1, 1)
+    lines = []
+    while day.year <= 2014:
+        max_temp = value(-200, 400)
+        min_temp = value(-350, 250)
+        precipitation = value(0, 900)
+        lines.append(
+            f"{day:%Y%m%d}\t{max_temp}\t{min_temp}\t{precipitation}\n"
+        )
+        day += timedelta(days=1)
+    return "".join(lines).encode()
+
+
+def parse_with_csv(data: bytes) -> int:
+    """Parse with csv.reader and parse_row, as ingest does by default."""
+    reader = csv.reader(io.StringIO(data.decode()), delimiter="\t")
+    return sum(1 for row in reader if parse_row(row))
+
+
+def parse_vectorized(data: bytes) -> int:
+    """Parse with the NumPy column parser."""
+    return len(parse_wx_bytes(data).date)
+
+
+def measure(parse: Callable[[bytes], int], data: bytes, repeat: int) -> float:
+    """Return the best rows/sec over `repeat` runs."""
+    best = float("inf")
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = parse(data)
+        best = min(best, time.perf_counter() - start)
+    return rows / best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = generate_station_file(args.years)
+    rows = data.count(b"\n")
+    print(f"Generated {rows} rows ({len(data) / 1024:.0f} KiB)")
+
+    baseline = measure(parse_with_csv, data, args.repeat)
+    vectorized = measure(parse_vectorized, data, args.repeat)
+    print(f"csv.reader + strptime: {baseline:,.0f} rows/sec")
+    print(f"vectorized:            {vectorized:,.0f} rows/sec")
+    print(f"speedup:               {vectorized / baseline:.1f}x")
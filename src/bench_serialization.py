@@ -0,0 +1,90 @@
+"""Benchmark the /api/weather serialization paths.
+
+Loads synthetic rows into an in-memory SQLite database and compares the
+per-row cost of a page built from ORM objects with as_dict() + jsonify()
+against the column-tuple + orjson path used by the endpoints.
+
+Usage:
+    python bench_serialization.py [--per-page 1000] [--repeat 20]
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+from typing import Callable
+
+from flask import jsonify
+
+from utils import setup_flask_app, init_db
+from models import WeatherData
+from columnar import WEATHER_SCHEMA
+
+
+def measure(build: Callable[[], bytes], repeat: int) -> float:
+    """Return the best wall time of `repeat` calls, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--per-page", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    bench_app = setup_flask_app()
+    bench_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    db = init_db(bench_app)
+
+    with bench_app.app_context():
+        from app import json_page, paginate
+
+        db.create_all()
+        rng = random.Random(0)
+        first = date(1985, 1, 1)
+        db.session.bulk_insert_mappings(
+            WeatherData,
+            [
+                {
+                    "station_id": f"USC{i % 10:08d}",
+                    "date": first + timedelta(days=i // 10),
+                    "max_temp": rng.randint(-200, 400) / 10,
+                    "min_temp": rng.randint(-350, 250) / 10,
+                    "precipitation": (
+                        None if i % 20 == 0 else rng.randint(0, 900) / 10
+                    ),
+                }
+                for i in range(args.per_page)
+            ],
+        )
+        db.session.commit()
+
+        with bench_app.test_request_context():
+
+            def orm_page() -> bytes:
+                page = paginate(WeatherData.query, 1, args.per_page)
+                return jsonify(page).get_data()
+
+            def tuple_page() -> bytes:
+                query = WeatherData.query.with_entities(
+                    *[getattr(WeatherData, n) for n in WEATHER_SCHEMA.names]
+                )
+                page = paginate(query, 1, args.per_page, raw=True)
+                return json_page(page, WEATHER_SCHEMA.names).get_data()
+
+            assert json.loads(orm_page()) == json.loads(tuple_page())
+
+            before = measure(orm_page, args.repeat)
+            after = measure(tuple_page, args.repeat)
+
+    rows = args.per_page
+    print(f"Page of {rows} rows")
+    print(f"ORM + as_dict + jsonify: {before / rows * 1e6:.2f} us/row")
+    print(f"column tuples + orjson:  {after / rows * 1e6:.2f} us/row")
+    print(f"speedup:                 {before / after:.1f}x")
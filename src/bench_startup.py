@@ -0,0 +1,67 @@
+"""Measure the API's cold start: import, app creation and first request.
+
+Each run starts a fresh interpreter that imports app, calls create_app()
+and sends one request through the test client, timing each step. The
+medians over all runs are printed as JSON.
+
+Usage:
+    python bench_startup.py [--runs 10]
+        [--path /api/weather?per_page=1] [--output startup.json]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Runs in the fresh interpreter; prints the timings in milliseconds
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+flask_app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "total_ms": (served - start) * 1000,
+}))
+"""
+
+
+def measure(path: str) -> dict:
+    """Time one cold start in a new interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, path],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", default="/api/weather?per_page=1")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    runs = [measure(args.path) for _ in range(args.runs)]
+    results = {
+        "path": args.path,
+        "runs": args.runs,
+        **{
+            key: statistics.median(run[key] for run in runs)
+            for key in runs[0]
+        },
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
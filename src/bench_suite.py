@@ -0,0 +1,306 @@
+"""End-to-end benchmark suite: ingestion, analysis and the API.
+
+Generates a synthetic wx_data directory (stations x years of daily rows in
+the real tab-separated format, with -9999 sentinels), loads it into a
+scratch database with ingest_weather_data, runs calculate_annual_stats,
+and times /api/weather and /api/weather/stats at several page sizes and
+filters. Results are written as JSON so runs on different commits can be
+compared.
+
+The benchmark drops and recreates every table in --database-url, so
+point it at a database that holds nothing else.
+
+Usage:
+    python bench_suite.py run --database-url postgresql://.../wx_bench
+        [--stations 50] [--years 20] [--bulk] [--vectorized]
+        [--workers 1] [--compact] [--requests 50] [--output results.json]
+    python bench_suite.py compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from bench_async import percentile
+from bench_parser import generate_station_file
+from compact import drop_compact_tables
+
+RESULTS_VERSION = 1
+PAGE_SIZES = [20, 100, 1000]
+LAST_YEAR = 2014
+
+
+def generate_wx_data(
+    directory: str, stations: int, years: int, missing_rate: float = 0.05
+) -> int:
+    """
+    Write one synthetic station file per station into a directory.
+
+    Args:
+        directory: Directory to write USC<number>.txt files into
+        stations: Number of station files
+        years: Years of daily rows per station, ending on 2014-12-31
+        missing_rate: Fraction of measurements replaced by -9999
+
+    Returns:
+        Number of rows written
+    """
+    os.makedirs(directory, exist_ok=True)
+    rows = 0
+    for station in range(stations):
+        data = generate_station_file(years, missing_rate, seed=station)
+        path = os.path.join(directory, f"USC{station:08d}.txt")
+        with open(path, "wb") as f:
+            f.write(data)
+        rows += data.count(b"\n")
+    return rows
+
+
+def api_scenarios(years: int) -> List[Dict[str, str]]:
+    """Return the API requests to time, as name and path-with-query."""
+    station = "USC00000000"
+    year = LAST_YEAR - years + 1
+    scenarios = []
+    for per_page in PAGE_SIZES:
+        scenarios += [
+            {
+                "name": f"weather/all/{per_page}",
+                "path": f"/api/weather?per_page={per_page}",
+            },
+            {
+                "name": f"weather/all-cursor/{per_page}",
+                "path": f"/api/weather?per_page={per_page}&cursor=",
+            },
+            {
+                "name": f"weather/station/{per_page}",
+                "path": f"/api/weather?station_id={station}"
+                f"&per_page={per_page}",
+            },
+            {
+                "name": f"weather/station-year/{per_page}",
+                "path": f"/api/weather?station_id={station}"
+                f"&start_date={year}-01-01&end_date={year}-12-31"
+                f"&per_page={per_page}",
+            },
+            {
+                "name": f"weather/month-all-stations/{per_page}",
+                "path": f"/api/weather?start_date={year}-06-01"
+                f"&end_date={year}-06-30&per_page={per_page}",
+            },
+            {
+                "name": f"weather/arrow/{per_page}",
+                "path": f"/api/weather?per_page={per_page}&format=arrow",
+            },
+            {
+                "name": f"stats/all/{per_page}",
+                "path": f"/api/weather/stats?per_page={per_page}",
+            },
+            {
+                "name": f"stats/year/{per_page}",
+                "path": f"/api/weather/stats?year={year}"
+                f"&per_page={per_page}",
+            },
+            {
+                "name": f"stats/month/{per_page}",
+                "path": f"/api/weather/stats?granularity=month"
+                f"&per_page={per_page}",
+            },
+        ]
+    return scenarios
+
+
+def time_requests(client, path: str, requests: int) -> Dict[str, Any]:
+    """
+    Issue the same request repeatedly and summarize its latency.
+
+    Returns:
+        Latency percentiles in milliseconds, sequential requests/sec and
+        the response size in bytes
+    """
+    # The first request warms up connections and the planner's caches
+    response = client.get(path)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}")
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        client.get(path)
+        latencies.append(time.perf_counter() - request_start)
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "requests_per_sec": requests / elapsed,
+        "response_bytes": len(response.get_data()),
+    }
+
+
+def use_database(database_url: str):
+    """
+    Recreate the tables of the scratch database and return an API app
+    serving it, which ingestion and analysis are also run with.
+    """
+    import app
+
+    # Measure the endpoints themselves, not the response cache
+    api_app = app.create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": database_url,
+            "RESPONSE_CACHE_MAX_ENTRIES": 0,
+        }
+    )
+    with api_app.app_context():
+        with app.db.engine.begin() as connection:
+            drop_compact_tables(connection)
+        app.db.drop_all()
+        app.create_tables()
+    return api_app
+
+
+def git_commit() -> str:
+    """Return the checked-out commit, or "unknown" outside a git tree."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the whole suite and return its results."""
+    if args.compact:
+        os.environ["WEATHER_DATA_COMPACT"] = "true"
+    api_app = use_database(args.database_url)
+
+    import analysis
+    import ingest
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        rows = generate_wx_data(data_dir, args.stations, args.years)
+        print(f"Generated {rows} rows for {args.stations} stations")
+
+        start = time.perf_counter()
+        ingest.ingest_weather_data(
+            data_dir=data_dir,
+            bulk=args.bulk,
+            workers=args.workers,
+            vectorized=args.vectorized,
+            app=api_app,
+        )
+        ingest_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analysis.calculate_annual_stats(app=api_app)
+    analysis_seconds = time.perf_counter() - start
+
+    client = api_app.test_client()
+    api = []
+    for scenario in api_scenarios(args.years):
+        result = time_requests(client, scenario["path"], args.requests)
+        api.append(dict(scenario, **result))
+        print(
+            f"{scenario['name']:<36} p50 {result['p50_ms']:7.2f} ms  "
+            f"p99 {result['p99_ms']:7.2f} ms"
+        )
+
+    return {
+        "version": RESULTS_VERSION,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "scale": {
+            "stations": args.stations,
+            "years": args.years,
+            "rows": rows,
+        },
+        "ingest": {
+            "bulk": args.bulk,
+            "vectorized": args.vectorized,
+            "workers": args.workers,
+            "compact": args.compact,
+            "seconds": ingest_seconds,
+            "rows_per_sec": rows / ingest_seconds,
+        },
+        "analysis": {"seconds": analysis_seconds},
+        "api": api,
+    }
+
+
+def flatten(results: Dict[str, Any]) -> Dict[str, float]:
+    """Map each metric of a results document to a dotted name."""
+    metrics = {
+        "ingest.rows_per_sec": results["ingest"]["rows_per_sec"],
+        "analysis.seconds": results["analysis"]["seconds"],
+    }
+    for scenario in results["api"]:
+        for key in ("p50_ms", "p99_ms", "requests_per_sec"):
+            metrics[f"api.{scenario['name']}.{key}"] = scenario[key]
+    return metrics
+
+
+def compare(before_path: str, after_path: str) -> None:
+    """Print each metric of two result files with its relative change."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    if before["scale"] != after["scale"]:
+        print("warning: the runs used different scales", file=sys.stderr)
+
+    old, new = flatten(before), flatten(after)
+    print(f"{before['commit'][:10]} -> {after['commit'][:10]}")
+    for name in sorted(old.keys() & new.keys()):
+        change = (new[name] - old[name]) / old[name] * 100 if old[name] else 0
+        print(
+            f"{name:<56} {old[name]:12.2f} {new[name]:12.2f} "
+            f"{change:+7.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the suite")
+    run_parser.add_argument("--database-url", required=True)
+    run_parser.add_argument("--stations", type=int, default=50)
+    run_parser.add_argument("--years", type=int, default=20)
+    run_parser.add_argument("--bulk", action="store_true")
+    run_parser.add_argument("--vectorized", action="store_true")
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Store weather_data with the compact layout (compact.py)",
+    )
+    run_parser.add_argument("--requests", type=int, default=50)
+    run_parser.add_argument("--output", default="bench_results.json")
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two result files"
+    )
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.before, args.after)
+    else:
+        results = run(args)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,137 @@
+"""In-process response cache for the API.
+
+Entries are keyed on the request path, the normalized query arguments, the
+Accept header and the current data generation (see models.DataGeneration).
+Ingestion and analysis bump the generation when they commit, so a cached
+response can never outlive the data it was built from and no TTL is
+needed; entries for old generations simply age out of the LRU.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Hashable, NamedTuple, Optional
+
+from flask import current_app, g, make_response, request
+
+from models import DataGeneration, db
+
+
+class CachedResponse(NamedTuple):
+    """A response body with the headers needed to replay it."""
+
+    body: bytes
+    etag: str
+    mimetype: str
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache bounded by entry count and total body size.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """Return the entry for key, marking it as recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: Hashable, entry: CachedResponse) -> None:
+        """Store an entry, evicting the least recently used ones."""
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.body)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            while (
+                len(self._entries) > self.max_entries
+                or self._size > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Return the response cache of the current app, creating it on first
+    use from RESPONSE_CACHE_MAX_ENTRIES and RESPONSE_CACHE_MAX_BYTES.
+    """
+    cache = current_app.extensions.get("response_cache")
+    if cache is None:
+        cache = ResponseCache(
+            current_app.config.get("RESPONSE_CACHE_MAX_ENTRIES", 1024),
+            current_app.config.get("RESPONSE_CACHE_MAX_BYTES", 64 << 20),
+        )
+        current_app.extensions["response_cache"] = cache
+    return cache
+
+
+def cached_response(view):
+    """
+    Serve a GET view from the response cache.
+
+    Successful responses are stored with a strong ETag derived from the
+    body and sent with Cache-Control: no-cache, so clients revalidate on
+    every poll and receive 304 Not Modified while the data is unchanged.
+
+    Requests that asked for a profile (see profiling) bypass the cache in
+    both directions, so the profile shows the view's own work and its
+    response is not stored.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        profile = g.get("request_profile")
+        if profile is not None and profile.profiled:
+            return view(*args, **kwargs)
+
+        cache = get_response_cache()
+        key = (
+            request.path,
+            tuple(sorted(request.args.items(multi=True))),
+            request.headers.get("Accept"),
+            DataGeneration.current(db.session),
+        )
+
+        entry = cache.get(key)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            entry = CachedResponse(
+                body=body,
+                etag=hashlib.sha1(body).hexdigest(),
+                mimetype=response.mimetype,
+            )
+            cache.set(key, entry)
+        else:
+            response = current_app.response_class(
+                entry.body, mimetype=entry.mimetype
+            )
+
+        response.set_etag(entry.etag)
+        response.cache_control.no_cache = True
+        response.vary.add("Accept")
+        return response.make_conditional(request)
+
+    return wrapper
@@ -0,0 +1,124 @@
+"""Columnar (Apache Arrow IPC stream) encoding for API responses.
+
+Pages are built straight from the selected column tuples, without per-row
+as_dict() dictionaries or JSON encoding, and pagination metadata travels
+in the schema metadata under the "pagination" key.
+"""
+
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+
+class ColumnSchema(NamedTuple):
+    """
+    Columns of a response as (name, Arrow type) pairs, the type given by
+    the name of its pyarrow factory. pyarrow is only imported when a
+    response is actually encoded as Arrow (see arrow_schema()), so
+    importing this module stays cheap for JSON-only processes.
+    """
+
+    fields: Tuple[Tuple[str, str], ...]
+
+    @property
+    def names(self) -> List[str]:
+        """Column names, in order."""
+        return [name for name, _ in self.fields]
+
+
+WEATHER_SCHEMA = ColumnSchema(
+    (
+        ("id", "int64"),
+        ("station_id", "string"),
+        ("date", "date32"),
+        ("max_temp", "float64"),
+        ("min_temp", "float64"),
+        ("precipitation", "float64"),
+    )
+)
+
+STATS_SCHEMA = ColumnSchema(
+    (
+        ("id", "int64"),
+        ("station_id", "string"),
+        ("year", "int32"),
+        ("avg_max_temp", "float64"),
+        ("avg_min_temp", "float64"),
+        ("total_precipitation", "float64"),
+    )
+)
+
+
+ROLLUP_FIELDS = (
+    ("avg_max_temp", "float64"),
+    ("avg_min_temp", "float64"),
+    ("total_precipitation", "float64"),
+    ("max_temp_days", "int32"),
+    ("min_temp_days", "int32"),
+    ("precipitation_days", "int32"),
+)
+
+MONTHLY_STATS_SCHEMA = ColumnSchema(
+    (
+        ("id", "int64"),
+        ("station_id", "string"),
+        ("year", "int32"),
+        ("month", "int32"),
+    )
+    + ROLLUP_FIELDS
+)
+
+SEASONAL_STATS_SCHEMA = ColumnSchema(
+    (
+        ("id", "int64"),
+        ("station_id", "string"),
+        ("year", "int32"),
+        ("season", "string"),
+    )
+    + ROLLUP_FIELDS
+)
+
+
+@lru_cache(maxsize=None)
+def arrow_schema(schema: ColumnSchema):
+    """Build (once) the pyarrow schema of a ColumnSchema."""
+    import pyarrow as pa
+
+    return pa.schema(
+        [(name, getattr(pa, type_name)()) for name, type_name in schema.fields]
+    )
+
+
+def to_arrow_stream(
+    rows: List[Sequence[Any]],
+    schema: ColumnSchema,
+    metadata: Dict[str, Any],
+) -> bytes:
+    """
+    Encode rows as an Arrow IPC stream.
+
+    Args:
+        rows: Row tuples whose values follow the order of schema's fields
+        schema: Columns of the response
+        metadata: JSON-serializable pagination metadata
+
+    Returns:
+        Arrow IPC stream bytes with a single record batch
+    """
+    import pyarrow as pa
+
+    arrow = arrow_schema(schema)
+    columns = list(zip(*rows)) if rows else [[] for _ in arrow]
+    batch = pa.record_batch(
+        [
+            pa.array(values, type=field.type)
+            for values, field in zip(columns, arrow)
+        ],
+        schema=arrow.with_metadata({"pagination": json.dumps(metadata)}),
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
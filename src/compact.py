@@ -0,0 +1,438 @@
+"""Compact storage layout for weather_data on PostgreSQL.
+
+With the compact layout, measurements are stored as the integer tenths
+found in the wx_data files, in SMALLINT columns of weather_data_compact,
+and each station ID is stored once in a stations table and referenced
+by an integer key. weather_data becomes a view over the two tables that
+converts the tenths back to degrees and millimetres, so the API and the
+analysis read exactly the same values as before; ingestion writes to
+weather_data_compact directly.
+
+Enable it for a new database by setting WEATHER_DATA_COMPACT=true
+before the first ingestion (it can't be combined with
+WEATHER_DATA_PARTITIONED), or convert an existing table with:
+
+    python compact.py migrate
+
+To compare the size and scan time of both layouts on the current data
+without changing anything, run this before migrating:
+
+    python compact.py compare
+"""
+
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import (
+    Column,
+    Date,
+    Integer,
+    MetaData,
+    SmallInteger,
+    String,
+    Table,
+    cast,
+    extract,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import insert
+
+from partitioning import SEQUENCE, TABLE, is_partitioned, partitioning_enabled
+
+COMPACT_TABLE = "weather_data_compact"
+STATIONS_TABLE = "stations"
+MEASUREMENTS = ["max_temp", "min_temp", "precipitation"]
+
+# Core tables used to build statements; the DDL is in create_compact_tables
+metadata = MetaData()
+stations = Table(
+    STATIONS_TABLE,
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("station_id", String, nullable=False, unique=True),
+)
+compact_table = Table(
+    COMPACT_TABLE,
+    metadata,
+    Column("station_key", Integer, primary_key=True),
+    Column("date", Date, primary_key=True),
+    Column("id", Integer, nullable=False),
+    *[Column(name, SmallInteger) for name in MEASUREMENTS],
+)
+
+
+def compact_enabled() -> bool:
+    """Whether new weather_data tables should use the compact layout."""
+    return os.getenv("WEATHER_DATA_COMPACT", "").lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+
+
+def is_compact(connection) -> bool:
+    """Whether weather_data exists as the view of the compact layout."""
+    if connection.dialect.name != "postgresql":
+        return False
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :name"),
+        {"name": TABLE},
+    ).scalar()
+    return relkind == "v"
+
+
+def to_tenths(value: Optional[float]) -> Optional[int]:
+    """Convert a parsed measurement back to the integer tenths on file."""
+    return None if value is None else round(value * 10)
+
+
+def create_compact_tables(connection) -> None:
+    """
+    Create the stations and weather_data_compact tables.
+
+    Columns are ordered so that no alignment padding is needed, and the
+    primary key (station_key, date) doubles as the conflict target for
+    ingestion, so the table has no separate index on id. id still comes
+    from weather_data_id_seq, as it is part of the API's rows.
+
+    Args:
+        connection: Connection to run the DDL on
+    """
+    connection.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}"))
+    connection.execute(
+        text(
+            f"CREATE TABLE {STATIONS_TABLE} ("
+            "id SERIAL PRIMARY KEY, "
+            "station_id VARCHAR NOT NULL UNIQUE"
+            ")"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE TABLE {COMPACT_TABLE} ("
+            f"station_key INTEGER NOT NULL REFERENCES {STATIONS_TABLE} (id), "
+            "date DATE NOT NULL, "
+            f"id INTEGER NOT NULL DEFAULT nextval('{SEQUENCE}'), "
+            "max_temp SMALLINT, "
+            "min_temp SMALLINT, "
+            "precipitation SMALLINT, "
+            "PRIMARY KEY (station_key, date)"
+            ")"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE INDEX ix_weather_compact_date_station "
+            f"ON {COMPACT_TABLE} (date, station_key)"
+        )
+    )
+
+
+def create_view(connection, name: str = TABLE) -> None:
+    """
+    Create the view presenting the compact tables as weather_data.
+
+    Dividing by a double precision 10 gives the same floats as the
+    row-by-row parser's float(value) / 10.
+    """
+    measurements = ", ".join(
+        f"d.{column} / 10::double precision AS {column}"
+        for column in MEASUREMENTS
+    )
+    connection.execute(
+        text(
+            f"CREATE VIEW {name} AS "
+            f"SELECT d.id, s.station_id, d.date, {measurements} "
+            f"FROM {COMPACT_TABLE} d "
+            f"JOIN {STATIONS_TABLE} s ON s.id = d.station_key"
+        )
+    )
+
+
+def create_weather_data_compact(engine) -> None:
+    """
+    Create weather_data with the compact layout if it is enabled and the
+    table doesn't exist yet. Otherwise this is a no-op.
+
+    Raises:
+        ValueError: If partitioning is enabled as well
+    """
+    if engine.dialect.name != "postgresql" or not compact_enabled():
+        return
+    if partitioning_enabled():
+        raise ValueError(
+            "WEATHER_DATA_COMPACT can't be combined with "
+            "WEATHER_DATA_PARTITIONED"
+        )
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT to_regclass(:name)"), {"name": TABLE}
+        ).scalar()
+        if exists is None:
+            create_compact_tables(connection)
+            create_view(connection)
+
+
+def drop_compact_tables(connection) -> None:
+    """Drop the compact layout's view and tables if they exist."""
+    if is_compact(connection):
+        connection.execute(text(f"DROP VIEW {TABLE}"))
+    connection.execute(text(f"DROP TABLE IF EXISTS {COMPACT_TABLE}"))
+    connection.execute(text(f"DROP TABLE IF EXISTS {STATIONS_TABLE}"))
+
+
+def station_key(connection, station_id: str) -> int:
+    """Return a station's key, adding the station if it is new."""
+    connection.execute(
+        insert(stations)
+        .values(station_id=station_id)
+        .on_conflict_do_nothing(index_elements=["station_id"])
+    )
+    return connection.execute(
+        select(stations.c.id).where(stations.c.station_id == station_id)
+    ).scalar()
+
+
+def add_stations(connection, station_ids) -> None:
+    """
+    Add the stations of a select of station IDs that aren't known yet,
+    in sorted order so keys follow station IDs within a load.
+    """
+    connection.execute(
+        insert(stations)
+        .from_select(
+            ["station_id"],
+            select(station_ids.c.station_id)
+            .distinct()
+            .order_by(station_ids.c.station_id),
+        )
+        .on_conflict_do_nothing(index_elements=["station_id"])
+    )
+
+
+def delete_station_rows(station_id: str):
+    """Build the delete of all of a station's rows."""
+    return compact_table.delete().where(
+        compact_table.c.station_key
+        == select(stations.c.id)
+        .where(stations.c.station_id == station_id)
+        .scalar_subquery()
+    )
+
+
+def insert_row(key: int, date, max_temp, min_temp, precipitation):
+    """
+    Build the insert of one parsed row into weather_data_compact,
+    skipping it if the station already has a row for the date.
+    """
+    return (
+        insert(compact_table)
+        .values(
+            station_key=key,
+            date=date,
+            max_temp=to_tenths(max_temp),
+            min_temp=to_tenths(min_temp),
+            precipitation=to_tenths(precipitation),
+        )
+        .on_conflict_do_nothing(index_elements=["station_key", "date"])
+    )
+
+
+def merge_rows(source):
+    """
+    Build a statement that inserts the rows of a table of parsed rows
+    (station_id, date and the measurements as floats) into
+    weather_data_compact and counts the new records per station and
+    year. Run add_stations on the same rows first.
+
+    Returns:
+        Select of (station_id, year, count) rows
+    """
+    inserted = (
+        insert(compact_table)
+        .from_select(
+            ["station_key", "date"] + MEASUREMENTS,
+            select(
+                stations.c.id,
+                source.c.date,
+                *[
+                    cast(func.round(source.c[name] * 10), SmallInteger)
+                    for name in MEASUREMENTS
+                ],
+            ).join_from(
+                source, stations, stations.c.station_id == source.c.station_id
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=["station_key", "date"])
+        .returning(
+            compact_table.c.station_key,
+            cast(extract("year", compact_table.c.date), Integer).label("year"),
+        )
+        .cte("inserted")
+    )
+    return (
+        select(stations.c.station_id, inserted.c.year, func.count())
+        .join_from(inserted, stations, stations.c.id == inserted.c.station_key)
+        .group_by(stations.c.station_id, inserted.c.year)
+    )
+
+
+def copy_rows(connection, source: str) -> None:
+    """Copy the rows of a weather_data table into the compact tables."""
+    connection.execute(
+        text(
+            f"INSERT INTO {STATIONS_TABLE} (station_id) "
+            f"SELECT DISTINCT station_id FROM {source} ORDER BY station_id"
+        )
+    )
+    measurements = ", ".join(
+        f"round(w.{column} * 10)::smallint" for column in MEASUREMENTS
+    )
+    connection.execute(
+        text(
+            f"INSERT INTO {COMPACT_TABLE} "
+            f"(station_key, date, id, {', '.join(MEASUREMENTS)}) "
+            f"SELECT s.id, w.date, w.id, {measurements} "
+            f"FROM {source} w "
+            f"JOIN {STATIONS_TABLE} s ON s.station_id = w.station_id"
+        )
+    )
+
+
+def migrate_to_compact(connection) -> None:
+    """
+    Convert an existing weather_data table to the compact layout.
+
+    Rows keep their ids, the id sequence is handed over and the old
+    table is replaced by the view. Run it inside a transaction so a
+    failure leaves the original table untouched.
+
+    Raises:
+        ValueError: If weather_data is partitioned
+    """
+    if is_compact(connection):
+        return
+    if is_partitioned(connection):
+        raise ValueError("A partitioned weather_data can't be made compact")
+
+    create_compact_tables(connection)
+    copy_rows(connection, TABLE)
+    connection.execute(
+        text(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {COMPACT_TABLE}.id")
+    )
+    connection.execute(text(f"DROP TABLE {TABLE}"))
+    create_view(connection)
+
+
+def relation_size(connection, table: str) -> Dict[str, int]:
+    """Return a table's heap, index and total size in bytes."""
+    heap, indexes = connection.execute(
+        text("SELECT pg_table_size(:name), pg_indexes_size(:name)"),
+        {"name": table},
+    ).one()
+    return {"table": heap, "indexes": indexes, "total": heap + indexes}
+
+
+def time_scan(connection, relation: str, runs: int = 5) -> float:
+    """
+    Return the median seconds of a full scan aggregating every
+    measurement of a relation, after one warm-up run.
+    """
+    stmt = text(
+        "SELECT count(*), "
+        + ", ".join(f"sum({column})" for column in MEASUREMENTS)
+        + f" FROM {relation}"
+    )
+    connection.execute(stmt)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        connection.execute(stmt)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def compare_layouts(connection) -> Dict[str, Any]:
+    """
+    Copy weather_data into the compact layout and measure both.
+
+    The copy is made in the connection's transaction, which the caller
+    rolls back, so nothing is left behind.
+
+    Returns:
+        Row count, per-layout sizes in bytes and scan times in seconds
+
+    Raises:
+        ValueError: If weather_data isn't a plain table
+    """
+    if is_compact(connection) or is_partitioned(connection):
+        raise ValueError("weather_data has to be a plain table to compare")
+
+    create_compact_tables(connection)
+    copy_rows(connection, TABLE)
+    create_view(connection, f"{COMPACT_TABLE}_view")
+    for table in (TABLE, STATIONS_TABLE, COMPACT_TABLE):
+        connection.execute(text(f"ANALYZE {table}"))
+
+    compact_sizes = relation_size(connection, COMPACT_TABLE)
+    for key, size in relation_size(connection, STATIONS_TABLE).items():
+        compact_sizes[key] += size
+    return {
+        "rows": connection.execute(
+            text(f"SELECT count(*) FROM {TABLE}")
+        ).scalar(),
+        "current": {
+            "bytes": relation_size(connection, TABLE),
+            "scan_seconds": time_scan(connection, TABLE),
+        },
+        "compact": {
+            "bytes": compact_sizes,
+            "scan_seconds": time_scan(connection, f"{COMPACT_TABLE}_view"),
+            "scan_tenths_seconds": time_scan(connection, COMPACT_TABLE),
+        },
+    }
+
+
+def print_comparison(results: Dict[str, Any]) -> None:
+    """Print compare_layouts' results with the compact/current ratios."""
+    current, compact = results["current"], results["compact"]
+    print(f"{results['rows']} rows")
+    print(f"{'':<24}{'current':>14}{'compact':>14}{'ratio':>8}")
+    for key in ("table", "indexes", "total"):
+        old, new = current["bytes"][key], compact["bytes"][key]
+        ratio = new / old if old else 0
+        print(f"{key + ' bytes':<24}{old:>14}{new:>14}{ratio:>8.2f}")
+    old, new = current["scan_seconds"], compact["scan_seconds"]
+    ratio = new / old if old else 0
+    print(f"{'full scan seconds':<24}{old:>14.3f}{new:>14.3f}{ratio:>8.2f}")
+    print(
+        f"{'  (tenths, no view)':<24}{'':>14}"
+        f"{compact['scan_tenths_seconds']:>14.3f}"
+    )
+
+
+if __name__ == "__main__":
+    from utils import setup_flask_app, init_db
+
+    if sys.argv[1:] not in (["migrate"], ["compare"]):
+        sys.exit(f"Usage: python {sys.argv[0]} migrate|compare")
+
+    app = setup_flask_app()
+    db = init_db(app)
+    with app.app_context():
+        if sys.argv[1] == "compare":
+            with db.engine.connect() as connection:
+                transaction = connection.begin()
+                try:
+                    print_comparison(compare_layouts(connection))
+                finally:
+                    transaction.rollback()
+        else:
+            with db.engine.begin() as connection:
+                migrate_to_compact(connection)
+            print("weather_data now uses the compact layout")
@@ -1,24 +1,103 @@
+import argparse
+import hashlib
+import io
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 import csv
+import re
+import tarfile
+import zipfile
 from datetime import datetime
-from typing import List
-from dotenv import load_dotenv
-from utils import setup_logger, setup_flask_app, init_db
-from models import WeatherData
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from flask import Flask
+from utils import ErrorSampler, create_db_app, setup_logger
+from models import (
+    db,
+    DataGeneration,
+    IngestManifest,
+    StationVersion,
+    WeatherData,
+    WeatherRowCount,
+    WeatherStatsPending,
+)
+from wx_parser import parse_wx_bytes, to_copy_text, to_rows
+from metrics import instrument_engine, phase, record_rows, write_job_metrics
+from compact import (
+    add_stations,
+    create_weather_data_compact,
+    delete_station_rows,
+    insert_row,
+    is_compact,
+    merge_rows,
+    station_key,
+)
+from partitioning import (
+    TABLE,
+    create_weather_data_table,
+    ensure_year_partitions,
+    is_partitioned,
+)
+from station_cache import refresh_stations
+from sqlalchemy import (
+    Column,
+    Date,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    cast,
+    delete,
+    extract,
+    func,
+    inspect,
+    select,
+    text,
+)
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.dialects.postgresql import insert
 import time
 
-# Load environment variables
-load_dotenv(override=True)
-
 # Setup logger
 logger = setup_logger("weather_ingestion.log")
 
-# Create and configure Flask app
-app = setup_flask_app()
-db = init_db(app)
+# Session-local staging table used by the bulk (COPY) loader. Rows are
+# cleared on every commit so each batch starts from an empty table.
+staging_table = Table(
+    "weather_data_staging",
+    MetaData(),
+    Column("station_id", String, nullable=False),
+    Column("date", Date, nullable=False),
+    Column("max_temp", Float),
+    Column("min_temp", Float),
+    Column("precipitation", Float),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DELETE ROWS",
+)
+
+STAGING_COLUMNS = [
+    "station_id",
+    "date",
+    "max_temp",
+    "min_temp",
+    "precipitation",
+]
+
+# Archives are read member by member, in blocks of about this many bytes
+ARCHIVE_SUFFIXES = (".tar.gz", ".tgz", ".tar", ".zip")
+ARCHIVE_CHUNK_SIZE = 1 << 20
+YEAR_AT_LINE_START = re.compile(rb"^(\d{4})\d{4}\t", re.MULTILINE)
 
 
 def create_db_if_not_exists() -> None:
@@ -27,123 +106,1272 @@ def create_db_if_not_exists() -> None:
     This function ensures that the necessary database structure is in
     place before ingestion.
     """
-    with app.app_context():
-        if not database_exists(db.engine.url):
-            create_database(db.engine.url)
-            logger.info(f"Created database: {db.engine.url}")
+    if not database_exists(db.engine.url):
+        create_database(db.engine.url)
+        logger.info(f"Created database: {db.engine.url}")
+
+    create_weather_data_compact(db.engine)
+    create_weather_data_table(db.engine)
+    WeatherData.__table__.create(db.engine, checkfirst=True)
+    logger.info("WeatherData table created (if it didn't exist)")
+
+    with db.engine.connect() as connection:
+        partitioned = is_partitioned(connection)
+        compact = is_compact(connection)
+    if partitioned:
+        logger.info("WeatherData is partitioned by year")
+    elif compact:
+        logger.info("WeatherData uses the compact layout")
+    else:
+        # Tables created by earlier versions lack the secondary indexes
+        for index in WeatherData.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        logger.info("WeatherData indexes created (if they didn't exist)")
+
+    IngestManifest.__table__.create(db.engine, checkfirst=True)
+    logger.info("IngestManifest table created (if it didn't exist)")
+
+    WeatherStatsPending.__table__.create(db.engine, checkfirst=True)
+    logger.info("WeatherStatsPending table created (if it didn't exist)")
+
+    DataGeneration.__table__.create(db.engine, checkfirst=True)
+    logger.info("DataGeneration table created (if it didn't exist)")
+
+    StationVersion.__table__.create(db.engine, checkfirst=True)
+    logger.info("StationVersion table created (if it didn't exist)")
+
+    if not inspect(db.engine).has_table(WeatherRowCount.__tablename__):
+        WeatherRowCount.__table__.create(db.engine)
+        backfill_row_counts()
+        logger.info("WeatherRowCount table created and backfilled")
+
+
+def backfill_row_counts() -> None:
+    """
+    Fill weather_row_counts from the rows already in weather_data.
+    """
+    year = cast(extract("year", WeatherData.date), Integer)
+    db.session.execute(
+        insert(WeatherRowCount).from_select(
+            ["station_id", "year", "row_count"],
+            select(WeatherData.station_id, year, func.count()).group_by(
+                WeatherData.station_id, year
+            ),
+        )
+    )
+    db.session.commit()
+
+
+def parse_row(
+    row: List[str],
+) -> Tuple[datetime, Optional[float], Optional[float], Optional[float]]:
+    """
+    Convert a raw wx_data row into typed values.
+
+    Args:
+        row: Tab-separated fields: date, max temp, min temp, precipitation
+
+    Returns:
+        Tuple of (date, max_temp, min_temp, precipitation) where missing
+        values ('-9999') are None
+
+    Raises:
+        ValueError: If a field cannot be converted
+    """
+    # Convert date string to datetime object
+    date = datetime.strptime(row[0], "%Y%m%d")
+
+    # Convert temperature values, handling special case '-9999'.
+    # Divide by 10 to convert tenths of degrees to degrees
+    max_temp = float(row[1]) / 10 if row[1] != "-9999" else None
+    min_temp = float(row[2]) / 10 if row[2] != "-9999" else None
+
+    # Convert precipitation, handling special case '-9999'
+    # Divide by 10 to convert tenths of mm to mm
+    precipitation = float(row[3]) / 10 if row[3] != "-9999" else None
+
+    return date, max_temp, min_temp, precipitation
+
+
+def _hash_prefix(path: str, length: int) -> str:
+    """Return the SHA-256 hex digest of the first `length` bytes of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 16))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def file_state(path: str) -> Dict[str, Any]:
+    """
+    Snapshot a weather file for the ingestion manifest.
+
+    Only complete lines are considered ingestible, so a trailing line
+    that is still being written is left for the next run.
+
+    Args:
+        path: Path to the weather file
+
+    Returns:
+        Dict with size, mtime, ingested_bytes (offset just past the last
+        newline), content_hash (SHA-256 of those bytes) and last_date
+        (date of the last complete row, if it parses)
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    ingested_bytes = 0
+    last_line = b""
+    pending = b""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            pending += chunk
+            cut = pending.rfind(b"\n") + 1
+            if cut:
+                complete = pending[:cut]
+                digest.update(complete)
+                ingested_bytes += cut
+                last_line = complete.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+                pending = pending[cut:]
+
+    try:
+        last_date = datetime.strptime(
+            last_line.split(b"\t")[0].decode().strip(), "%Y%m%d"
+        ).date()
+    except ValueError:
+        last_date = None
+
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "ingested_bytes": ingested_bytes,
+        "content_hash": digest.hexdigest(),
+        "last_date": last_date,
+    }
+
+
+def load_manifest() -> Dict[str, Any]:
+    """
+    Load the ingestion manifest.
+
+    Returns:
+        Mapping of file name to its manifest row
+    """
+    rows = db.session.query(
+        IngestManifest.file_name,
+        IngestManifest.size,
+        IngestManifest.mtime,
+        IngestManifest.content_hash,
+        IngestManifest.ingested_bytes,
+    ).all()
+    return {row.file_name: row for row in rows}
+
+
+def plan_file(path: str, entry: Optional[Any]) -> Optional[int]:
+    """
+    Decide how much of a weather file needs to be ingested.
+
+    Args:
+        path: Path to the weather file
+        entry: Manifest row for the file, or None if it was never ingested
+
+    Returns:
+        None if the file is unchanged and can be skipped, otherwise the
+        byte offset to start reading from: the stored offset if rows were
+        only appended, or 0 if the file has to be re-ingested in full
+    """
+    if entry is None:
+        return 0
+
+    stat = os.stat(path)
+    if stat.st_size == entry.size and stat.st_mtime == entry.mtime:
+        return None
+
+    # Rows were only appended if the previously ingested bytes are intact
+    if stat.st_size >= entry.ingested_bytes and (
+        _hash_prefix(path, entry.ingested_bytes) == entry.content_hash
+    ):
+        return entry.ingested_bytes
+
+    return 0
+
+
+def read_bytes(path: str, start: int, end: int) -> bytes:
+    """
+    Read the bytes of a weather file between two offsets.
+
+    Args:
+        path: Path to the weather file
+        start: Byte offset to start reading from
+        end: Byte offset to stop at (the manifest's ingested_bytes)
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(max(end - start, 0))
+
+
+def station_id_of(file: str) -> str:
+    """Return the station ID of a weather file: its name up to the dot."""
+    return os.path.basename(file).split(".")[0]
+
+
+def parse_columns(data: bytes, file: str):
+    """
+    Parse a block of complete lines with the NumPy column parser.
+
+    Returns:
+        WxColumns, or None if a row is malformed and the block has to go
+        through the row-by-row parser instead
+    """
+    try:
+        return parse_wx_bytes(data)
+    except ValueError as e:
+        logger.warning(f"Falling back to row parser for file {file}: {e}")
+        return None
+
+
+def parse_block(
+    data: bytes, file: str, errors: ErrorSampler
+) -> Iterator[
+    Tuple[datetime, Optional[float], Optional[float], Optional[float]]
+]:
+    """
+    Yield converted rows from a block of complete lines, reporting rows
+    that fail to convert to the file's error sampler.
+    """
+    for row in csv.reader(io.StringIO(data.decode()), delimiter="\t"):
+        try:
+            yield parse_row(row)
+        except ValueError as e:
+            # Log any data conversion errors
+            errors.error(
+                f"Error converting data in row {row} in file "
+                f"{file}: {e}"
+            )
+        except Exception as e:
+            # Log any other unexpected errors
+            errors.error(
+                f"Unexpected error processing row {row} in file "
+                f"{file}: {e}"
+            )
+
+
+def parse_chunks(
+    chunks: Iterable[bytes], file: str, vectorized: bool = False
+) -> Iterator[
+    Tuple[datetime, Optional[float], Optional[float], Optional[float]]
+]:
+    """
+    Yield converted rows from blocks of complete lines of one weather
+    file, logging rows that fail to convert.
+
+    Args:
+        chunks: Blocks of the file, each ending on a line boundary
+        file: Name of the file, used in log messages
+        vectorized: Parse each block with the NumPy parser; blocks with
+            malformed rows fall back to the row-by-row parser so the bad
+            rows are still reported individually
+    """
+    errors = ErrorSampler(logger, f"file {file}")
+    for data in chunks:
+        columns = parse_columns(data, file) if vectorized else None
+        if columns is not None:
+            yield from to_rows(columns)
+        else:
+            yield from parse_block(data, file, errors)
+    errors.summary()
+
+
+def parse_rows(
+    path: str, start: int, end: int, file: str, vectorized: bool = False
+) -> Iterator[
+    Tuple[datetime, Optional[float], Optional[float], Optional[float]]
+]:
+    """
+    Yield converted rows from a weather file, logging rows that fail to
+    convert.
+
+    Args:
+        path: Path to the weather file
+        start: Byte offset to start reading from
+        end: Byte offset to stop at
+        file: Name of the file, used in log messages
+        vectorized: Parse the whole range with the NumPy parser
+    """
+    yield from parse_chunks([read_bytes(path, start, end)], file, vectorized)
+
+
+def record_manifest(file: str, state: Dict[str, Any]) -> None:
+    """
+    Upsert the manifest row for a file in the current transaction, so it
+    is committed (or rolled back) together with the file's rows.
+
+    Args:
+        file: Name of the weather file
+        state: Snapshot returned by file_state
+    """
+    values = dict(state, ingested_at=datetime.now())
+    stmt = insert(IngestManifest).values(file_name=file, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["file_name"], set_=values
+    )
+    db.session.execute(stmt)
+
+
+def mark_stats_pending(station_years: Set[Tuple[str, int]]) -> None:
+    """
+    Queue station-years for incremental analysis in the current
+    transaction, so they are committed together with the new records.
+
+    Args:
+        station_years: (station ID, year) pairs that received new records
+    """
+    if not station_years:
+        return
+    stmt = insert(WeatherStatsPending).values(
+        [
+            {"station_id": station_id, "year": year}
+            for station_id, year in sorted(station_years)
+        ]
+    )
+    stmt = stmt.on_conflict_do_nothing(index_elements=["station_id", "year"])
+    db.session.execute(stmt)
+
+
+def record_row_counts(new_counts: Dict[Tuple[str, int], int]) -> None:
+    """
+    Add newly inserted rows to weather_row_counts in the current
+    transaction.
+
+    Args:
+        new_counts: Number of new records per (station ID, year)
+    """
+    if not new_counts:
+        return
+    stmt = insert(WeatherRowCount).values(
+        [
+            {"station_id": station_id, "year": year, "row_count": count}
+            for (station_id, year), count in sorted(new_counts.items())
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["station_id", "year"],
+        set_={
+            "row_count": WeatherRowCount.row_count + stmt.excluded.row_count
+        },
+    )
+    db.session.execute(stmt)
+
+
+def clear_station(station_id: str) -> None:
+    """
+    Delete a station's rows and row counts in the current transaction,
+    before its file is re-ingested in full, so rows that were edited or
+    removed since the last run don't survive the reload. Its years are
+    queued for analysis and its version is bumped, which makes its
+    station cache file stale once the transaction commits.
+
+    Args:
+        station_id: Station whose file is re-read from the start
+    """
+    # Queue every year the station had before the reload, not only those
+    # the new file holds, so analysis drops the rollups of years that
+    # disappeared from it
+    counts = WeatherRowCount.station_id == station_id
+    years = db.session.execute(select(WeatherRowCount.year).where(counts))
+    mark_stats_pending({(station_id, year) for year in years.scalars()})
+    db.session.execute(delete(WeatherRowCount).where(counts))
+
+    if is_compact(db.session.connection()):
+        db.session.execute(delete_station_rows(station_id))
+    else:
+        db.session.execute(
+            delete(WeatherData).where(WeatherData.station_id == station_id)
+        )
+
+    StationVersion.bump(db.session, {station_id})
+
+
+def year_span(path: str, start: int) -> Optional[Tuple[int, int]]:
+    """
+    Return the years of the first row after an offset and of the last row
+    of a weather file, or None if there is nothing to read.
+
+    Station files are sorted by date, so this bounds the years a run
+    will insert into.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        first = f.readline()
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 4096, start))
+        last = f.read().rstrip(b"\n").rsplit(b"\n", 1)[-1]
+    try:
+        return int(first[:4]), int(last[:4])
+    except ValueError:
+        return None
+
+
+def create_partitions(years: Set[int]) -> None:
+    """
+    Create the yearly weather_data partitions for some years, if
+    weather_data is partitioned, in a short transaction of its own.
+
+    Creating a partition locks weather_data exclusively, so this must
+    run while the caller's session holds no lock on it (before its
+    transaction touches weather_data). An advisory lock serializes
+    concurrent workers creating the same partitions.
+    """
+    if not years or db.engine.dialect.name != "postgresql":
+        return
+    with db.engine.begin() as connection:
+        if not is_partitioned(connection):
+            return
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:name))"),
+            {"name": TABLE},
+        )
+        ensure_year_partitions(connection, years)
+
+
+def ensure_partitions_for(
+    data_dir: str, pending: List[Tuple[str, int, bool]]
+):
+    """
+    Create the yearly weather_data partitions the pending plain files
+    need, up front and in one short transaction, so workers never race
+    on DDL. Archives can't be sampled without decompressing them, so
+    their workers create partitions as they read them instead (see
+    ingest_archive).
+    """
+    years: Set[int] = set()
+    for file, offset, _ in pending:
+        if is_archive(file):
+            continue
+        span = year_span(os.path.join(data_dir, file), offset)
+        if span:
+            years.update(range(min(span), max(span) + 1))
+    create_partitions(years)
+    logger.info(f"Ensured partitions for {len(years)} years")
+
+
+def is_archive(file: str) -> bool:
+    """Return whether a file name is one of the ARCHIVE_SUFFIXES."""
+    return file.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def archive_state(path: str) -> Dict[str, Any]:
+    """
+    Snapshot an archive for the ingestion manifest.
+
+    Archives are always read in full, so the whole file is hashed and
+    counted as ingested.
+    """
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "ingested_bytes": stat.st_size,
+        "content_hash": _hash_prefix(path, stat.st_size),
+        "last_date": None,
+    }
+
+
+def archive_members(path: str) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Yield the name and a decompressing reader of each file in a .tar.gz,
+    .tgz, .tar or .zip archive, one member at a time.
+
+    Nothing is extracted to disk. Tar archives are opened in stream mode,
+    so each member's reader is only valid until the next one is yielded.
+
+    Args:
+        path: Path to the archive
 
-        WeatherData.__table__.create(db.engine, checkfirst=True)
-        logger.info("WeatherData table created (if it didn't exist)")
+    Yields:
+        (file name without its directory, binary file object) pairs
+    """
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or name.startswith("."):
+                    continue
+                with archive.open(info) as member:
+                    yield name, member
+        return
+
+    with tarfile.open(path, mode="r|*") as archive:
+        for info in archive:
+            name = os.path.basename(info.name)
+            # Skip directories and macOS resource forks (._USC...)
+            if not info.isfile() or name.startswith("."):
+                continue
+            yield name, archive.extractfile(info)
 
 
-def ingest_weather_data(data_dir="data/wx_data/") -> None:
+def line_chunks(
+    stream: BinaryIO, size: int = ARCHIVE_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Read a stream in blocks of about `size` bytes that end on a line
+    boundary, so each block can be parsed on its own.
+    """
+    pending = b""
+    for block in iter(lambda: stream.read(size), b""):
+        pending += block
+        cut = pending.rfind(b"\n") + 1
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+    # Archived files are complete, so a last line without a newline counts
+    if pending.strip():
+        yield pending
+
+
+def chunk_years(chunks: Iterable[bytes], years: Set[int]) -> Iterator[bytes]:
+    """
+    Pass blocks of a weather file through, adding the years of their
+    rows to a set as they go by.
+    """
+    for data in chunks:
+        years.update(int(year) for year in YEAR_AT_LINE_START.findall(data))
+        yield data
+
+
+def insert_rows(
+    rows: Iterable[
+        Tuple[datetime, Optional[float], Optional[float], Optional[float]]
+    ],
+    file: str,
+) -> Tuple[int, Dict[Tuple[str, int], int]]:
+    """
+    Insert a weather file's rows with one INSERT per row in the current
+    transaction.
+
+    Args:
+        rows: Converted rows of the file
+        file: Name of the file; its stem is used as the station ID
+
+    Returns:
+        Tuple of (records processed, new records per (station ID, year))
+    """
+    station_id = station_id_of(file)
+    records = 0
+    new_counts: Dict[Tuple[str, int], int] = {}
+    connection = db.session.connection()
+    compact_key = None
+    if is_compact(connection):
+        compact_key = station_key(connection, station_id)
+    errors = ErrorSampler(logger, f"file {file}")
+    for row in rows:
+        try:
+            date, max_temp, min_temp, precipitation = row
+
+            if compact_key is not None:
+                stmt = insert_row(
+                    compact_key, date, max_temp, min_temp, precipitation
+                )
+            else:
+                # Prepare insert statement
+                stmt = insert(WeatherData).values(
+                    station_id=station_id,
+                    date=date,
+                    max_temp=max_temp,
+                    min_temp=min_temp,
+                    precipitation=precipitation,
+                )
+
+                # Add on_conflict_do_nothing clause to avoid duplicate
+                # entries
+                stmt = stmt.on_conflict_do_nothing(
+                    index_elements=["station_id", "date"]
+                )
+
+            # Execute the insert statement
+            result = db.session.execute(stmt)
+            if result.rowcount > 0:
+                count_key = (station_id, date.year)
+                new_counts[count_key] = new_counts.get(count_key, 0) + 1
+
+            records += 1
+        except Exception as e:
+            # Log any other unexpected errors
+            errors.error(
+                f"Unexpected error processing row {row} in file "
+                f"{file}: {e}"
+            )
+    errors.summary()
+    return records, new_counts
+
+
+def commit_file(
+    file: str, new_counts: Dict[Tuple[str, int], int]
+) -> Optional[int]:
+    """
+    Queue a file's new records for analysis and commit its transaction.
+
+    Args:
+        file: Name of the file, used in log messages
+        new_counts: New records per (station ID, year)
+
+    Returns:
+        Number of new records committed, or None if the commit failed
+    """
+    new_records = sum(new_counts.values())
+    mark_stats_pending(set(new_counts))
+    record_row_counts(new_counts)
+    StationVersion.bump(db.session, {station for station, _ in new_counts})
+    if new_records:
+        DataGeneration.bump(db.session)
+
+    try:
+        # Commit the transaction for each file
+        db.session.commit()
+        logger.info(
+            f"Successfully ingested file: {file}. New records: "
+            f"{new_records}"
+        )
+    except IntegrityError:
+        # If there's an integrity error, rollback the transaction
+        db.session.rollback()
+        logger.error(f"Failed to commit data for file: {file}")
+        return None
+
+    return new_records
+
+
+def ingest_file(
+    data_dir: str,
+    file: str,
+    offset: int = 0,
+    vectorized: bool = False,
+    reload: bool = False,
+) -> Tuple[int, Optional[int]]:
+    """
+    Ingest a single weather file with one INSERT per row.
+
+    Args:
+        data_dir: Directory containing the weather files
+        file: Name of the file; its stem is used as the station ID
+        offset: Byte offset to start reading from
+        vectorized: Parse the file with the NumPy column parser
+        reload: Replace the station's rows instead of adding to them
+
+    Returns:
+        Tuple of (records processed, new records inserted), the latter
+        None if the file's transaction failed to commit
+    """
+    logger.info(f"Processing file: {file}")
+    path = os.path.join(data_dir, file)
+    state = file_state(path)
+    if reload:
+        clear_station(station_id_of(file))
+    records, new_counts = insert_rows(
+        parse_rows(path, offset, state["ingested_bytes"], file, vectorized),
+        file,
+    )
+    record_manifest(file, state)
+    return records, commit_file(file, new_counts)
+
+
+def _copy_value(value: Optional[float]) -> str:
+    """Format a value for PostgreSQL's COPY text format."""
+    return "\\N" if value is None else repr(value)
+
+
+def stage_chunks(
+    cursor, chunks: Iterable[bytes], file: str, vectorized: bool = False
+) -> int:
+    """
+    Parse blocks of a weather file and COPY their rows into the staging
+    table, one COPY per block.
+
+    Rows that fail to convert are logged and skipped, exactly like the
+    row-by-row path.
+
+    Args:
+        cursor: DBAPI cursor on the connection owning the staging table
+        chunks: Blocks of the file, each ending on a line boundary
+        file: Name of the file; its stem is used as the station ID
+        vectorized: Parse and format blocks with the NumPy column parser
+
+    Returns:
+        Number of rows staged
+    """
+    station_id = station_id_of(file)
+    records = 0
+    errors = ErrorSampler(logger, f"file {file}")
+    for data in chunks:
+        buffer = io.StringIO()
+        columns = parse_columns(data, file) if vectorized else None
+        if columns is not None:
+            buffer.write(to_copy_text(columns, station_id))
+            records += len(columns.date)
+        else:
+            for date, max_temp, min_temp, precipitation in parse_block(
+                data, file, errors
+            ):
+                buffer.write(
+                    f"{station_id}\t{date:%Y-%m-%d}\t"
+                    f"{_copy_value(max_temp)}\t{_copy_value(min_temp)}\t"
+                    f"{_copy_value(precipitation)}\n"
+                )
+                records += 1
+
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {staging_table.name} ({', '.join(STAGING_COLUMNS)}) "
+            "FROM STDIN",
+            buffer,
+        )
+    errors.summary()
+    return records
+
+
+def stage_file(
+    cursor,
+    data_dir: str,
+    file: str,
+    offset: int,
+    state: Dict[str, Any],
+    vectorized: bool = False,
+) -> int:
+    """
+    Parse a weather file and COPY its rows into the staging table.
+
+    Args:
+        cursor: DBAPI cursor on the connection owning the staging table
+        data_dir: Directory containing the weather files
+        file: Name of the file; its stem is used as the station ID
+        offset: Byte offset to start reading from
+        state: Snapshot returned by file_state, bounding the read
+        vectorized: Parse and format the file with the NumPy column parser
+
+    Returns:
+        Number of rows staged
+    """
+    logger.info(f"Processing file: {file}")
+    data = read_bytes(
+        os.path.join(data_dir, file), offset, state["ingested_bytes"]
+    )
+    return stage_chunks(cursor, [data], file, vectorized)
+
+
+def merge_staged_rows() -> Dict[Tuple[str, int], int]:
+    """
+    Move staged rows into weather_data with a single set-based insert.
+
+    Returns:
+        Mapping of (station ID, year) to the number of new records inserted
+    """
+    connection = db.session.connection()
+    if is_compact(connection):
+        add_stations(connection, staging_table)
+        counts = connection.execute(merge_rows(staging_table))
+        return {
+            (station_id, year): count for station_id, year, count in counts
+        }
+
+    inserted = (
+        insert(WeatherData)
+        .from_select(
+            STAGING_COLUMNS,
+            select(*[staging_table.c[name] for name in STAGING_COLUMNS]),
+        )
+        .on_conflict_do_nothing(index_elements=["station_id", "date"])
+        .returning(
+            WeatherData.station_id,
+            cast(extract("year", WeatherData.date), Integer).label("year"),
+        )
+        .cte("inserted")
+    )
+    counts = db.session.execute(
+        select(inserted.c.station_id, inserted.c.year, func.count()).group_by(
+            inserted.c.station_id, inserted.c.year
+        )
+    )
+    return {(station_id, year): count for station_id, year, count in counts}
+
+
+def staging_cursor():
+    """
+    Create the staging table on the session's connection if needed.
+
+    Returns:
+        DBAPI cursor on the connection owning the staging table
+    """
+    connection = db.session.connection()
+    staging_table.create(connection, checkfirst=True)
+    return connection.connection.cursor()
+
+
+def commit_staged(
+    staged: Dict[str, int]
+) -> Dict[str, Tuple[int, Optional[int]]]:
+    """
+    Merge the staged rows of some files into weather_data and commit.
+
+    Args:
+        staged: Mapping of file name to the number of rows it staged
+
+    Returns:
+        Mapping of file name to (records processed, new records
+        inserted), the latter None if the commit failed
+    """
+    connection = db.session.connection()
+    if is_partitioned(connection):
+        # Rows outside the years found up front (unsorted files) still
+        # need a partition before they can be merged
+        staged_years = connection.execute(
+            select(
+                cast(extract("year", staging_table.c.date), Integer)
+            ).distinct()
+        ).scalars()
+        ensure_year_partitions(connection, staged_years)
+
+    new_counts = merge_staged_rows()
+    mark_stats_pending(set(new_counts))
+    record_row_counts(new_counts)
+    StationVersion.bump(db.session, {station for station, _ in new_counts})
+    if new_counts:
+        DataGeneration.bump(db.session)
+
+    station_counts: Dict[str, int] = {}
+    for (station_id, _), count in new_counts.items():
+        station_counts[station_id] = station_counts.get(station_id, 0) + count
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        for file in staged:
+            logger.error(f"Failed to commit data for file: {file}")
+        return {file: (staged[file], None) for file in staged}
+
+    results = {}
+    for file in staged:
+        new_records = station_counts.get(station_id_of(file), 0)
+        logger.info(
+            f"Successfully ingested file: {file}. New records: "
+            f"{new_records}"
+        )
+        results[file] = (staged[file], new_records)
+    return results
+
+
+def ingest_batch_bulk(
+    data_dir: str,
+    batch: List[Tuple[str, int, bool]],
+    vectorized: bool = False,
+) -> Dict[str, Tuple[int, Optional[int]]]:
+    """
+    Ingest a batch of weather files through COPY and a staging table.
+
+    All files in the batch are loaded in one transaction; if it fails,
+    none of them are committed.
+
+    Args:
+        data_dir: Directory containing the weather files
+        batch: (file name, start offset, reload) triples to load
+            together; files to reload replace their station's rows
+        vectorized: Parse files with the NumPy column parser
+
+    Returns:
+        Mapping of file name to (records processed, new records
+        inserted), the latter None for files that failed to commit
+    """
+    cursor = staging_cursor()
+    staged = {}
+    for file, offset, reload in batch:
+        state = file_state(os.path.join(data_dir, file))
+        if reload:
+            clear_station(station_id_of(file))
+        staged[file] = stage_file(
+            cursor, data_dir, file, offset, state, vectorized
+        )
+        record_manifest(file, state)
+    return commit_staged(staged)
+
+
+def ingest_archive(
+    data_dir: str,
+    archive: str,
+    bulk: bool,
+    batch_size: int = 20,
+    vectorized: bool = False,
+    reload: bool = False,
+) -> Tuple[int, Optional[int]]:
+    """
+    Ingest every weather file in an archive without extracting it.
+
+    Members are decompressed once, one at a time, in blocks of
+    ARCHIVE_CHUNK_SIZE bytes. Each member's name gives its station ID,
+    as for plain files. Members are committed like plain files (one per
+    transaction, or batch_size per transaction in bulk mode), and the
+    archive is only recorded in the manifest once all of them are
+    committed, so a run after a failed transaction reads the archive
+    again.
+
+    The partitions a transaction needs are created (see
+    create_partitions) from the years seen while reading, before the
+    transaction touches weather_data: in bulk mode members are staged
+    first and their stations cleared for a reload only before the
+    merge, and in row mode each member's blocks are held in memory
+    until its partitions exist, which costs one station file at a time.
+
+    Args:
+        data_dir: Directory containing the archive
+        archive: File name of the archive
+        bulk: Load members with COPY and a set-based merge
+        batch_size: Members merged per transaction in bulk mode
+        vectorized: Parse members with the NumPy column parser
+        reload: Replace the rows of each member's station instead of
+            adding to them
+
+    Returns:
+        Tuple of (records processed, new records inserted), the latter
+        None if a member's transaction failed to commit
+    """
+    logger.info(f"Processing archive: {archive}")
+    path = os.path.join(data_dir, archive)
+    state = archive_state(path)
+    # (records processed, new records or None) per committed transaction
+    results: List[Tuple[int, Optional[int]]] = []
+
+    if bulk:
+        staged: Dict[str, int] = {}
+        years: Set[int] = set()
+
+        def merge_batch() -> None:
+            # Staging only writes the staging table, so nothing holds a
+            # lock on weather_data yet
+            create_partitions(years)
+            years.clear()
+            if reload:
+                for file in staged:
+                    clear_station(station_id_of(file))
+            results.extend(commit_staged(staged).values())
+            staged.clear()
+
+        for file, member in archive_members(path):
+            logger.info(f"Processing file: {archive}/{file}")
+            staged[file] = stage_chunks(
+                staging_cursor(),
+                chunk_years(line_chunks(member), years),
+                file,
+                vectorized,
+            )
+            if len(staged) == batch_size:
+                merge_batch()
+        # The manifest entry commits with the last batch, if the others
+        # did
+        if all(new is not None for _, new in results):
+            record_manifest(archive, state)
+        if staged:
+            merge_batch()
+        else:
+            db.session.commit()
+    else:
+        for file, member in archive_members(path):
+            logger.info(f"Processing file: {archive}/{file}")
+            member_years: Set[int] = set()
+            chunks = list(chunk_years(line_chunks(member), member_years))
+            create_partitions(member_years)
+            if reload:
+                clear_station(station_id_of(file))
+            member_records, new_counts = insert_rows(
+                parse_chunks(chunks, file, vectorized), file
+            )
+            results.append((member_records, commit_file(file, new_counts)))
+        if all(new is not None for _, new in results):
+            record_manifest(archive, state)
+            db.session.commit()
+
+    records = sum(member_records for member_records, _ in results)
+    if any(new is None for _, new in results):
+        logger.error(
+            f"Not all of archive {archive} was committed; it will be "
+            "read again on the next run"
+        )
+        return records, None
+    return records, sum(new for _, new in results)
+
+
+def init_worker(config: Dict[str, Any]) -> None:
+    """
+    Set up a worker process: create its own app from the parent's
+    settings and keep its context pushed for the worker's lifetime.
+    """
+    create_db_app(config).app_context().push()
+
+
+def ingest_batch(
+    data_dir: str,
+    batch: List[Tuple[str, int, bool]],
+    bulk: bool,
+    vectorized: bool = False,
+    batch_size: int = 20,
+) -> Dict[str, Tuple[int, Optional[int]]]:
+    """
+    Ingest a batch of weather files in the current app context.
+
+    This is the unit of work handed to worker processes, so it only
+    takes picklable arguments and returns plain per-file totals.
+
+    Args:
+        data_dir: Directory containing the weather files
+        batch: (file name, start offset, reload) triples to ingest, or
+            a single archive; files to reload replace their station's
+            rows
+        bulk: Use the COPY-based loader instead of per-row inserts
+        vectorized: Parse files with the NumPy column parser
+        batch_size: Archive members merged per transaction in bulk mode
+
+    Returns:
+        Mapping of file name to (records processed, new records
+        inserted), the latter None for files that failed to commit
+    """
+    if is_archive(batch[0][0]):
+        return {
+            file: ingest_archive(
+                data_dir, file, bulk, batch_size, vectorized, reload
+            )
+            for file, _, reload in batch
+        }
+    if bulk:
+        return ingest_batch_bulk(data_dir, batch, vectorized)
+    return {
+        file: ingest_file(data_dir, file, offset, vectorized, reload)
+        for file, offset, reload in batch
+    }
+
+
+def ingest_weather_data(
+    data_dir: str = os.path.join("data", "wx_data"),
+    bulk: bool = False,
+    batch_size: int = 20,
+    workers: int = 1,
+    full: bool = False,
+    vectorized: bool = False,
+    app: Optional[Flask] = None,
+) -> None:
     """
     Ingest weather data from CSV files into the database.
     This function reads weather data files, processes them, and inserts
     the data into the database. It handles data conversion, error logging,
     and provides a summary of the ingestion process.
+
+    Args:
+        data_dir: Directory containing the weather files and/or archives
+            of them (ARCHIVE_SUFFIXES), or the path of a single archive
+        bulk: Load files through COPY into a staging table and merge
+            them with one INSERT ... SELECT per batch instead of issuing
+            one INSERT per row
+        batch_size: Number of files merged per transaction in bulk mode
+        workers: Number of worker processes; each opens its own database
+            connections and commits every file (or bulk batch) separately
+        full: Ignore the ingestion manifest and re-read every file. By
+            default unchanged files are skipped and files that only had
+            rows appended are read from where the last run stopped.
+            Files read again from the start (changed files, or every
+            file with full) replace their station's rows, so edited
+            rows are updated
+        vectorized: Parse each file in one pass with the NumPy column
+            parser (wx_parser) instead of csv.reader and strptime
+        app: App whose database to load into; by default one is created
+            from the configuration with create_db_app()
+
+    With STATION_CACHE_DIR set, the cache files of the stations whose
+    rows changed are rebuilt at the end (see station_cache.py).
     """
-    create_db_if_not_exists()
+    app = app or create_db_app()
+    with app.app_context():
+        start_time = time.time()
+        instrument_engine(db.engine)
+        with phase("ingest", "setup"):
+            create_db_if_not_exists()
 
-    data_dir = os.path.join("data", "wx_data")
-    files: List[str] = os.listdir(data_dir)
+        if os.path.isfile(data_dir):
+            data_dir, archive = os.path.split(data_dir)
+            files: List[str] = [archive]
+        else:
+            files = os.listdir(data_dir)
 
-    start_time = time.time()
-    logger.info(
-        f"Starting data ingestion at "
-        f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    )
-    logger.info(f"Found {len(files)} weather files to process")
+        logger.info(
+            f"Starting data ingestion at "
+            f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+        logger.info(f"Found {len(files)} weather files to process")
 
-    total_records = 0
-    total_new_records = 0
+        total_records = 0
+        total_new_records = 0
+        failed_files: List[str] = []
 
-    with app.app_context():
-        for file in files:
-            logger.info(f"Processing file: {file}")
-            new_records = 0
-            with open(os.path.join(data_dir, file), "r") as f:
-                reader = csv.reader(f, delimiter="\t")
-                for row in reader:
-                    try:
-                        # Convert date string to datetime object
-                        date = datetime.strptime(row[0], "%Y%m%d")
-
-                        # Convert temperature values, handling special
-                        # case '-9999'. Divide by 10 to convert tenths of
-                        # degrees to degrees
-                        max_temp = (
-                            float(row[1]) / 10 if row[1] != "-9999" else None
-                        )
-                        min_temp = (
-                            float(row[2]) / 10 if row[2] != "-9999" else None
-                        )
-
-                        # Convert precipitation, handling special case '-9999'
-                        # Divide by 10 to convert tenths of mm to mm
-                        precipitation = (
-                            float(row[3]) / 10 if row[3] != "-9999" else None
-                        )
-
-                        # Prepare insert statement
-                        stmt = insert(WeatherData).values(
-                            station_id=file.split(".")[
-                                0
-                            ],  # Extract station ID from filename
-                            date=date,
-                            max_temp=max_temp,
-                            min_temp=min_temp,
-                            precipitation=precipitation,
-                        )
-
-                        # Add on_conflict_do_nothing clause to avoid duplicate
-                        # entries
-                        stmt = stmt.on_conflict_do_nothing(
-                            index_elements=["station_id", "date"]
-                        )
-
-                        # Execute the insert statement
-                        result = db.session.execute(stmt)
-                        if result.rowcount > 0:
-                            new_records += 1
-
-                        total_records += 1
-                    except ValueError as e:
-                        # Log any data conversion errors
-                        logger.error(
-                            f"Error converting data in row {row} in file "
-                            f"{file}: {e}"
-                        )
-                    except Exception as e:
-                        # Log any other unexpected errors
-                        logger.error(
-                            f"Unexpected error processing row {row} in file "
-                            f"{file}: {e}"
-                        )
-
-            try:
-                # Commit the transaction for each file
-                db.session.commit()
-                total_new_records += new_records
-                logger.info(
-                    f"Successfully ingested file: {file}. New records: "
-                    f"{new_records}"
-                )
-            except IntegrityError:
-                # If there's an integrity error, rollback the transaction
-                db.session.rollback()
-                logger.error(f"Failed to commit data for file: {file}")
+        with phase("ingest", "plan"):
+            manifest = {} if full else load_manifest()
+            pending: List[Tuple[str, int, bool]] = []
+            for file in files:
+                path = os.path.join(data_dir, file)
+                offset = plan_file(path, manifest.get(file))
+                if offset is None:
+                    logger.info(f"Skipping unchanged file: {file}")
+                    continue
+                # A changed archive is always read again from the start
+                if is_archive(file):
+                    offset = 0
+                # Files read again from the start replace the rows loaded
+                # from them before, unless they were never loaded
+                reload = offset == 0 and (full or file in manifest)
+                pending.append((file, offset, reload))
+            logger.info(
+                f"{len(pending)} files to ingest, "
+                f"{len(files) - len(pending)} unchanged"
+            )
 
-    end_time = time.time()
-    duration = end_time - start_time
-    logger.info(
-        f"Data ingestion completed at "
-        f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    )
-    logger.info(f"Total duration: {duration:.2f} seconds")
-    logger.info(f"Total records processed: {total_records}")
-    logger.info(f"Total new records inserted: {total_new_records}")
+            with db.engine.connect() as connection:
+                partitioned = is_partitioned(connection)
+            if partitioned:
+                ensure_partitions_for(data_dir, pending)
+
+        load_start = time.time()
+        with phase("ingest", "load"):
+            step = batch_size if bulk else 1
+            archives = [item for item in pending if is_archive(item[0])]
+            plain = [item for item in pending if not is_archive(item[0])]
+            # Each archive is a batch of its own, streamed by a single worker
+            batches = [plain[i:i + step] for i in range(0, len(plain), step)]
+            batches += [[archive] for archive in archives]
+
+            if workers > 1:
+                logger.info(f"Ingesting with {workers} worker processes")
+
+                # Drop pooled connections before forking so that workers
+                # never share a socket with the parent; each opens its own
+                # on first use
+                db.engine.dispose()
+
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=init_worker,
+                    initargs=(dict(app.config),),
+                ) as executor:
+                    futures = {
+                        executor.submit(
+                            ingest_batch,
+                            data_dir,
+                            batch,
+                            bulk,
+                            vectorized,
+                            batch_size,
+                        ): batch
+                        for batch in batches
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            for file, *_ in futures[future]:
+                                logger.error(
+                                    f"Failed to ingest file {file}: {e}"
+                                )
+                                failed_files.append(file)
+                            continue
+                        for file, (records, new_records) in results.items():
+                            total_records += records
+                            if new_records is None:
+                                failed_files.append(file)
+                            else:
+                                total_new_records += new_records
+            else:
+                for batch in batches:
+                    results = ingest_batch(
+                        data_dir, batch, bulk, vectorized, batch_size
+                    )
+                    for file, (records, new_records) in results.items():
+                        total_records += records
+                        if new_records is None:
+                            failed_files.append(file)
+                        else:
+                            total_new_records += new_records
+
+        directory = app.config.get("STATION_CACHE_DIR")
+        if directory:
+            with phase("ingest", "cache"):
+                with db.engine.connect() as connection:
+                    rebuilt = refresh_stations(connection, directory)
+            logger.info(f"Refreshed {rebuilt} station cache files")
+
+        end_time = time.time()
+        duration = end_time - start_time
+        record_rows(
+            "ingest",
+            end_time - load_start,
+            processed=total_records,
+            inserted=total_new_records,
+            failed_files=len(failed_files),
+        )
+        write_job_metrics("ingest", logger)
+        logger.info(
+            f"Data ingestion completed at "
+            f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+        logger.info(f"Total duration: {duration:.2f} seconds")
+        logger.info(f"Total records processed: {total_records}")
+        logger.info(f"Total new records inserted: {total_new_records}")
+        if failed_files:
+            logger.error(
+                f"Files failed: {len(failed_files)} "
+                f"({', '.join(sorted(failed_files))})"
+            )
 
 
 if __name__ == "__main__":
-    ingest_weather_data()
+    parser = argparse.ArgumentParser(description="Ingest wx_data files")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Load files with COPY and a set-based merge",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=20,
+        help="Files merged per transaction in bulk mode",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes to spread files across",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the ingestion manifest and re-read every file",
+    )
+    parser.add_argument(
+        "--vectorized",
+        action="store_true",
+        help="Parse files with the NumPy column parser",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join("data", "wx_data"),
+        help="Directory of weather files and/or archives of them "
+        "(.tar.gz, .tgz, .tar, .zip), or a single archive",
+    )
+    args = parser.parse_args()
+    ingest_weather_data(
+        data_dir=args.data_dir,
+        bulk=args.bulk,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        full=args.full,
+        vectorized=args.vectorized,
+        app=create_db_app(),
+    )
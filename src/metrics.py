@@ -0,0 +1,234 @@
+"""Prometheus metrics for the API and the ingest/analysis jobs.
+
+The API exposes everything on /metrics:
+
+- http_request_duration_seconds: latency histogram per method, route
+  (the URL rule, not the raw path) and status code
+- http_response_size_bytes: body size histogram per route
+- db_query_duration_seconds: SQL time histogram per statement type,
+  recorded from SQLAlchemy engine events (its _count is the query count)
+- db_pool_checked_out / db_pool_overflow: connection pool gauges, read
+  from the pool when scraped
+
+Ingestion and analysis record the same SQL histograms plus job metrics
+(job_phase_duration_seconds, job_rows, job_rows_per_second) and write
+them when they finish, in the Prometheus text format, to
+METRICS_TEXTFILE_DIR (default: logs/) for node_exporter's textfile
+collector, and to a Pushgateway if PROMETHEUS_PUSHGATEWAY is set.
+
+Collection costs two perf_counter() calls and one histogram update per
+request or query, so it is always on. When the API runs in several
+processes, set PROMETHEUS_MULTIPROC_DIR to aggregate their metrics (the
+pool gauges are per process and are left out in that mode).
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    push_to_gateway,
+    write_to_textfile,
+)
+from sqlalchemy import event
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"],
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "HTTP response body size",
+    ["route"],
+    buckets=[2 ** exponent for exponent in range(8, 27, 2)],
+)
+QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time",
+    ["operation"],
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow",
+    "Connections open beyond the pool size",
+)
+JOB_PHASE = Gauge(
+    "job_phase_duration_seconds",
+    "Wall time of a phase of the last ingest or analysis run",
+    ["job", "phase"],
+)
+JOB_ROWS = Gauge(
+    "job_rows",
+    "Rows handled by the last ingest or analysis run",
+    ["job", "kind"],
+)
+JOB_ROWS_PER_SECOND = Gauge(
+    "job_rows_per_second",
+    "Rows processed per second by the last ingest or analysis run",
+    ["job"],
+)
+
+
+def statement_operation(statement: str) -> str:
+    """Return the leading SQL keyword of a statement (SELECT, INSERT...)."""
+    return statement.lstrip().split(None, 1)[0].upper() if statement else ""
+
+
+def start_query_timer(
+    conn, cursor, statement, parameters, context, executemany
+):
+    """before_cursor_execute listener: note when a statement started."""
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    """after_cursor_execute listener: record the statement's duration."""
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    QUERY_LATENCY.labels(statement_operation(statement)).observe(elapsed)
+
+
+def instrument_engine(engine) -> None:
+    """
+    Time every statement executed on an engine into QUERY_LATENCY and
+    expose its pool's checked-out and overflow connections.
+
+    Args:
+        engine: SQLAlchemy Engine (for async engines, its sync_engine)
+    """
+    if event.contains(engine, "before_cursor_execute", start_query_timer):
+        return
+    event.listen(engine, "before_cursor_execute", start_query_timer)
+    event.listen(engine, "after_cursor_execute", record_query)
+
+    # Pools without these counters (e.g. SQLite's) report 0
+    POOL_CHECKED_OUT.set_function(
+        lambda: getattr(engine.pool, "checkedout", lambda: 0)()
+    )
+    POOL_OVERFLOW.set_function(
+        lambda: max(getattr(engine.pool, "overflow", lambda: 0)(), 0)
+    )
+
+
+def observe_request(
+    method: str, route: str, status: int, elapsed: float, size
+) -> None:
+    """Record one request's latency and, if known, its body size."""
+    REQUEST_LATENCY.labels(method, route, status).observe(elapsed)
+    if size is not None:
+        RESPONSE_SIZE.labels(route).observe(size)
+
+
+def exposition() -> bytes:
+    """Render the metrics in the Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def instrument_app(app, db) -> None:
+    """
+    Record request metrics for a Flask app and serve them on /metrics.
+
+    Args:
+        app: Flask application
+        db: Flask-SQLAlchemy extension bound to app
+    """
+
+    @app.before_request
+    def start_timer():
+        g.request_start_time = time.perf_counter()
+
+    @app.after_request
+    def record_request(response: Response) -> Response:
+        start = g.pop("request_start_time", None)
+        if start is not None:
+            rule = request.url_rule
+            observe_request(
+                request.method,
+                rule.rule if rule else "unmatched",
+                response.status_code,
+                time.perf_counter() - start,
+                # Streamed responses have no length up front
+                None if response.is_streamed else response.content_length,
+            )
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """
+        Endpoint exposing Prometheus metrics
+        ---
+        responses:
+          200:
+            description: Metrics in the Prometheus text format
+        """
+        return Response(exposition(), mimetype=CONTENT_TYPE_LATEST)
+
+    @app.before_first_request
+    def instrument_database():
+        # Deferred so that creating the app doesn't create the engine
+        instrument_engine(db.engine)
+
+
+@contextmanager
+def phase(job: str, name: str) -> Iterator[None]:
+    """Time a phase of an ingest or analysis run into JOB_PHASE."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        JOB_PHASE.labels(job, name).set(time.perf_counter() - start)
+
+
+def record_rows(job: str, seconds: float, **rows: int) -> None:
+    """
+    Record a run's row counts, and its throughput from the "processed"
+    count.
+
+    Args:
+        job: Job name ("ingest" or "analysis")
+        seconds: Wall time of the run
+        rows: Row counts by kind, e.g. processed=..., inserted=...
+    """
+    for kind, count in rows.items():
+        JOB_ROWS.labels(job, kind).set(count)
+    if "processed" in rows and seconds > 0:
+        JOB_ROWS_PER_SECOND.labels(job).set(rows["processed"] / seconds)
+
+
+def write_job_metrics(job: str, logger=None) -> None:
+    """
+    Write the metrics of a finished job for Prometheus to collect.
+
+    Args:
+        job: Job name, used for the file name and the Pushgateway job
+        logger: Logger to report failures to; metrics never fail a job
+    """
+    directory = os.getenv(
+        "METRICS_TEXTFILE_DIR",
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs"),
+    )
+    gateway = os.getenv("PROMETHEUS_PUSHGATEWAY")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        write_to_textfile(os.path.join(directory, f"{job}.prom"), REGISTRY)
+        if gateway:
+            push_to_gateway(gateway, job=job, registry=REGISTRY)
+    except Exception as e:
+        if logger:
+            logger.error(f"Failed to write {job} metrics: {e}")
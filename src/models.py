@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import UniqueConstraint
-from typing import Dict, Any
+from sqlalchemy import UniqueConstraint, select
+from sqlalchemy.dialects.postgresql import insert
+from typing import Dict, Any, Set
 
 db = SQLAlchemy()
 
@@ -22,12 +23,11 @@ class WeatherData(db.Model):
     precipitation = db.Column(db.Float)
 
     __table_args__ = (
-        UniqueConstraint(
-            "station_id",
-            "date",
-            name="uix_station_date",
-            postgresql_where=db.column("max_temp") != -9999,
-        ),
+        # Serves station-scoped lookups and date ranges, and is the
+        # conflict target for ingestion's ON CONFLICT (station_id, date)
+        db.Index("uix_station_date", "station_id", "date", unique=True),
+        # Serves date ranges across all or many stations
+        db.Index("ix_weather_date_station", "date", "station_id"),
     )
 
     def as_dict(self) -> Dict[str, Any]:
@@ -62,6 +62,10 @@ class WeatherStats(db.Model):
     avg_min_temp = db.Column(db.Float)
     total_precipitation = db.Column(db.Float)
 
+    __table_args__ = (
+        UniqueConstraint("station_id", "year", name="uix_station_year"),
+    )
+
     def as_dict(self) -> Dict[str, Any]:
         """
         Convert the WeatherStats object to a dictionary.
@@ -75,3 +79,200 @@ class WeatherStats(db.Model):
             "avg_min_temp": self.avg_min_temp,
             "total_precipitation": self.total_precipitation,
         }
+
+
+class WeatherStatsMonthly(db.Model):
+    """
+    Represents aggregated weather statistics for a station and month.
+    Alongside the averages and totals, the *_days columns count the days
+    with a valid (non-missing) measurement, so consumers can judge how
+    well each month is covered.
+    """
+
+    __tablename__ = "weather_stats_monthly"
+
+    id = db.Column(db.Integer, primary_key=True)
+    station_id = db.Column(db.String, nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    avg_max_temp = db.Column(db.Float)
+    avg_min_temp = db.Column(db.Float)
+    total_precipitation = db.Column(db.Float)
+    max_temp_days = db.Column(db.Integer, nullable=False, default=0)
+    min_temp_days = db.Column(db.Integer, nullable=False, default=0)
+    precipitation_days = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "station_id", "year", "month", name="uix_station_year_month"
+        ),
+    )
+
+
+class WeatherStatsSeasonal(db.Model):
+    """
+    Represents aggregated weather statistics for a station and
+    meteorological season (winter = Dec-Feb, spring = Mar-May,
+    summer = Jun-Aug, fall = Sep-Nov).
+    December counts towards the following year's winter, so winter 2000
+    covers December 1999 through February 2000.
+    """
+
+    __tablename__ = "weather_stats_seasonal"
+
+    id = db.Column(db.Integer, primary_key=True)
+    station_id = db.Column(db.String, nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    season = db.Column(db.String, nullable=False)
+    avg_max_temp = db.Column(db.Float)
+    avg_min_temp = db.Column(db.Float)
+    total_precipitation = db.Column(db.Float)
+    max_temp_days = db.Column(db.Integer, nullable=False, default=0)
+    min_temp_days = db.Column(db.Integer, nullable=False, default=0)
+    precipitation_days = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "station_id", "year", "season", name="uix_station_year_season"
+        ),
+    )
+
+
+class IngestManifest(db.Model):
+    """
+    Records what has been ingested from each weather data file.
+    Ingestion uses it to skip unchanged files and to resume files that
+    only had rows appended from the last ingested byte offset.
+    """
+
+    __tablename__ = "ingest_manifest"
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_name = db.Column(db.String, nullable=False, unique=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    ingested_bytes = db.Column(db.BigInteger, nullable=False)
+    last_date = db.Column(db.Date)
+    ingested_at = db.Column(db.DateTime, nullable=False)
+
+
+class WeatherStatsPending(db.Model):
+    """
+    Station-years whose weather data changed since the last analysis run.
+    Ingestion adds a row for every station-year it inserts new records
+    into, and incremental analysis consumes them.
+    """
+
+    __tablename__ = "weather_stats_pending"
+
+    id = db.Column(db.Integer, primary_key=True)
+    station_id = db.Column(db.String, nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "station_id", "year", name="uix_pending_station_year"
+        ),
+    )
+
+
+class DataGeneration(db.Model):
+    """
+    Single-row counter bumped whenever ingestion or analysis commits new
+    data. The API keys its response cache on it, so cached responses are
+    never served after the underlying data has changed.
+    """
+
+    __tablename__ = "data_generation"
+
+    id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def current(cls, session) -> int:
+        """Return the current generation (0 if nothing was committed)."""
+        generation = session.query(cls.generation).filter_by(id=1).scalar()
+        return generation or 0
+
+    @classmethod
+    def bump(cls, session) -> None:
+        """
+        Increment the generation in the session's current transaction, so
+        it becomes visible together with the data it describes.
+
+        A single upsert creates the row on first use, so concurrent
+        writers on a fresh database can't both insert it.
+        """
+        stmt = insert(cls).values(id=1, generation=1)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[cls.id],
+                set_={cls.generation: cls.generation + 1},
+            )
+        )
+
+
+class WeatherRowCount(db.Model):
+    """
+    Number of weather_data rows per station and year.
+    Ingestion keeps it up to date so that paginated endpoints can report
+    totals without running COUNT(*) over weather_data.
+    """
+
+    __tablename__ = "weather_row_counts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    station_id = db.Column(db.String, nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    row_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "station_id", "year", name="uix_row_count_station_year"
+        ),
+    )
+
+
+class StationVersion(db.Model):
+    """
+    Per-station counter bumped by every transaction that changes the
+    station's weather_data rows. Station cache files record the version
+    they were built from, so any change makes them stale, including
+    edits and reloads that leave the row count unchanged.
+    """
+
+    __tablename__ = "station_versions"
+
+    station_id = db.Column(db.String, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def current(cls, connection, station_id: str) -> int:
+        """Return a station's version (0 if its rows never changed)."""
+        version = connection.execute(
+            select(cls.version).where(cls.station_id == station_id)
+        ).scalar()
+        return version or 0
+
+    @classmethod
+    def bump(cls, session, station_ids: Set[str]) -> None:
+        """
+        Increment the versions of some stations in the session's current
+        transaction, so they change together with the rows.
+        """
+        if not station_ids:
+            return
+        stmt = insert(cls).values(
+            # Sorted so concurrent writers lock the rows in the same order
+            [
+                {"station_id": station_id, "version": 1}
+                for station_id in sorted(station_ids)
+            ]
+        )
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[cls.station_id],
+                set_={cls.version: cls.version + 1},
+            )
+        )
@@ -0,0 +1,197 @@
+"""Yearly range partitioning of weather_data on PostgreSQL.
+
+With partitioning enabled, weather_data is a declaratively partitioned
+table (PARTITION BY RANGE (date)) with one weather_data_y<year> partition
+per year. Year-filtered queries then only touch the matching partitions,
+and a year can be reloaded by swapping its partition.
+
+Enable it for a new database by setting WEATHER_DATA_PARTITIONED=true
+before the first ingestion, or convert an existing table with:
+
+    python partitioning.py migrate
+"""
+
+import os
+import sys
+from typing import Iterable
+
+from sqlalchemy import text
+
+TABLE = "weather_data"
+SEQUENCE = "weather_data_id_seq"
+
+
+def partitioning_enabled() -> bool:
+    """Whether new weather_data tables should be created partitioned."""
+    return os.getenv("WEATHER_DATA_PARTITIONED", "").lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+
+
+def partition_name(year: int) -> str:
+    """Return the name of the partition holding a year's rows."""
+    return f"{TABLE}_y{year}"
+
+
+def is_partitioned(connection) -> bool:
+    """Whether weather_data exists as a partitioned table."""
+    if connection.dialect.name != "postgresql":
+        return False
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :name"),
+        {"name": TABLE},
+    ).scalar()
+    return relkind == "p"
+
+
+def create_partitioned_table(connection) -> None:
+    """
+    Create weather_data as a table partitioned by year.
+
+    The primary key has to include the partition key, so it is
+    (id, date); id still comes from weather_data_id_seq and stays unique.
+    The indexes match the ones declared on the WeatherData model.
+
+    Args:
+        connection: Connection to run the DDL on
+    """
+    connection.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}"))
+    connection.execute(
+        text(
+            f"CREATE TABLE {TABLE} ("
+            f"id INTEGER NOT NULL DEFAULT nextval('{SEQUENCE}'), "
+            "station_id VARCHAR NOT NULL, "
+            "date DATE NOT NULL, "
+            "max_temp FLOAT, "
+            "min_temp FLOAT, "
+            "precipitation FLOAT, "
+            "PRIMARY KEY (id, date)"
+            ") PARTITION BY RANGE (date)"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE UNIQUE INDEX uix_station_date "
+            f"ON {TABLE} (station_id, date)"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE INDEX ix_weather_date_station "
+            f"ON {TABLE} (date, station_id)"
+        )
+    )
+
+
+def ensure_year_partitions(connection, years: Iterable[int]) -> None:
+    """
+    Create the partitions for the given years if they don't exist.
+
+    Args:
+        connection: Connection to run the DDL on
+        years: Years that are about to receive rows
+    """
+    for year in sorted(set(years)):
+        connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(year)} "
+                f"PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+        )
+
+
+def create_weather_data_table(engine) -> None:
+    """
+    Create weather_data partitioned if partitioning is enabled and the
+    table doesn't exist yet. Otherwise this is a no-op and the regular
+    model DDL applies.
+    """
+    if engine.dialect.name != "postgresql" or not partitioning_enabled():
+        return
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT to_regclass(:name)"), {"name": TABLE}
+        ).scalar()
+        if exists is None:
+            create_partitioned_table(connection)
+
+
+def migrate_to_partitioned(connection) -> None:
+    """
+    Convert an existing unpartitioned weather_data into a partitioned one.
+
+    Rows are copied into yearly partitions of a new table, the id
+    sequence is handed over and the old table is dropped. Run it inside
+    a transaction so a failure leaves the original table untouched.
+    """
+    if is_partitioned(connection):
+        return
+
+    old = f"{TABLE}_unpartitioned"
+    connection.execute(text(f"ALTER TABLE {TABLE} RENAME TO {old}"))
+    for index in ("uix_station_date", "ix_weather_date_station"):
+        connection.execute(
+            text(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_old")
+        )
+
+    create_partitioned_table(connection)
+    years = connection.execute(
+        text(
+            f"SELECT DISTINCT CAST(EXTRACT(year FROM date) AS INTEGER) "
+            f"FROM {old}"
+        )
+    ).scalars()
+    ensure_year_partitions(connection, years)
+
+    columns = "id, station_id, date, max_temp, min_temp, precipitation"
+    connection.execute(
+        text(f"INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {old}")
+    )
+    connection.execute(
+        text(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id")
+    )
+    connection.execute(text(f"DROP TABLE {old}"))
+
+
+def swap_year_partition(connection, year: int, table: str) -> None:
+    """
+    Replace a year's partition with a fully loaded table.
+
+    This makes per-year reloads cheap: load the year into a standalone
+    table with the same columns, then swap it in; the old partition is
+    detached and dropped without touching any other year.
+
+    Args:
+        connection: Connection to run the DDL on, inside a transaction
+        year: Year to replace
+        table: Name of the table holding the year's new rows
+    """
+    name = partition_name(year)
+    connection.execute(
+        text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+    )
+    connection.execute(text(f"DROP TABLE {name}"))
+    connection.execute(text(f"ALTER TABLE {table} RENAME TO {name}"))
+    connection.execute(
+        text(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+    )
+
+
+if __name__ == "__main__":
+    from utils import setup_flask_app, init_db
+
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit(f"Usage: python {sys.argv[0]} migrate")
+
+    app = setup_flask_app()
+    db = init_db(app)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            migrate_to_partitioned(connection)
+    print("weather_data is now partitioned by year")
@@ -0,0 +1,288 @@
+"""Opt-in per-request profiling and the slow-request log.
+
+With PROFILING_ENABLED set, a request sent with an X-Profile header (whose
+value must equal PROFILING_TOKEN when one is configured) is traced:
+
+- every SQL statement it executes, with its duration and row count
+  (from SQLAlchemy engine events)
+- time spent in named sections of the view, such as "serialize" for
+  encoding the page (see section())
+- with X-Profile-Mode: cprofile, a cProfile of the whole request
+
+The breakdown is returned in a Server-Timing header and written as one
+JSON line to logs/profile.log.
+
+With SLOW_REQUEST_MS set, every request is traced the same way (without
+cProfile) and the ones taking longer than that many milliseconds are
+written to logs/slow_requests.log, with the EXPLAIN plan of each of their
+SELECT statements. Plans are fetched when the response has been sent, so
+they don't add to the request's own latency.
+
+Tracing costs two perf_counter() calls per statement; requests are not
+traced at all unless one of the two settings is on.
+"""
+
+import cProfile
+import hmac
+import io
+import json
+import logging
+import pstats
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+from metrics import statement_operation
+from utils import setup_logger
+
+# Functions listed in a cProfile breakdown, by cumulative time
+PROFILE_LINES = 30
+# Longest statement and parameters written to the logs
+MAX_STATEMENT_LENGTH = 4000
+
+
+@lru_cache(maxsize=None)
+def record_logger(log_file: str) -> logging.Logger:
+    """
+    Return the logger of a record file, set up on first use so that
+    apps that never trace a request don't create it.
+    """
+    return setup_logger(log_file, name=log_file[:-4], console=False)
+
+
+class RequestProfile:
+    """Timings collected while serving one request."""
+
+    def __init__(self, profiled: bool, use_cprofile: bool):
+        self.start = time.perf_counter()
+        self.profiled = profiled
+        self.statements: List[Dict[str, Any]] = []
+        self.sections: Dict[str, float] = {}
+        self.finished = False
+        self.profiler = None
+        if use_cprofile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add_section(self, name: str, elapsed: float) -> None:
+        """Add time spent in a named section."""
+        self.sections[name] = self.sections.get(name, 0.0) + elapsed
+
+    def server_timing(self) -> str:
+        """Summarize the timings so far as a Server-Timing header."""
+        database = sum(item["duration_ms"] for item in self.statements)
+        metrics = [
+            f'db;dur={database:.2f};desc="{len(self.statements)} statements"'
+        ]
+        metrics += [
+            f"{name};dur={elapsed * 1000:.2f}"
+            for name, elapsed in self.sections.items()
+        ]
+        elapsed = (time.perf_counter() - self.start) * 1000
+        metrics.append(f"total;dur={elapsed:.2f}")
+        return ", ".join(metrics)
+
+    def finish(self) -> Dict[str, Any]:
+        """Stop tracing and return the breakdown as a log record."""
+        self.finished = True
+        record = {
+            "total_ms": (time.perf_counter() - self.start) * 1000,
+            "db_ms": sum(item["duration_ms"] for item in self.statements),
+            "sections_ms": {
+                name: elapsed * 1000
+                for name, elapsed in self.sections.items()
+            },
+            "statements": self.statements,
+        }
+        if self.profiler is not None:
+            self.profiler.disable()
+            output = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=output)
+            stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+            record["cprofile"] = output.getvalue()
+        return record
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """Return the profile of the request being served, if it is traced."""
+    if not has_request_context():
+        return None
+    profile = g.get("request_profile")
+    if profile is None or profile.finished:
+        return None
+    return profile
+
+
+@contextmanager
+def section(name: str) -> Iterator[None]:
+    """Time a section of a view into the request's profile, if traced."""
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_section(name, time.perf_counter() - start)
+
+
+def truncate(value: Any) -> str:
+    """Render a statement or its parameters for the logs."""
+    text = value if isinstance(value, str) else repr(value)
+    return text[:MAX_STATEMENT_LENGTH]
+
+
+def start_statement(
+    conn, cursor, statement, parameters, context, executemany
+):
+    """before_cursor_execute listener: note when a traced statement began."""
+    if current_profile() is not None:
+        conn.info.setdefault("profile_start_time", []).append(
+            time.perf_counter()
+        )
+
+
+def record_statement(
+    conn, cursor, statement, parameters, context, executemany
+):
+    """after_cursor_execute listener: add the statement to the profile."""
+    profile = current_profile()
+    starts = conn.info.get("profile_start_time")
+    if profile is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    rowcount = getattr(cursor, "rowcount", -1)
+    profile.statements.append(
+        {
+            "statement": statement,
+            "parameters": None if executemany else parameters,
+            "duration_ms": elapsed * 1000,
+            # Unknown for server-side cursors and some drivers
+            "rows": rowcount if rowcount >= 0 else None,
+        }
+    )
+
+
+def attach_profiling_listeners(engine) -> None:
+    """Record the statements executed on an engine in request profiles."""
+    if event.contains(engine, "before_cursor_execute", start_statement):
+        return
+    event.listen(engine, "before_cursor_execute", start_statement)
+    event.listen(engine, "after_cursor_execute", record_statement)
+
+
+def explain(connection, statement: str, parameters) -> str:
+    """Return the plan of a statement as the database prints it."""
+    prefix = (
+        "EXPLAIN QUERY PLAN"
+        if connection.dialect.name == "sqlite"
+        else "EXPLAIN"
+    )
+    try:
+        rows = connection.exec_driver_sql(
+            f"{prefix} {statement}", parameters or ()
+        ).all()
+    except Exception as e:
+        return f"unavailable: {e}"
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def slow_request_threshold(app) -> Optional[float]:
+    """Return SLOW_REQUEST_MS as a number, or None if it is unset."""
+    threshold = app.config.get("SLOW_REQUEST_MS")
+    if threshold in (None, ""):
+        return None
+    return float(threshold)
+
+
+def wants_profile(app) -> bool:
+    """Whether the current request asked for, and may get, a profile."""
+    header = request.headers.get("X-Profile")
+    if not app.config.get("PROFILING_ENABLED") or header is None:
+        return False
+    token = app.config.get("PROFILING_TOKEN")
+    return not token or hmac.compare_digest(header, token)
+
+
+def write_records(app, db, profile: RequestProfile, request_info) -> None:
+    """
+    Finish a request's profile and write it to the profile log if it was
+    asked for, and to the slow-request log if it exceeded the threshold.
+    Failures are logged; they never affect the request.
+    """
+    try:
+        record = dict(request_info, **profile.finish())
+        threshold = slow_request_threshold(app)
+        slow = threshold is not None and record["total_ms"] >= threshold
+        if slow:
+            with app.app_context(), db.engine.connect() as connection:
+                for item in record["statements"]:
+                    if (
+                        statement_operation(item["statement"]) == "SELECT"
+                        and item["parameters"] is not None
+                    ):
+                        item["plan"] = explain(
+                            connection, item["statement"], item["parameters"]
+                        )
+
+        for item in record["statements"]:
+            item["statement"] = truncate(item["statement"])
+            if item["parameters"] is not None:
+                item["parameters"] = truncate(item["parameters"])
+        line = json.dumps(record, default=str)
+        if slow:
+            record_logger("slow_requests.log").info(line)
+        if profile.profiled:
+            record_logger("profile.log").info(line)
+    except Exception as e:
+        record_logger("profile.log").error(
+            f"Failed to write the profile of {request_info['path']}: {e}"
+        )
+
+
+def instrument_profiling(app, db) -> None:
+    """
+    Trace the requests of a Flask app that ask for a profile or, with
+    SLOW_REQUEST_MS set, all of them.
+
+    Args:
+        app: Flask application
+        db: Flask-SQLAlchemy extension bound to app
+    """
+
+    @app.before_request
+    def start_profile():
+        profiled = wants_profile(app)
+        if not profiled and slow_request_threshold(app) is None:
+            return
+        attach_profiling_listeners(db.engine)
+        g.request_profile = RequestProfile(
+            profiled,
+            profiled
+            and request.headers.get("X-Profile-Mode") == "cprofile",
+        )
+
+    @app.after_request
+    def finish_profile(response: Response) -> Response:
+        profile = g.get("request_profile")
+        if profile is None:
+            return response
+        if profile.profiled and not response.is_streamed:
+            response.headers["Server-Timing"] = profile.server_timing()
+
+        request_info = {
+            "method": request.method,
+            "path": request.full_path,
+            "status": response.status_code,
+        }
+        # Streamed bodies run their queries after this hook, so the
+        # records are written once the response is closed
+        response.call_on_close(
+            lambda: write_records(app, db, profile, request_info)
+        )
+        return response
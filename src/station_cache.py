@@ -0,0 +1,391 @@
+"""Memory-mapped columnar cache of each station's daily rows.
+
+With STATION_CACHE_DIR set, ingestion keeps one file per station in that
+directory, holding the station's weather_data rows sorted by date as
+contiguous column arrays:
+
+    header: magic, format version, rows, data version (24 bytes)
+    id: int32[rows]
+    date: int32[rows] (days since 1970-01-01)
+    max_temp, min_temp, precipitation: int16[rows] (tenths, -9999 when
+        missing, as in the wx_data files)
+
+Files are mapped read-only and the arrays are views of the mapping, so
+a date range is a pair of binary searches and slicing copies nothing;
+the OS page cache keeps hot stations in memory across requests and
+processes. The API serves single-station /api/weather requests from
+the cache and analysis can compute its rollups from it with NumPy.
+
+"data version" is the station's version in station_versions when the
+file was built. Every transaction that inserts, deletes or replaces a
+station's rows (including reloads of edited files) bumps that version,
+so a file is current exactly while it is unchanged; readers compare it
+and fall back to the database otherwise. Since the version only moves
+when the transaction commits, nothing done to the files inside a
+transaction that rolls back can make them look current. Files are
+replaced atomically, so readers never see a partial file.
+
+Build or refresh the whole cache for an existing database with:
+
+    python station_cache.py refresh
+"""
+
+import os
+import re
+import struct
+import sys
+from datetime import date
+from functools import lru_cache
+from itertools import repeat
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from models import StationVersion, WeatherData, WeatherRowCount
+from wx_parser import SENTINEL
+
+MAGIC = b"WXSC"
+VERSION = 2
+HEADER = struct.Struct("<4sIQQ")
+COLUMN_DTYPES = [
+    ("id", np.int32),
+    ("date", np.int32),
+    ("max_temp", np.int16),
+    ("min_temp", np.int16),
+    ("precipitation", np.int16),
+]
+MEASUREMENTS = ["max_temp", "min_temp", "precipitation"]
+EPOCH = date(1970, 1, 1)
+
+# Station IDs come from request arguments, so only plain names map to files
+STATION_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Season of each month (January first) and the order of SEASONS
+SEASONS = ["winter", "spring", "summer", "fall"]
+MONTH_SEASON = np.array([0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])
+
+
+class StationSeries(NamedTuple):
+    """Column arrays of one station's cache file, sorted by date."""
+
+    data_version: int
+    id: np.ndarray
+    date: np.ndarray
+    max_temp: np.ndarray
+    min_temp: np.ndarray
+    precipitation: np.ndarray
+
+
+def station_path(directory: str, station_id: str) -> Optional[str]:
+    """Return a station's cache file, or None for unusable station IDs."""
+    if not STATION_ID.match(station_id):
+        return None
+    return os.path.join(directory, f"{station_id}.wxc")
+
+
+@lru_cache(maxsize=256)
+def _map(path: str, mtime_ns: int, size: int) -> StationSeries:
+    """
+    Map a cache file. Replaced files have a new mtime, so they are mapped
+    again instead of being served from a stale entry.
+
+    Raises:
+        ValueError: If the file is not a cache file of this version
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    magic, version, rows, data_version = HEADER.unpack(
+        bytes(data[: HEADER.size])
+    )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} cache file")
+
+    columns = {}
+    offset = HEADER.size
+    for name, dtype in COLUMN_DTYPES:
+        columns[name] = np.frombuffer(
+            data, dtype=dtype, count=rows, offset=offset
+        )
+        offset += rows * np.dtype(dtype).itemsize
+    return StationSeries(data_version=data_version, **columns)
+
+
+def load_station(directory: str, station_id: str) -> Optional[StationSeries]:
+    """Return a station's cached columns, or None if it isn't cached."""
+    path = station_path(directory, station_id)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+        return _map(path, stat.st_mtime_ns, stat.st_size)
+    except (OSError, ValueError):
+        return None
+
+
+def write_station(
+    directory: str,
+    station_id: str,
+    data_version: int,
+    columns: Dict[str, np.ndarray],
+) -> None:
+    """
+    Write a station's cache file, replacing any previous one atomically.
+
+    Args:
+        directory: Cache directory
+        station_id: Station the rows belong to
+        data_version: The station's version in station_versions the
+            rows were read at
+        columns: Arrays for every name in COLUMN_DTYPES, sorted by date
+    """
+    path = station_path(directory, station_id)
+    if path is None:
+        raise ValueError(f"Can't cache station {station_id!r}")
+    os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(
+            HEADER.pack(MAGIC, VERSION, len(columns["id"]), data_version)
+        )
+        for name, dtype in COLUMN_DTYPES:
+            f.write(np.ascontiguousarray(columns[name], dtype=dtype).data)
+    os.replace(temporary, path)
+
+
+def to_tenths(values: List[Optional[float]]) -> np.ndarray:
+    """Convert measurements read from weather_data back to tenths."""
+    floats = np.array(
+        [np.nan if value is None else value for value in values],
+        dtype=np.float64,
+    )
+    return np.where(
+        np.isnan(floats), SENTINEL, np.round(np.nan_to_num(floats) * 10)
+    )
+
+
+def build_station(connection, directory: str, station_id: str) -> int:
+    """
+    Rebuild a station's cache file from weather_data.
+
+    The station's version is read before the rows, so a concurrent
+    ingest can only make the file newer than its recorded version, which
+    gets it rebuilt again rather than served stale.
+
+    Returns:
+        Number of rows cached
+    """
+    data_version = StationVersion.current(connection, station_id)
+    rows = connection.execute(
+        select(
+            WeatherData.id,
+            WeatherData.date,
+            *[getattr(WeatherData, name) for name in MEASUREMENTS],
+        )
+        .where(WeatherData.station_id == station_id)
+        .order_by(WeatherData.date)
+    ).all()
+
+    ids, dates, *measurements = zip(*rows) if rows else ([], [], [], [], [])
+    columns = {
+        "id": np.array(ids, dtype=np.int32),
+        "date": np.array(
+            [(day - EPOCH).days for day in dates], dtype=np.int32
+        ),
+    }
+    for name, values in zip(MEASUREMENTS, measurements):
+        columns[name] = to_tenths(values)
+    write_station(directory, station_id, data_version, columns)
+    return len(rows)
+
+
+def refresh_stations(connection, directory: str) -> int:
+    """
+    Rebuild the cache files of every station whose version differs from
+    the one its file was built at (or that has no file yet).
+
+    Returns:
+        Number of stations rebuilt
+    """
+    stations = (
+        select(WeatherRowCount.station_id)
+        .union(select(StationVersion.station_id))
+        .subquery()
+    )
+    versions = connection.execute(
+        select(
+            stations.c.station_id, func.coalesce(StationVersion.version, 0)
+        ).select_from(
+            stations.outerjoin(
+                StationVersion,
+                StationVersion.station_id == stations.c.station_id,
+            )
+        )
+    ).all()
+    rebuilt = 0
+    for station_id, data_version in versions:
+        if station_path(directory, station_id) is None:
+            continue
+        series = load_station(directory, station_id)
+        if series is None or series.data_version != data_version:
+            build_station(connection, directory, station_id)
+            rebuilt += 1
+    return rebuilt
+
+
+def date_range(
+    series: StationSeries, start: Optional[date], end: Optional[date]
+) -> Tuple[int, int]:
+    """Return the positions of the rows within an inclusive date range."""
+    first = 0
+    stop = len(series.date)
+    if start is not None:
+        first = int(
+            np.searchsorted(series.date, (start - EPOCH).days, "left")
+        )
+    if end is not None:
+        stop = int(np.searchsorted(series.date, (end - EPOCH).days, "right"))
+    return first, max(first, stop)
+
+
+def _nullable(tenths: np.ndarray) -> List[Optional[float]]:
+    """Scale tenths to units like the parsers do, the sentinel as None."""
+    return [
+        None if value == SENTINEL else value / 10 for value in tenths.tolist()
+    ]
+
+
+def station_rows(
+    series: StationSeries, station_id: str, first: int, stop: int
+) -> List[Tuple]:
+    """
+    Return rows of a station as (id, station_id, date, max_temp,
+    min_temp, precipitation) tuples, the column order of WEATHER_SCHEMA.
+    """
+    window = slice(first, stop)
+    return list(
+        zip(
+            series.id[window].tolist(),
+            repeat(station_id),
+            series.date[window].astype("datetime64[D]").tolist(),
+            *[
+                _nullable(getattr(series, name)[window])
+                for name in MEASUREMENTS
+            ],
+        )
+    )
+
+
+def _rollup(keys: np.ndarray, size: int, sums, days) -> Tuple:
+    """Add up monthly sums and valid-day counts per group key."""
+    return (
+        [np.bincount(keys, weights=column, minlength=size) for column in sums],
+        [np.bincount(keys, weights=column, minlength=size) for column in days],
+    )
+
+
+def _stats(sums, days, index: int) -> Tuple:
+    """
+    Return one group's statistics in the order of analysis's
+    ROLLUP_COLUMNS: the averages and the total are None without valid
+    days, like SQL's aggregates over NULLs.
+    """
+    counts = [int(column[index]) for column in days]
+    max_sum, min_sum, precipitation_sum = (column[index] for column in sums)
+    return (
+        max_sum / counts[0] if counts[0] else None,
+        min_sum / counts[1] if counts[1] else None,
+        precipitation_sum if counts[2] else None,
+        *counts,
+    )
+
+
+def station_rollups(series: StationSeries) -> Dict[str, List[Tuple]]:
+    """
+    Compute a station's annual, monthly and seasonal statistics.
+
+    Like analysis's SQL, the daily values are summed per month first and
+    the years and seasons are rolled up from those monthly partial sums,
+    with December counting towards the following year's winter.
+
+    Returns:
+        Rows for "year" (year, avg_max_temp, avg_min_temp,
+        total_precipitation), "month" (year, month, *ROLLUP_COLUMNS) and
+        "season" (year, season, *ROLLUP_COLUMNS)
+    """
+    if not len(series.date):
+        return {"year": [], "month": [], "season": []}
+
+    # Months since January 1970, relative to the station's first month
+    months = series.date.astype("datetime64[D]").astype("datetime64[M]")
+    months = months.astype(np.int64)
+    first_month = int(months[0])
+    month_keys = months - first_month
+    size = int(month_keys[-1]) + 1
+
+    present = np.bincount(month_keys, minlength=size) > 0
+    sums, days = [], []
+    for name in MEASUREMENTS:
+        tenths = getattr(series, name)
+        valid = tenths != SENTINEL
+        values = np.where(valid, tenths / 10, 0.0)
+        sums.append(np.bincount(month_keys, weights=values, minlength=size))
+        days.append(np.bincount(month_keys, weights=valid, minlength=size))
+
+    month_index = np.flatnonzero(present)
+    absolute = month_index + first_month
+    years = absolute // 12 + 1970
+    month_numbers = absolute % 12 + 1
+    monthly_sums = [column[month_index] for column in sums]
+    monthly_days = [column[month_index] for column in days]
+
+    year_keys = years - years[0]
+    year_size = int(year_keys[-1]) + 1
+    year_sums, year_days = _rollup(
+        year_keys, year_size, monthly_sums, monthly_days
+    )
+    annual = [
+        (int(years[0]) + key, *_stats(year_sums, year_days, key)[:3])
+        for key in np.unique(year_keys).tolist()
+    ]
+
+    season_years = years + (month_numbers == 12)
+    season_keys = (season_years - season_years[0]) * 4 + MONTH_SEASON[
+        month_numbers - 1
+    ]
+    season_size = int(season_keys.max()) + 1
+    season_sums, season_days = _rollup(
+        season_keys, season_size, monthly_sums, monthly_days
+    )
+    seasonal = [
+        (
+            int(season_years[0]) + key // 4,
+            SEASONS[key % 4],
+            *_stats(season_sums, season_days, key),
+        )
+        for key in np.unique(season_keys).tolist()
+    ]
+
+    monthly = [
+        (int(year), int(month), *_stats(monthly_sums, monthly_days, index))
+        for index, (year, month) in enumerate(
+            zip(years.tolist(), month_numbers.tolist())
+        )
+    ]
+    return {"year": annual, "month": monthly, "season": seasonal}
+
+
+if __name__ == "__main__":
+    from utils import setup_flask_app, init_db
+
+    if sys.argv[1:] != ["refresh"]:
+        sys.exit(f"Usage: python {sys.argv[0]} refresh")
+
+    app = setup_flask_app()
+    directory = app.config.get("STATION_CACHE_DIR")
+    if not directory:
+        sys.exit("Set STATION_CACHE_DIR to the cache directory")
+    db = init_db(app)
+    with app.app_context():
+        with db.engine.connect() as connection:
+            rebuilt = refresh_stations(connection, directory)
+    print(f"Rebuilt {rebuilt} station cache files in {directory}")
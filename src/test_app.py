@@ -2,9 +2,22 @@
 It uses an in-memory SQLite database for faster testing.
 """
 
+import base64
+import json
+import tempfile
 import unittest
+import pyarrow as pa
 from utils import setup_flask_app, init_db
-from models import WeatherData, WeatherStats
+from models import (
+    DataGeneration,
+    StationVersion,
+    WeatherData,
+    WeatherRowCount,
+    WeatherStats,
+    WeatherStatsMonthly,
+    WeatherStatsPending,
+    WeatherStatsSeasonal,
+)
 from datetime import date
 
 
@@ -23,12 +36,32 @@ class TestApp(unittest.TestCase):
 
         # Import and register routes
         with self.app.app_context():
-            from app import get_weather, get_weather_stats
+            from app import (
+                aggregate_weather,
+                batch_weather,
+                export_weather,
+                get_weather,
+                get_weather_stats,
+            )
 
             self.app.add_url_rule("/api/weather", "get_weather", get_weather)
             self.app.add_url_rule(
                 "/api/weather/stats", "get_weather_stats", get_weather_stats
             )
+            self.app.add_url_rule(
+                "/api/weather/export", "export_weather", export_weather
+            )
+            self.app.add_url_rule(
+                "/api/weather/batch",
+                "batch_weather",
+                batch_weather,
+                methods=["POST"],
+            )
+            self.app.add_url_rule(
+                "/api/weather/aggregate",
+                "aggregate_weather",
+                aggregate_weather,
+            )
 
             self.db.create_all()
 
@@ -104,6 +137,513 @@ class TestApp(unittest.TestCase):
         data = response.get_json()
         self.assertEqual(len(data["items"]), 0)
 
+    def test_metrics(self):
+        """Test request and SQL metrics on /metrics"""
+        from metrics import instrument_app
+
+        instrument_app(self.app, self.db)
+        self.client.get("/api/weather?station_id=TEST001")
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        self.assertIn(
+            "http_request_duration_seconds_count{method=\"GET\","
+            "route=\"/api/weather\",status=\"200\"}",
+            body,
+        )
+        self.assertIn("http_response_size_bytes_bucket", body)
+        self.assertIn(
+            "db_query_duration_seconds_count{operation=\"SELECT\"}", body
+        )
+        self.assertIn("db_pool_checked_out", body)
+
+    def test_weather_stats_granularity(self):
+        """Test monthly and seasonal rollups on /api/weather/stats"""
+        with self.app.app_context():
+            self.db.session.add(
+                WeatherStatsMonthly(
+                    station_id="TEST001",
+                    year=2021,
+                    month=1,
+                    avg_max_temp=10.0,
+                    max_temp_days=31,
+                    min_temp_days=30,
+                    precipitation_days=0,
+                )
+            )
+            self.db.session.add(
+                WeatherStatsSeasonal(
+                    station_id="TEST001",
+                    year=2021,
+                    season="winter",
+                    avg_max_temp=9.0,
+                    max_temp_days=90,
+                    min_temp_days=88,
+                    precipitation_days=0,
+                )
+            )
+            self.db.session.commit()
+
+        response = self.client.get("/api/weather/stats?granularity=month")
+        self.assertEqual(response.status_code, 200)
+        (item,) = response.get_json()["items"]
+        self.assertEqual(item["month"], 1)
+        self.assertEqual(item["max_temp_days"], 31)
+        self.assertIsNone(item["total_precipitation"])
+
+        response = self.client.get(
+            "/api/weather/stats?granularity=season&format=arrow"
+        )
+        table = pa.ipc.open_stream(response.get_data()).read_all()
+        self.assertEqual(table.column("season").to_pylist(), ["winter"])
+
+        response = self.client.get("/api/weather/stats?granularity=week")
+        self.assertEqual(response.status_code, 400)
+
+    def test_weather_cursor_pagination(self):
+        """Test walking /api/weather pages with next_cursor"""
+        with self.app.app_context():
+            self.db.session.add(
+                WeatherData(
+                    station_id="TEST001",
+                    date=date(2021, 1, 2),
+                    max_temp=11.0,
+                    min_temp=6.0,
+                    precipitation=0.0,
+                )
+            )
+            self.db.session.commit()
+
+        response = self.client.get("/api/weather?per_page=1&cursor=")
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data["items"]), 1)
+        self.assertIsNotNone(data["next_cursor"])
+
+        response = self.client.get(
+            f"/api/weather?per_page=1&cursor={data['next_cursor']}"
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data["items"]), 1)
+        self.assertIn("2021", data["items"][0]["date"])
+        self.assertIsNone(data["next_cursor"])
+
+        response = self.client.get("/api/weather?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+        # Well-formed JSON with values of the wrong types
+        cursor = base64.urlsafe_b64encode(b'["TEST001", 5]').decode()
+        response = self.client.get(f"/api/weather?cursor={cursor}")
+        self.assertEqual(response.status_code, 400)
+
+        for url in ("/api/weather", "/api/weather/stats"):
+            for per_page in (0, -1):
+                response = self.client.get(
+                    f"{url}?cursor=&per_page={per_page}"
+                )
+                self.assertEqual(response.status_code, 400, (url, per_page))
+
+    def test_conditional_get(self):
+        """Test ETag revalidation and invalidation by the data generation"""
+        response = self.client.get("/api/weather/stats")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+
+        response = self.client.get(
+            "/api/weather/stats", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        with self.app.app_context():
+            stats = WeatherStats.query.first()
+            stats.avg_max_temp = 16.0
+            DataGeneration.bump(self.db.session)
+            self.db.session.commit()
+
+        response = self.client.get(
+            "/api/weather/stats", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["items"][0]["avg_max_temp"], 16.0)
+
+    def test_data_generation_bump(self):
+        """Test that bump() creates the generation row and increments it"""
+        with self.app.app_context():
+            self.db.session.query(DataGeneration).delete()
+            self.assertEqual(DataGeneration.current(self.db.session), 0)
+            DataGeneration.bump(self.db.session)
+            DataGeneration.bump(self.db.session)
+            self.db.session.commit()
+            self.assertEqual(DataGeneration.current(self.db.session), 2)
+
+    def test_weather_export(self):
+        """Test streaming weather data as NDJSON and CSV"""
+        response = self.client.get("/api/weather/export?station_id=TEST001")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["date"], "2021-01-01")
+
+        response = self.client.get(
+            "/api/weather/export?format=csv&start=2022-01-01"
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["id", "station_id", "date"])
+        self.assertEqual(len(lines), 1)
+
+        response = self.client.get("/api/weather/export?format=xml")
+        self.assertEqual(response.status_code, 400)
+
+    def test_weather_batch(self):
+        """Test fetching several stations in one batch request"""
+        with self.app.app_context():
+            self.db.session.add(
+                WeatherData(station_id="TEST002", date=date(2021, 1, 2))
+            )
+            self.db.session.commit()
+
+        response = self.client.post(
+            "/api/weather/batch",
+            json={
+                "station_ids": ["TEST002", "NONE", "TEST001"],
+                "start_date": "2021-01-01",
+                "end_date": "2021-12-31",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        stations = json.loads(response.get_data())["stations"]
+        self.assertEqual(stations["NONE"], [])
+        self.assertEqual(stations["TEST001"][0]["date"], "2021-01-01")
+        self.assertEqual(len(stations["TEST002"]), 1)
+
+        response = self.client.post(
+            "/api/weather/batch",
+            json={
+                "station_ids": ["TEST001", "TEST002"],
+                "dates": ["2021-01-02"],
+            },
+        )
+        stations = json.loads(response.get_data())["stations"]
+        self.assertEqual(list(stations), ["TEST002", "TEST001"])
+        self.assertEqual(stations["TEST001"], [])
+        self.assertEqual(stations["TEST002"][0]["date"], "2021-01-02")
+
+        self.app.config["BATCH_MAX_STATIONS"] = 1
+        for body in [
+            {"station_ids": ["TEST001", "TEST002"], "dates": ["2021-01-01"]},
+            {"station_ids": [], "dates": ["2021-01-01"]},
+            {"station_ids": ["TEST001"], "start_date": "2021-01-01"},
+            {
+                "station_ids": ["TEST001"],
+                "start_date": "2000-01-01",
+                "end_date": "2021-01-01",
+            },
+            {"station_ids": ["TEST001"], "start_date": 5, "end_date": 6},
+            {"station_ids": ["TEST001"], "dates": [20210101]},
+        ]:
+            response = self.client.post("/api/weather/batch", json=body)
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_weather_aggregate(self):
+        """Test aggregating weather data over a date range"""
+        self.app.config["RESPONSE_CACHE_MAX_ENTRIES"] = 0
+        response = self.client.get(
+            "/api/weather/aggregate?station_id=TEST001,NONE&start=2021-01-01"
+            "&end=2021-01-31&metrics=avg_max,min_min,count_precip"
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data["source"], "weather_data")
+        self.assertEqual(
+            data["stations"]["TEST001"],
+            {"avg_max": 10.0, "min_min": 5.0, "count_precip": 1},
+        )
+        self.assertEqual(
+            data["stations"]["NONE"],
+            {"avg_max": None, "min_min": None, "count_precip": 0},
+        )
+
+        # Whole years are computed from the monthly rollups, weighted by
+        # their valid days, once every month of them has a rollup
+        with self.app.app_context():
+            for month in range(1, 12):
+                avg_max_temp, days = {1: (10.0, 1), 2: (20.0, 3)}.get(
+                    month, (None, 0)
+                )
+                self.db.session.add(
+                    WeatherStatsMonthly(
+                        station_id="TEST001",
+                        year=2021,
+                        month=month,
+                        avg_max_temp=avg_max_temp,
+                        total_precipitation=1.5 if days else None,
+                        max_temp_days=days,
+                        precipitation_days=days,
+                    )
+                )
+            self.db.session.commit()
+        path = (
+            "/api/weather/aggregate?station_id=TEST001&start=2021-01-01"
+            "&end=2021-12-31&metrics=avg_max,sum_precip"
+        )
+        data = self.client.get(path).get_json()
+        self.assertEqual(data["source"], "weather_data")
+
+        with self.app.app_context():
+            self.db.session.add(
+                WeatherStatsMonthly(
+                    station_id="TEST001",
+                    year=2021,
+                    month=12,
+                    max_temp_days=0,
+                    precipitation_days=0,
+                )
+            )
+            self.db.session.commit()
+        data = self.client.get(path).get_json()
+        self.assertEqual(data["source"], "rollups")
+        self.assertEqual(
+            data["stations"]["TEST001"], {"avg_max": 17.5, "sum_precip": 3.0}
+        )
+
+        # Until analysis catches up with new rows, weather_data is scanned
+        with self.app.app_context():
+            self.db.session.add(
+                WeatherStatsPending(station_id="TEST001", year=2021)
+            )
+            self.db.session.commit()
+        data = self.client.get(path).get_json()
+        self.assertEqual(data["source"], "weather_data")
+        self.assertEqual(data["stations"]["TEST001"]["avg_max"], 10.0)
+
+        for query in [
+            "station_id=TEST001&start=2021-01-01&end=2021-12-31",
+            "station_id=TEST001&start=2021-01-01&end=2021-12-31&metrics=x",
+            "station_id=TEST001&start=2021-12-31&end=2021-01-01"
+            "&metrics=avg_max",
+            "start=2021-01-01&end=2021-12-31&metrics=avg_max",
+        ]:
+            response = self.client.get(f"/api/weather/aggregate?{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_request_profiling(self):
+        """Test profiling a request and logging slow requests"""
+        from profiling import instrument_profiling
+
+        instrument_profiling(self.app, self.db)
+        self.app.config.update(
+            PROFILING_ENABLED=True, PROFILING_TOKEN="secret"
+        )
+        # Fills the response cache, which profiled requests bypass
+        response = self.client.get(
+            "/api/weather?station_id=TEST001", headers={"X-Profile": "x"}
+        )
+        self.assertNotIn("Server-Timing", response.headers)
+
+        with self.assertLogs("profile") as logs:
+            response = self.client.get(
+                "/api/weather?station_id=TEST001",
+                headers={"X-Profile": "secret", "X-Profile-Mode": "cprofile"},
+            )
+            response.close()
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["path"], "/api/weather?station_id=TEST001")
+        statements = record["statements"]
+        self.assertTrue(
+            any("count(" in item["statement"] for item in statements)
+        )
+        timing = response.headers["Server-Timing"]
+        self.assertIn(f'desc="{len(statements)} statements"', timing)
+        self.assertIn("serialize;dur=", timing)
+        self.assertIn("cumulative", record["cprofile"])
+        # Not replayed from the cache, which would have set an ETag
+        self.assertNotIn("ETag", response.headers)
+
+        self.app.config.update(PROFILING_ENABLED=False, SLOW_REQUEST_MS=0)
+        with self.assertLogs("slow_requests") as logs:
+            response = self.client.get("/api/weather/export")
+            response.get_data()
+            response.close()
+        self.assertNotIn("Server-Timing", response.headers)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertIn("weather_data", record["statements"][0]["plan"])
+
+    def test_weather_arrow(self):
+        """Test the Arrow IPC response format"""
+        response = self.client.get(
+            "/api/weather",
+            headers={"Accept": "application/vnd.apache.arrow.stream"},
+        )
+        self.assertEqual(response.status_code, 200)
+        table = pa.ipc.open_stream(response.get_data()).read_all()
+        self.assertEqual(table.column("station_id").to_pylist(), ["TEST001"])
+        self.assertEqual(table.column("date").to_pylist(), [date(2021, 1, 1)])
+        pagination = json.loads(table.schema.metadata[b"pagination"])
+        self.assertEqual(pagination["total"], 1)
+
+        response = self.client.get("/api/weather/stats?format=arrow&year=2022")
+        self.assertEqual(response.status_code, 200)
+        table = pa.ipc.open_stream(response.get_data()).read_all()
+        self.assertEqual(table.num_rows, 0)
+
+    def test_weather_date_range(self):
+        """Test date range and multi-station filters on /api/weather"""
+        with self.app.app_context():
+            self.db.session.add(
+                WeatherData(
+                    station_id="TEST002",
+                    date=date(2021, 2, 1),
+                    max_temp=12.0,
+                    min_temp=4.0,
+                    precipitation=1.0,
+                )
+            )
+            self.db.session.commit()
+
+        response = self.client.get(
+            "/api/weather?start_date=2021-01-15&end_date=2021-02-01"
+        )
+        self.assertEqual(response.status_code, 200)
+        items = response.get_json()["items"]
+        self.assertEqual([item["station_id"] for item in items], ["TEST002"])
+
+        response = self.client.get("/api/weather?station_id=TEST001,TEST002")
+        self.assertEqual(response.get_json()["total"], 2)
+
+        response = self.client.get("/api/weather?start_date=2021-13-01")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/api/weather?date=2021-02-01")
+        items = response.get_json()["items"]
+        self.assertEqual([item["station_id"] for item in items], ["TEST002"])
+        response = self.client.get("/api/weather?date=2021-02-30")
+        self.assertEqual(response.status_code, 400)
+
+    def explain(self, url):
+        """Return SQLite's query plan for the /api/weather filters of url"""
+        from app import weather_filters
+
+        with self.app.test_request_context(url):
+            statement = WeatherData.query.filter(*weather_filters()).statement
+            sql = statement.compile(
+                dialect=self.db.engine.dialect,
+                compile_kwargs={"literal_binds": True},
+            )
+            rows = self.db.session.execute(
+                self.db.text(f"EXPLAIN QUERY PLAN {sql}")
+            )
+            return " ".join(row[-1] for row in rows)
+
+    def test_weather_filters_use_indexes(self):
+        """Test that common filter shapes are answered by index searches"""
+        with self.app.app_context():
+            plan = self.explain(
+                "/api/weather?station_id=TEST001"
+                "&start_date=2021-01-01&end_date=2021-03-31"
+            )
+            self.assertIn("USING INDEX uix_station_date", plan)
+
+            plan = self.explain(
+                "/api/weather?station_id=TEST001,TEST002"
+                "&start_date=2021-01-01"
+            )
+            self.assertIn("USING INDEX uix_station_date", plan)
+
+            plan = self.explain(
+                "/api/weather?start_date=2021-01-01&end_date=2021-03-31"
+            )
+            self.assertIn("USING INDEX ix_weather_date_station", plan)
+
+    def test_weather_count_modes(self):
+        """Test count=none and count=estimate on /api/weather"""
+        response = self.client.get("/api/weather?count=none")
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data["items"]), 1)
+        self.assertIsNone(data["total"])
+        self.assertIsNone(data["pages"])
+
+        with self.app.app_context():
+            self.db.session.add(
+                WeatherRowCount(station_id="TEST001", year=2021, row_count=365)
+            )
+            self.db.session.commit()
+
+        response = self.client.get("/api/weather?count=estimate")
+        self.assertEqual(response.get_json()["total"], 365)
+
+        response = self.client.get(
+            "/api/weather?count=estimate&station_id=TEST001"
+            "&start_date=2021-01-01&end_date=2021-01-31"
+        )
+        self.assertEqual(response.get_json()["total"], 31)
+
+        response = self.client.get("/api/weather?count=approximate")
+        self.assertEqual(response.status_code, 400)
+
+    def test_weather_station_cache(self):
+        """Test serving /api/weather from the station cache"""
+        from station_cache import build_station
+
+        self.app.config["RESPONSE_CACHE_MAX_ENTRIES"] = 0
+        with self.app.app_context():
+            for day in range(2, 6):
+                self.db.session.add(
+                    WeatherData(
+                        station_id="TEST001",
+                        date=date(2021, 1, day),
+                        max_temp=day + 0.1,
+                        min_temp=None,
+                        precipitation=0.3,
+                    )
+                )
+            self.db.session.add(
+                WeatherRowCount(station_id="TEST001", year=2021, row_count=5)
+            )
+            self.db.session.commit()
+            directory = tempfile.mkdtemp()
+            with self.db.engine.connect() as connection:
+                build_station(connection, directory, "TEST001")
+
+        queries = [
+            "station_id=TEST001",
+            "station_id=TEST001&per_page=2&page=2",
+            "station_id=TEST001&start_date=2021-01-02&end_date=2021-01-04",
+            "station_id=TEST001&date=2021-01-03",
+            "station_id=TEST001&per_page=2&cursor=",
+        ]
+        for query in queries:
+            self.app.config["STATION_CACHE_DIR"] = None
+            expected = self.client.get(f"/api/weather?{query}").get_json()
+            self.app.config["STATION_CACHE_DIR"] = directory
+            cached = self.client.get(f"/api/weather?{query}").get_json()
+            self.assertEqual(cached, expected, query)
+
+        cursor = cached["next_cursor"]
+        response = self.client.get(
+            f"/api/weather?station_id=TEST001&per_page=2&cursor={cursor}"
+        )
+        self.assertEqual(
+            [item["max_temp"] for item in response.get_json()["items"]],
+            [3.1, 4.1],
+        )
+
+        # A station whose rows changed since its file was built is served
+        # from the database, even when its row count is the same
+        with self.app.app_context():
+            self.db.session.query(WeatherData).filter_by(
+                date=date(2021, 1, 2)
+            ).update({"max_temp": 9.9})
+            StationVersion.bump(self.db.session, {"TEST001"})
+            self.db.session.commit()
+        response = self.client.get("/api/weather?station_id=TEST001")
+        self.assertEqual(response.get_json()["items"][1]["max_temp"], 9.9)
+
 
 if __name__ == "__main__":
     unittest.main()
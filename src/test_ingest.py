@@ -0,0 +1,234 @@
+"""This module contains unit tests for the ingestion helpers.
+Database tests use an in-memory SQLite database.
+"""
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from datetime import date
+from types import SimpleNamespace
+
+from ingest import (
+    archive_members,
+    chunk_years,
+    file_state,
+    ingest_archive,
+    ingest_file,
+    insert_rows,
+    line_chunks,
+    plan_file,
+)
+from models import (
+    IngestManifest,
+    WeatherData,
+    WeatherRowCount,
+    WeatherStatsPending,
+)
+from utils import setup_flask_app, init_db
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        """Set up an app bound to an empty in-memory database."""
+        self.app = setup_flask_app()
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.db = init_db(self.app)
+        with self.app.app_context():
+            self.db.create_all()
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Drop every table."""
+        with self.app.app_context():
+            self.db.session.remove()
+            self.db.drop_all()
+        shutil.rmtree(self.data_dir)
+
+    def test_insert_rows(self):
+        """Test that every row of a file reaches weather_data"""
+        rows = [(date(2021, 1, day), day / 10, None, 0.0) for day in (1, 2)]
+        rows.append((date(2022, 1, 1), 1.0, -1.0, None))
+        with self.app.app_context():
+            records, new_counts = insert_rows(rows, "USC001.txt")
+            self.db.session.commit()
+            stored = self.db.session.query(
+                WeatherData.station_id, WeatherData.date
+            ).all()
+
+        self.assertEqual(records, 3)
+        self.assertEqual(
+            new_counts, {("USC001", 2021): 2, ("USC001", 2022): 1}
+        )
+        self.assertEqual(
+            sorted(stored),
+            [("USC001", row[0]) for row in rows],
+        )
+
+    def write_file(self, name: str, data: bytes) -> str:
+        """Write a weather file into the test's data directory."""
+        path = os.path.join(self.data_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_file_state(self):
+        """Test that a trailing partial line is left for the next run"""
+        path = self.write_file(
+            "USC001.txt", b"20210101\t10\t5\t0\n20210102\t11\t6"
+        )
+        state = file_state(path)
+        self.assertEqual(state["size"], os.path.getsize(path))
+        self.assertEqual(state["ingested_bytes"], 16)
+        self.assertEqual(state["last_date"], date(2021, 1, 1))
+
+    def test_plan_file(self):
+        """Test skipping unchanged, appended and modified files"""
+        path = self.write_file("USC001.txt", b"20210101\t10\t5\t0\n")
+        self.assertEqual(plan_file(path, None), 0)
+        entry = SimpleNamespace(**file_state(path))
+        self.assertIsNone(plan_file(path, entry))
+
+        self.write_file(
+            "USC001.txt", b"20210101\t10\t5\t0\n20210102\t11\t6\t0\n"
+        )
+        self.assertEqual(plan_file(path, entry), entry.ingested_bytes)
+
+        # Same size, so only the mtime tells the edit apart
+        self.write_file("USC001.txt", b"20210101\t99\t5\t0\n")
+        os.utime(path, (entry.mtime + 1, entry.mtime + 1))
+        self.assertEqual(plan_file(path, entry), 0)
+
+    def test_reload_modified_file(self):
+        """Test that re-ingesting a modified file replaces its rows"""
+        self.write_file(
+            "USC001.txt", b"20210101\t10\t5\t0\n20210102\t11\t6\t0\n"
+        )
+        with self.app.app_context():
+            ingest_file(self.data_dir, "USC001.txt")
+            entry = self.db.session.query(IngestManifest).one()
+
+            path = self.write_file("USC001.txt", b"20210101\t99\t5\t0\n")
+            os.utime(path, (entry.mtime + 1, entry.mtime + 1))
+            self.assertEqual(plan_file(path, entry), 0)
+            records, new_records = ingest_file(
+                self.data_dir, "USC001.txt", reload=True
+            )
+            stored = self.db.session.query(
+                WeatherData.date, WeatherData.max_temp
+            ).all()
+            row_count = self.db.session.query(WeatherRowCount.row_count)
+
+            self.assertEqual((records, new_records), (1, 1))
+            self.assertEqual(stored, [(date(2021, 1, 1), 9.9)])
+            self.assertEqual(row_count.scalar(), 1)
+
+    def test_reload_queues_removed_years(self):
+        """Test that years dropped from a reloaded file are re-analysed"""
+        self.write_file(
+            "USC001.txt", b"20201231\t10\t5\t0\n20210101\t11\t6\t0\n"
+        )
+        with self.app.app_context():
+            ingest_file(self.data_dir, "USC001.txt")
+            self.db.session.query(WeatherStatsPending).delete()
+            self.db.session.commit()
+
+            self.write_file("USC001.txt", b"20210101\t11\t6\t0\n")
+            ingest_file(self.data_dir, "USC001.txt", reload=True)
+            pending = self.db.session.query(
+                WeatherStatsPending.station_id, WeatherStatsPending.year
+            ).all()
+
+        self.assertEqual(sorted(pending), [("USC001", 2020), ("USC001", 2021)])
+
+    def test_archive_members(self):
+        """Test reading the files of tar and zip archives"""
+        members = {
+            "USC001.txt": b"20210101\t10\t5\t0\n",
+            "USC002.txt": b"20210101\t20\t15\t0\n",
+        }
+        tar_path = os.path.join(self.data_dir, "stations.tar.gz")
+        with tarfile.open(tar_path, "w:gz") as archive:
+            directory = tarfile.TarInfo("wx_data")
+            directory.type = tarfile.DIRTYPE
+            archive.addfile(directory)
+            for name, data in [("._USC001.txt", b"\0")] + list(
+                members.items()
+            ):
+                info = tarfile.TarInfo(f"wx_data/{name}")
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        zip_path = os.path.join(self.data_dir, "stations.zip")
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            archive.writestr("wx_data/", b"")
+            archive.writestr("wx_data/._USC001.txt", b"\0")
+            for name, data in members.items():
+                archive.writestr(f"wx_data/{name}", data)
+
+        for path in (tar_path, zip_path):
+            found = {
+                name: member.read()
+                for name, member in archive_members(path)
+            }
+            self.assertEqual(found, members, path)
+
+    def test_line_chunks(self):
+        """Test that chunks end on line boundaries"""
+        lines = [b"20210101\t10\t5\t0\n", b"20210102\t11\t6\t0\n"]
+        data = b"".join(lines) + b"20210103\t12\t7\t0"
+        chunks = list(line_chunks(io.BytesIO(data), size=8))
+
+        self.assertEqual(b"".join(chunks), data)
+        self.assertEqual(chunks[:2], lines)
+        self.assertEqual(chunks[2], b"20210103\t12\t7\t0")
+
+        # Trailing whitespace after the last newline is not a row
+        chunks = list(line_chunks(io.BytesIO(lines[0] + b"  "), size=8))
+        self.assertEqual(chunks, [lines[0]])
+
+    def test_chunk_years(self):
+        """Test collecting the years of blocks as they are read"""
+        chunks = [b"19991231\t1\t1\t0\n", b"20000101\t1\t1\t0\n"]
+        years = set()
+        self.assertEqual(list(chunk_years(iter(chunks), years)), chunks)
+        self.assertEqual(years, {1999, 2000})
+
+    def test_ingest_archive(self):
+        """Test loading an archive's members and recording it once"""
+        path = os.path.join(self.data_dir, "stations.tar.gz")
+        with tarfile.open(path, "w:gz") as archive:
+            for name in ("USC001.txt", "USC002.txt"):
+                data = b"20210101\t10\t5\t0\n20220101\t11\t6\t0\n"
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        with tarfile.open(
+            os.path.join(self.data_dir, "empty.tar.gz"), "w:gz"
+        ):
+            pass
+
+        with self.app.app_context():
+            self.assertEqual(
+                ingest_archive(self.data_dir, "stations.tar.gz", bulk=False),
+                (4, 4),
+            )
+            # Nothing is staged, so there is no batch to merge
+            self.assertEqual(
+                ingest_archive(self.data_dir, "empty.tar.gz", bulk=True),
+                (0, 0),
+            )
+            stored = self.db.session.query(WeatherData).count()
+            recorded = self.db.session.query(IngestManifest.file_name)
+
+            self.assertEqual(stored, 4)
+            self.assertEqual(
+                sorted(name for name, in recorded),
+                ["empty.tar.gz", "stations.tar.gz"],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
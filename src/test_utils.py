@@ -0,0 +1,123 @@
+"""This module contains unit tests for the logging helpers in utils."""
+
+import io
+import logging
+import os
+import queue
+import threading
+import unittest
+from unittest import mock
+
+from utils import (
+    BatchedStreamHandler,
+    ErrorSampler,
+    LogWriter,
+    setup_queue_logging,
+)
+
+
+class FlushCountingStream(io.StringIO):
+    """StringIO that counts how often it is flushed."""
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+        super().flush()
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        """Set up a logger that records to a counting stream."""
+        self.stream = FlushCountingStream()
+        self.handler = BatchedStreamHandler(self.stream)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger = logging.getLogger(f"test_utils.{self.id()}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        """Detach the logger's handlers."""
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+        self.handler.close()
+
+    def test_error_sampler(self):
+        """Test that only LOG_ERROR_SAMPLE errors are logged"""
+        with mock.patch.dict(os.environ, {"LOG_ERROR_SAMPLE": "2"}):
+            sampler = ErrorSampler(self.logger, "USC001.txt")
+        with self.assertLogs(self.logger, logging.ERROR) as logs:
+            for i in range(5):
+                sampler.error(f"bad row {i}")
+            sampler.summary()
+
+        self.assertEqual(
+            [record.getMessage() for record in logs.records],
+            [
+                "bad row 0",
+                "bad row 1",
+                "5 errors in USC001.txt (3 not logged)",
+            ],
+        )
+
+    def test_error_sampler_summary_under_limit(self):
+        """Test that summary() stays quiet when every error was logged"""
+        with mock.patch.dict(os.environ, {"LOG_ERROR_SAMPLE": "2"}):
+            sampler = ErrorSampler(self.logger, "USC001.txt")
+        with self.assertLogs(self.logger, logging.ERROR) as logs:
+            sampler.error("bad row 0")
+            sampler.summary()
+
+        self.assertEqual(
+            [record.getMessage() for record in logs.records], ["bad row 0"]
+        )
+
+    def test_log_writer_stop(self):
+        """Test that stop() writes and flushes the queued records"""
+        # Only the writer flushes, once per batch of records
+        self.handler.flush()
+        self.assertEqual(self.stream.flushes, 0)
+
+        records = queue.SimpleQueue()
+        for i in range(3):
+            records.put(
+                logging.makeLogRecord(
+                    {"msg": f"record {i}", "levelno": logging.INFO}
+                )
+            )
+        writer = LogWriter(records, [self.handler])
+        writer.start()
+        writer.stop()
+
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(
+            self.stream.getvalue(), "record 0\nrecord 1\nrecord 2\n"
+        )
+        self.assertGreaterEqual(self.stream.flushes, 1)
+
+    def test_setup_queue_logging(self):
+        """Test that records reach the handlers once the writer stops"""
+        setup_queue_logging(self.logger, [self.handler])
+        queue_handler = self.logger.handlers[0]
+        writer = next(
+            thread
+            for thread in threading.enumerate()
+            if isinstance(thread, LogWriter)
+            and thread.records is queue_handler.queue
+        )
+        for i in range(3):
+            self.logger.info(f"record {i}")
+        self.logger.debug("below the handler's level")
+        writer.stop()
+
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(
+            self.stream.getvalue(), "record 0\nrecord 1\nrecord 2\n"
+        )
+        self.assertGreaterEqual(self.stream.flushes, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""This module contains unit tests for the vectorized wx_data parser."""
+
+import unittest
+from datetime import date
+
+from wx_parser import parse_wx_bytes, to_copy_text, to_rows
+
+
+class TestWxParser(unittest.TestCase):
+    def test_parse_columns(self):
+        """Test date decoding, tenths scaling and sentinel masking"""
+        columns = parse_wx_bytes(
+            b"20210101\t105\t-9999\t20\n20200229\t-3\t-50\t0\n"
+        )
+        self.assertEqual(
+            list(to_rows(columns)),
+            [
+                (date(2021, 1, 1), 10.5, None, 2.0),
+                (date(2020, 2, 29), -0.3, -5.0, 0.0),
+            ],
+        )
+
+    def test_copy_text(self):
+        """Test rendering columns in COPY text format"""
+        columns = parse_wx_bytes(b"20210101\t105\t-9999\t20\n")
+        self.assertEqual(
+            to_copy_text(columns, "TEST001"),
+            "TEST001\t2021-01-01\t10.5\t\\N\t2.0\n",
+        )
+
+    def test_malformed_rows(self):
+        """Test that malformed data is rejected so callers can fall back"""
+        for data in [
+            b"20210230\t1\t1\t1\n",
+            b"2021x101\t1\t1\t1\n",
+            b"20210101\t1\t1\n",
+        ]:
+            with self.assertRaises(ValueError):
+                parse_wx_bytes(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
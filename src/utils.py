@@ -1,15 +1,194 @@
+import atexit
 import logging
+import multiprocessing.util
 import os
+import queue
+import threading
+from logging.handlers import QueueHandler
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
 from flask import Flask
 
+# Most records a background writer handles before flushing its handlers
+LOG_BATCH_SIZE = 512
 
-def setup_logger(log_file):
+
+class DeferredFlushMixin:
+    """
+    Handler mixin that skips the flush after every record; the log
+    writer calls flush_batch() once per batch instead.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        # Like emit(), never let a broken stream take the writer down
+        try:
+            super().flush()
+        except (OSError, ValueError):
+            pass
+
+
+class BatchedFileHandler(DeferredFlushMixin, logging.FileHandler):
+    """FileHandler flushed once per batch of records."""
+
+
+class BatchedStreamHandler(DeferredFlushMixin, logging.StreamHandler):
+    """StreamHandler flushed once per batch of records."""
+
+
+class InProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler for a queue consumed in the same process: records are
+    queued as they are, leaving all formatting to the writer thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class LogWriter(threading.Thread):
+    """
+    Background thread writing queued log records to the real handlers.
+
+    Callers only pay for putting a record on the queue. The writer takes
+    every record that is waiting (up to LOG_BATCH_SIZE), writes them and
+    then flushes each handler once.
+    """
+
+    def __init__(self, records: queue.SimpleQueue, handlers: List):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.handlers = handlers
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            try:
+                while len(batch) < LOG_BATCH_SIZE:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+
+            for record in batch:
+                if record is None:
+                    continue
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                handler.flush_batch()
+            if None in batch:
+                return
+
+    def stop(self):
+        """Write the records still queued and stop the thread."""
+        if self.is_alive():
+            self.records.put(None)
+            self.join()
+
+
+def start_log_writer(
+    queue_handler: QueueHandler, handlers: List
+) -> LogWriter:
+    """
+    Start a writer for a queue handler's records, stopped (after writing
+    what is left) when the process exits.
+    """
+    queue_handler.queue = queue.SimpleQueue()
+    writer = LogWriter(queue_handler.queue, handlers)
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
+
+
+def setup_queue_logging(logger: logging.Logger, handlers: List) -> None:
+    """
+    Route a logger's records through a queue to a background LogWriter.
+
+    Forked children (ingest worker processes) start their own writer,
+    since threads do not survive a fork; multiprocessing workers exit
+    without running atexit hooks, so they stop it through a finalizer.
+    """
+    queue_handler = InProcessQueueHandler(queue.SimpleQueue())
+    queue_handler.setLevel(logging.INFO)
+    start_log_writer(queue_handler, handlers)
+    logger.addHandler(queue_handler)
+
+    def flush_before_fork():
+        # Buffered records would otherwise be written again by the child;
+        # the locks are held until the fork is done
+        for handler in handlers:
+            handler.acquire()
+            handler.flush_batch()
+
+    def release_in_parent():
+        for handler in handlers:
+            handler.release()
+
+    def restart_in_child():
+        # logging has already re-initialized the handler locks here
+        writer = start_log_writer(queue_handler, handlers)
+        multiprocessing.util.Finalize(None, writer.stop, exitpriority=0)
+
+    os.register_at_fork(
+        before=flush_before_fork,
+        after_in_parent=release_in_parent,
+        after_in_child=restart_in_child,
+    )
+
+
+class ErrorSampler:
+    """
+    Log the first few errors of a scope (e.g. the bad rows of one file)
+    and only count the rest, so a badly broken input cannot flood the
+    log. summary() reports how many errors there were in total.
+
+    The limit comes from LOG_ERROR_SAMPLE (default 10; 0 logs none).
+    """
+
+    def __init__(self, logger: logging.Logger, scope: str):
+        self.logger = logger
+        self.scope = scope
+        self.limit = int(os.getenv("LOG_ERROR_SAMPLE", "10"))
+        self.count = 0
+
+    def error(self, message: str) -> None:
+        """Count an error and log it if the scope is under the limit."""
+        self.count += 1
+        if self.count <= self.limit:
+            self.logger.error(message)
+
+    def summary(self) -> None:
+        """Log the total number of errors if some were not logged."""
+        if self.count > self.limit:
+            self.logger.error(
+                f"{self.count} errors in {self.scope} "
+                f"({self.count - self.limit} not logged)"
+            )
+
+
+def setup_logger(log_file, name=None, console=True):
     """
     Set up a logger that writes to both a file and the console.
     This function creates a logs directory if it doesn't exist and
     configures the logger.
+
+    By default records are handed to a background writer thread that
+    writes and flushes them in batches, so logging never blocks the
+    caller on I/O. Set LOG_MODE=sync to write each record synchronously.
+
+    Args:
+        log_file: File name in the logs directory
+        name: Name of a separate logger (e.g. for a dedicated log file)
+            that doesn't propagate to the shared application logger
+        console: Whether to also write the records to the console
     """
+    # LOG_MODE may come from .env
+    load_config()
+
     # Create logs directory if it doesn't exist
     logs_dir = os.path.join(
         os.path.dirname(os.path.dirname(__file__)), "logs"
@@ -19,17 +198,27 @@ def setup_logger(log_file):
     # Use the log_file name directly without timestamp
     log_path = os.path.join(logs_dir, log_file)
 
-    logger = logging.getLogger(__name__)
+    logger = logging.getLogger(name or __name__)
     logger.setLevel(logging.INFO)
+    if name:
+        logger.propagate = False
 
     # Check if logger already has handlers to avoid duplicate logging
     if not logger.handlers:
+        queued = os.getenv("LOG_MODE", "queue").lower() != "sync"
+
         # File handler
-        file_handler = logging.FileHandler(log_path)
+        file_handler = (
+            BatchedFileHandler(log_path)
+            if queued
+            else logging.FileHandler(log_path)
+        )
         file_handler.setLevel(logging.INFO)
 
         # Console handler
-        console_handler = logging.StreamHandler()
+        console_handler = (
+            BatchedStreamHandler() if queued else logging.StreamHandler()
+        )
         console_handler.setLevel(logging.INFO)
 
         # Formatter
@@ -40,31 +229,57 @@ def setup_logger(log_file):
         console_handler.setFormatter(formatter)
 
         # Add handlers to logger
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        handlers = [file_handler]
+        if console:
+            handlers.append(console_handler)
+        if queued:
+            setup_queue_logging(logger, handlers)
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
 
     return logger
 
 
-def setup_flask_app():
+@lru_cache(maxsize=None)
+def load_config() -> Dict[str, Any]:
     """
-    Set up and configure the Flask application.
-    This function loads environment variables, constructs the DATABASE_URL,
-    and configures the Flask app with the database URI.
+    Load the configuration shared by the app and the CLI scripts.
+
+    The .env file is read once per process; every later call returns the
+    same settings.
     """
     # Load environment variables
     load_dotenv(override=True)
 
     # Construct the DATABASE_URL
-    DATABASE_URL = f"postgresql://{os.getenv('POSTGRES_USER')}:"
-    f"{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST')}:"
-    f"{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
-    print(f"Constructed DATABASE_URL: {DATABASE_URL}")
+    database_url = (
+        f"postgresql://{os.getenv('POSTGRES_USER')}:"
+        f"{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST')}:"
+        f"{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
+    )
+    return {
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        # Directory of the station cache (station_cache.py); off if unset
+        "STATION_CACHE_DIR": os.getenv("STATION_CACHE_DIR"),
+        # Per-request profiling and the slow-request log (profiling.py)
+        "PROFILING_ENABLED": os.getenv("PROFILING_ENABLED", "").lower()
+        in ("1", "true", "yes"),
+        "PROFILING_TOKEN": os.getenv("PROFILING_TOKEN"),
+        "SLOW_REQUEST_MS": os.getenv("SLOW_REQUEST_MS"),
+    }
+
 
+def setup_flask_app():
+    """
+    Set up and configure the Flask application.
+    This function configures the Flask app with the database URI from
+    load_config().
+    """
     # Create and configure Flask app
     app = Flask(__name__)
-    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.from_mapping(load_config())
 
     if not app.config["SQLALCHEMY_DATABASE_URI"]:
         raise ValueError("DATABASE_URL is not set correctly")
@@ -83,5 +298,21 @@ def init_db(app):
     return db
 
 
+def create_db_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    """
+    Create a Flask app bound to the database. The API builds on it, and
+    the ingest and analysis jobs create one when they start rather than
+    when they are imported.
+
+    Args:
+        config: Settings overriding the ones from load_config()
+    """
+    app = setup_flask_app()
+    if config:
+        app.config.update(config)
+    init_db(app)
+    return app
+
+
 # Example usage in other files:
 # logger = setup_logger("flask_app.log")
@@ -0,0 +1,151 @@
+"""Vectorized parser for wx_data station files.
+
+Each file is decoded in one pass into typed NumPy column arrays instead of
+converting row by row with csv.reader and datetime.strptime. Dates are
+decoded from their integer YYYYMMDD form, the -9999 sentinel is masked to
+NaN (stored as NULL) and tenths are scaled to degrees/mm in bulk.
+"""
+
+import warnings
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from datetime import date
+
+import numpy as np
+
+# Value used in the raw files for a missing measurement
+SENTINEL = -9999
+
+# Fields per row: date, max temp, min temp, precipitation
+FIELDS = 4
+
+
+class WxColumns(NamedTuple):
+    """
+    Column arrays for one station file.
+    Missing measurements are NaN in the float columns.
+    """
+
+    date: np.ndarray  # datetime64[D]
+    max_temp: np.ndarray  # float64, degrees Celsius
+    min_temp: np.ndarray  # float64, degrees Celsius
+    precipitation: np.ndarray  # float64, millimetres
+
+
+def _decode_dates(raw: np.ndarray) -> np.ndarray:
+    """
+    Decode integer YYYYMMDD values into datetime64[D].
+
+    Raises:
+        ValueError: If any value is not a valid calendar date
+    """
+    year = raw // 10000
+    month = raw // 100 % 100
+    day = raw % 100
+    if ((month < 1) | (month > 12) | (day < 1) | (day > 31)).any():
+        raise ValueError("invalid month or day in date column")
+
+    months = (year - 1970) * 12 + (month - 1)
+    dates = months.astype("datetime64[M]").astype("datetime64[D]") + (
+        day - 1
+    )
+
+    # Days past the end of the month roll over into the next one
+    if (dates.astype("datetime64[M]").astype(np.int64) != months).any():
+        raise ValueError("invalid day of month in date column")
+    return dates
+
+
+def _tenths(raw: np.ndarray) -> np.ndarray:
+    """Scale tenths to units, turning the sentinel into NaN."""
+    values = raw / 10
+    values[raw == SENTINEL] = np.nan
+    return values
+
+
+def parse_wx_bytes(data: bytes) -> WxColumns:
+    """
+    Parse the contents of a wx_data file into column arrays.
+
+    Args:
+        data: Raw file contents (tab-separated, one row per line)
+
+    Returns:
+        WxColumns for every row in the data
+
+    Raises:
+        ValueError: If any row is malformed; callers can fall back to the
+            row-by-row parser to find and report the bad rows
+    """
+    lines = data.count(b"\n") + (0 if data.endswith(b"\n") or not data else 1)
+    if data.count(b"\t") != lines * (FIELDS - 1):
+        raise ValueError(f"expected {FIELDS} fields on every row")
+
+    with warnings.catch_warnings():
+        # NumPy only warns when it stops at a non-numeric token
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(data, dtype=np.int64, sep=" ")
+        except DeprecationWarning:
+            raise ValueError("non-numeric value in data")
+
+    if values.size != lines * FIELDS:
+        raise ValueError(f"expected {FIELDS} fields on every row")
+
+    raw = values.reshape(-1, FIELDS)
+    return WxColumns(
+        date=_decode_dates(raw[:, 0]),
+        max_temp=_tenths(raw[:, 1]),
+        min_temp=_tenths(raw[:, 2]),
+        precipitation=_tenths(raw[:, 3]),
+    )
+
+
+def _nullable(values: np.ndarray) -> List[Optional[float]]:
+    """Convert a float column to Python values with NaN as None."""
+    return [None if v != v else v for v in values.tolist()]
+
+
+def to_rows(
+    columns: WxColumns,
+) -> Iterator[Tuple[date, Optional[float], Optional[float], Optional[float]]]:
+    """
+    Iterate over parsed columns as (date, max_temp, min_temp,
+    precipitation) tuples, matching ingest.parse_row.
+    """
+    return zip(
+        columns.date.tolist(),
+        _nullable(columns.max_temp),
+        _nullable(columns.min_temp),
+        _nullable(columns.precipitation),
+    )
+
+
+def _copy_column(values: np.ndarray) -> np.ndarray:
+    """Format a float column for COPY text format, NaN as NULL."""
+    return np.where(np.isnan(values), "\\N", np.char.mod("%.1f", values))
+
+
+def to_copy_text(columns: WxColumns, station_id: str) -> str:
+    """
+    Render parsed columns in PostgreSQL COPY text format.
+
+    Args:
+        columns: Parsed columns for one station file
+        station_id: Station ID written in the first column
+
+    Returns:
+        Tab-separated lines for station_id, date, max_temp, min_temp and
+        precipitation
+    """
+    if not len(columns.date):
+        return ""
+    fields = [
+        np.datetime_as_string(columns.date).tolist(),
+        _copy_column(columns.max_temp).tolist(),
+        _copy_column(columns.min_temp).tolist(),
+        _copy_column(columns.precipitation).tolist(),
+    ]
+    prefix = f"{station_id}\t"
+    return (
+        "\n".join(prefix + "\t".join(row) for row in zip(*fields)) + "\n"
+    )